@@ -0,0 +1,48 @@
+"""Throughput of ``Runner.map`` for a filter + encode script as the number of
+worker processes grows.
+
+    python -m benchmarks.batch [items]
+"""
+from io import BytesIO
+
+import os
+import sys
+import time
+
+from PIL import Image
+
+from fstop import Runner
+
+SCRIPT = '''
+OPEN STREAM 0 AS img
+MEDIAN_FILTER img 5
+SHARPEN img
+RESIZE img (800, 600)
+SAVE img STREAM "JPEG"
+'''
+
+def synthetic(size=(1600, 1200)) -> bytes:
+    buffer = BytesIO()
+    Image.effect_mandelbrot(size, (-2, -1.5, 1, 1.5), 100).convert('RGB').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def main(items: int = 64) -> None:
+    inputs = [synthetic()] * items
+    runner = Runner()
+    baseline = None
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        list(runner.map(SCRIPT, inputs[:workers], workers=workers))  # spawn and warm the pool
+        start = time.perf_counter()
+        results = list(runner.map(SCRIPT, inputs, workers=workers))
+        elapsed = time.perf_counter() - start
+        assert all(r.ok for r in results)
+
+        rate = items / elapsed
+        baseline = baseline or rate
+        print('%2d workers: %7.1f items/s  (x%.2f)' % (workers, rate, rate / baseline))
+        workers *= 2
+    runner.close()
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
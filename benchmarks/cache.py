@@ -0,0 +1,54 @@
+"""Time of a request run without a result cache, with a cold one, repeated
+from memory and from disk, and with only its last statement changed.
+
+    python -m benchmarks.cache [side]
+"""
+from io import BytesIO
+
+import sys
+import time
+import shutil
+import tempfile
+
+from PIL import Image
+
+from fstop import Runner, ResultCache
+
+SCRIPT = '''OPEN STREAM 0 AS img
+RESIZE img (%(w)d, %(h)d)
+BLUR img 4
+CLONE img AS copy
+INVERT copy
+GRAYSCALE img
+RECTANGLE img (10, 10, 200, 200) 3 COLOR 255
+SAVE copy STREAM "PNG"
+SAVE img STREAM "%(format)s"'''
+
+def request(runner: Runner, source: bytes, format: str = 'JPEG') -> float:
+    runner.reset()
+    runner.streams.clear()
+    width, height = Image.open(BytesIO(source)).size
+    start = time.perf_counter()
+    runner.execute(SCRIPT % {'w': width * 4 // 5, 'h': height * 4 // 5, 'format': format}, streams=[BytesIO(source)])
+    return time.perf_counter() - start
+
+def main(side: int = 2000) -> None:
+    buffer = BytesIO()
+    Image.effect_mandelbrot((side, side * 2 // 3), (-2, -1.5, 1, 1.5), 100).convert('RGB').save(buffer, 'PNG')
+    source = buffer.getvalue()
+
+    directory = tempfile.mkdtemp()
+    cached = Runner(cache=ResultCache(directory=directory))
+    rows = [
+        ('no cache', request(Runner(), source)),
+        ('cold', request(cached, source)),
+        ('repeated, memory', request(cached, source)),
+        ('repeated, disk', request(Runner(cache=ResultCache(directory=directory)), source)),
+        ('last statement changed', request(cached, source, 'PNG')),
+    ]
+    shutil.rmtree(directory)
+    for name, seconds in rows:
+        print('%-24s%10.1f ms' % (name, seconds * 1e3))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
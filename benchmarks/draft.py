@@ -0,0 +1,52 @@
+"""Time to open a 24 megapixel image and shrink it to a thumbnail, decoding
+at full size (``optimize=False``) and at the reduced size the script needs
+(``draft=True``), with the mean absolute difference between the two outputs.
+
+    python -m benchmarks.draft [repeat]
+"""
+from io import BytesIO
+
+import sys
+import time
+
+from PIL import Image, ImageChops, ImageStat
+
+from fstop import Runner
+
+SCRIPTS = {
+    'resize': 'RESIZE img (400, 267)',
+    'scale': 'SCALE img 0.1',
+    'reduce': 'REDUCE img 8',
+}
+
+def encode(image: Image.Image, format: str) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format)
+    return buffer.getvalue()
+
+def measure(runner: Runner, script: str, source: bytes, repeat: int) -> tuple:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        runner.execute(script, streams=[BytesIO(source)])
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed, runner.context.env['img'].image
+
+def main(repeat: int = 3) -> None:
+    image = Image.effect_mandelbrot((6000, 4000), (-2, -1.5, 1, 1.5), 100).convert('RGB')
+    sources = {format: encode(image, format) for format in ('JPEG', 'PNG')}
+    runners = Runner(optimize=False), Runner(draft=True)
+
+    for format, source in sources.items():
+        for name, statement in SCRIPTS.items():
+            script = 'OPEN STREAM 0 AS img\n%s' % statement
+            (before, expected), (after, output) = (
+                measure(runner, script, source, repeat) for runner in runners
+            )
+            assert output.size == expected.size, name
+            diff = sum(ImageStat.Stat(ImageChops.difference(output, expected)).mean) / 3
+            print('%-4s %-7s full decode: %7.1f ms  draft: %7.1f ms  (%.1fx)  mean diff: %.2f' % (
+                format, name, before * 1e3, after * 1e3, before / after, diff,
+            ))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
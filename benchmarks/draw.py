@@ -0,0 +1,49 @@
+"""Time of an overlay script of 10k drawing primitives (dots, polylines
+drawn segment by segment and rectangles), one cursor per statement
+(``optimize=False``) versus one batch with merged points and lines.
+
+    python -m benchmarks.draw [primitives]
+"""
+import random
+import sys
+import time
+
+from fstop import Runner
+
+def overlay(primitives: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines, x, y = ['NEW "RGB" (1920, 1080) AS img'], 960, 540
+    while len(lines) <= primitives:
+        kind = rng.random()
+        if kind < 0.5:
+            for _ in range(20):
+                lines.append('DOT img (%d, %d) COLOR "yellow"' % (rng.randrange(1920), rng.randrange(1080)))
+        elif kind < 0.9:
+            for _ in range(20):
+                nx, ny = min(max(x + rng.randint(-30, 30), 0), 1919), min(max(y + rng.randint(-30, 30), 0), 1079)
+                lines.append('LINE img (%d, %d, %d, %d) COLOR "red"' % (x, y, nx, ny))
+                x, y = nx, ny
+        else:
+            x0, y0 = rng.randrange(1800), rng.randrange(1000)
+            lines.append('RECTANGLE img (%d, %d, %d, %d) COLOR "blue"' % (x0, y0, x0 + 50, y0 + 30))
+    return '\n'.join(lines[:primitives + 1])
+
+def main(primitives: int = 10000) -> None:
+    script = overlay(primitives)
+    outputs, timings = [], []
+    for optimize in (False, True):
+        runner = Runner(optimize=optimize)
+        runner.compile(script)
+        start = time.perf_counter()
+        runner.execute(script)
+        timings.append(time.perf_counter() - start)
+        outputs.append(runner.context.env['img'].image.tobytes())
+
+    assert outputs[0] == outputs[1], 'batched drawing differs'
+    before, after = timings
+    print('%d primitives  per statement: %7.1f ms  batched: %7.1f ms  (%.1fx)' % (
+        primitives, before * 1e3, after * 1e3, before / after,
+    ))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,37 @@
+"""Time of a caption heavy script with every ``FONT`` reference parsing the
+font file again (a zero sized cache) and with the font cache.
+
+    python -m benchmarks.fonts path/to/font.ttf [captions]
+"""
+import sys
+import time
+
+from fstop import Runner
+from fstop.fonts import fonts
+from fstop.utils import LRUCache
+
+def main(font: str, captions: int = 500) -> None:
+    script = '\n'.join(
+        ['NEW "RGB" (1280, 720) AS img'] + [
+            'TEXT img "caption %d" (%d, %d) FONT ("%s", %d)' % (i, i % 40 * 30, i % 24 * 30, font, 12 + i % 3)
+            for i in range(captions)
+        ]
+    )
+    runner = Runner()
+    runner.compile(script)
+
+    timings = []
+    for cache in (LRUCache(maxsize=0), LRUCache(maxsize=64)):
+        fonts.fonts = cache
+        start = time.perf_counter()
+        runner.execute(script)
+        timings.append(time.perf_counter() - start)
+
+    uncached, cached = timings
+    print('%d captions  uncached: %7.1f ms  cached: %7.1f ms  (%.1fx)' % (
+        captions, uncached * 1e3, cached * 1e3, uncached / cached,
+    ))
+    print('stats: %s' % fonts.stats())
+
+if __name__ == '__main__':
+    main(sys.argv[1], *map(int, sys.argv[2:]))
@@ -0,0 +1,50 @@
+"""Time of resizing, filtering and watermarking every frame of an animated
+GIF, as the number of frame pool threads grows.
+
+    python -m benchmarks.frames [frames]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import os
+import sys
+import time
+
+from PIL import Image
+
+from fstop import Runner, objects
+
+SCRIPT = '''
+OPEN STREAM 0 AS img
+NEW SEQUENCE img AS frames
+CONVERT frames "RGB"
+RESIZE frames (640, 360)
+SHARPEN frames
+RECTANGLE frames (20, 20, 200, 60) COLOR "white"
+SAVE frames STREAM "GIF" LOOP 0
+'''
+
+def animation(frames: int, size=(1280, 720)) -> bytes:
+    images = [
+        Image.effect_mandelbrot(size, (-2 + i * 0.01, -1.5, 1, 1.5), 50).convert('P')
+        for i in range(frames)
+    ]
+    buffer = BytesIO()
+    images[0].save(buffer, 'GIF', save_all=True, append_images=images[1:], duration=40, loop=0)
+    return buffer.getvalue()
+
+def main(frames: int = 60) -> None:
+    source = animation(frames)
+    runner = Runner()
+    counts = sorted({1, 2, os.cpu_count() or 1})
+    for threads in counts:
+        objects._pool = ThreadPoolExecutor(threads)
+        start = time.perf_counter()
+        runner.execute(SCRIPT, streams=[BytesIO(source)])
+        elapsed = time.perf_counter() - start
+        objects._pool.shutdown()
+        print('%2d thread(s): %7.1f ms  (%.1f frames/s)' % (threads, elapsed * 1e3, frames / elapsed))
+    objects._pool = None
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
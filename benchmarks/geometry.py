@@ -0,0 +1,49 @@
+"""Time of chains of geometric statements on a 4K RGB image, run statement
+by statement (``optimize=False``) and composed into one resample, with the
+mean absolute difference between the two outputs.
+
+    python -m benchmarks.geometry [repeat]
+"""
+from io import BytesIO
+
+import sys
+import time
+
+from PIL import Image, ImageChops, ImageStat
+
+from fstop import Runner
+
+CHAINS = {
+    'crop, mirror, flip': ['CROP img (200, 100, 3000, 2000)', 'MIRROR img', 'FLIP img'],
+    'crop, resize, mirror': ['CROP img (200, 100, 3000, 2000)', 'RESIZE img (640, 480)', 'MIRROR img'],
+    'resize, scale, rotate 90': ['RESIZE img (1920, 1080)', 'SCALE img 0.5', 'ROTATE img 90'],
+    'rotate 15, resize, mirror': ['ROTATE img 15', 'RESIZE img (960, 540)', 'MIRROR img'],
+}
+
+def measure(runner: Runner, script: str, repeat: int) -> tuple:
+    runner.execute(script)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        runner.execute(script)
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed, runner.context.env['img'].image
+
+def main(repeat: int = 5) -> None:
+    buffer = BytesIO()
+    Image.effect_mandelbrot((3840, 2160), (-2, -1.5, 1, 1.5), 100).convert('RGB').save(buffer, 'PNG')
+
+    runners = Runner(optimize=False), Runner(compose_geometry=True)
+    for runner in runners:
+        runner.execute('OPEN STREAM 0 AS src', streams=[BytesIO(buffer.getvalue())])
+
+    for name, ops in CHAINS.items():
+        script = '\n'.join(['CLONE src AS img', *ops])
+        (before, expected), (after, output) = (measure(runner, script, repeat) for runner in runners)
+        assert output.size == expected.size, name
+        diff = sum(ImageStat.Stat(ImageChops.difference(output, expected)).mean) / 3
+        print('%-26s sequential: %7.1f ms  composed: %7.1f ms  (%.1fx)  mean diff: %.2f' % (
+            name, before * 1e3, after * 1e3, before / after, diff,
+        ))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
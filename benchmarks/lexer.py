@@ -0,0 +1,50 @@
+"""Lexing and parsing time of large generated scripts with rply's ordered
+rules versus :class:`fstop.lexer.KeywordLexer` (``Runner(keyword_lexer=...)``).
+
+    python -m benchmarks.lexer [statements ...]
+"""
+import sys
+import time
+
+from fstop import Runner
+
+LINES = [
+    'OPEN STREAM 0 AS image_%(i)d',
+    'NEW "RGB" (WIDTH image_%(i)d, HEIGHT image_%(i)d + 10 - 10) COLOR (0, 0, 255) AS total_%(i)d',
+    'RECTANGLE total_%(i)d (%(a)d, %(b)d, %(c)d, %(d)d) 2 COLOR (0, 255, 0)',
+    'TEXT total_%(i)d "line %(i)d" (%(a)d, %(b)d) COLOR (255, 255, 255)',
+    'ROTATE image_%(i)d -%(a)d.5',
+    'BLEND total_%(i)d, image_%(i)d ALPHA 1 - 0.5 AS blended_%(i)d  // blend them',
+    'POLYGON blended_%(i)d (%(a)d, %(b)d, %(c)d, %(d)d, %(a)d, %(d)d) COLOR (255, 0, 0)',
+    'SAVE blended_%(i)d STREAM "PNG"',
+]
+
+def script(statements: int) -> str:
+    return '\n'.join(LINES[i % len(LINES)] % {
+        'i': i // len(LINES), 'a': i % 97, 'b': i % 89, 'c': 100 + i % 83, 'd': 100 + i % 79,
+    } for i in range(statements))
+
+def best(func, repeat: int = 5) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main(*sizes: int) -> None:
+    rules, keywords = Runner(keyword_lexer=False), Runner(keyword_lexer=True)
+    print('%-12s%8s%14s%14s%9s%14s%16s' % ('statements', 'tokens', 'lex rules', 'lex keywords', 'speedup', 'parse rules', 'parse keywords'))
+    for statements in sizes or (100, 1000, 10000):
+        code = script(statements)
+        tokens = list(keywords.lexer.lex(code))
+        assert [(t.name, t.value, t.source_pos.idx) for t in tokens] \
+            == [(t.name, t.value, t.source_pos.idx) for t in rules.lexer.lex(code)], 'token streams differ'
+        lex = [best(lambda runner=runner: list(runner.lexer.lex(code))) for runner in (rules, keywords)]
+        parse = [best(lambda runner=runner: runner.parser.parse(runner.lexer.lex(code)), 3) for runner in (rules, keywords)]
+        print('%-12d%8d%11.1f ms%11.1f ms%8.1fx%11.1f ms%13.1f ms' % (
+            statements, len(tokens), lex[0] * 1e3, lex[1] * 1e3, lex[0] / lex[1], parse[0] * 1e3, parse[1] * 1e3
+        ))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,31 @@
+"""Peak pixel bytes held by the variables of a script, with and without
+releasing each variable after its last use (``Runner(release=True)``).
+
+    python -m benchmarks.liveness [script]
+"""
+import sys
+
+from fstop import Runner
+from fstop.limits import live_bytes
+
+def peak(code: str, release: bool) -> int:
+    runner = Runner(release=release)
+    program, context = runner.compile(code), runner.context
+    results, highest = [None] * len(program), 0
+    with context.bind():
+        for node, dead in zip(program.statements, program.dead):
+            node.execute(results)
+            highest = max(highest, live_bytes(context.env))
+            if release:
+                for name in dead:
+                    context.release(name, close=name not in program.shared)
+    return highest
+
+def main(path: str = 'test.ft') -> None:
+    with open(path) as f:
+        code = f.read()
+    before, after = peak(code, False), peak(code, True)
+    print('%s: peak resident pixel bytes %d kept, %d released (%.0f%%)' % (path, before, after, 100 * after / before))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
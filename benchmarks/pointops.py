@@ -0,0 +1,50 @@
+"""Time of chains of point operations on a 4K RGB image, run statement by
+statement (``optimize=False``) and fused into one lookup table.
+
+    python -m benchmarks.pointops [repeat]
+"""
+from io import BytesIO
+
+import sys
+import time
+
+from PIL import Image
+
+from fstop import Runner
+
+CHAINS = {
+    1: ['INVERT img'],
+    3: ['INVERT img', 'BRIGHTEN img 1.2', 'SOLARIZE img 200'],
+    6: [
+        'CONTRAST img 1.3', 'INVERT img', 'BRIGHTEN img 0.9',
+        'SOLARIZE img 180', 'POSTERIZE img 5', 'INVERT img',
+    ],
+}
+
+def measure(runner: Runner, script: str, repeat: int) -> tuple:
+    runner.execute(script)  # warm up: compile and build the table
+    start = time.perf_counter()
+    for _ in range(repeat):
+        runner.execute(script)
+    elapsed = (time.perf_counter() - start) / repeat
+    runner.execute('SAVE img STREAM "BMP"')
+    return elapsed, runner.streams.pop().getvalue()
+
+def main(repeat: int = 5) -> None:
+    buffer = BytesIO()
+    Image.effect_mandelbrot((3840, 2160), (-2, -1.5, 1, 1.5), 100).convert('RGB').save(buffer, 'PNG')
+
+    runners = Runner(optimize=False), Runner(optimize=True)
+    for runner in runners:
+        runner.execute('OPEN STREAM 0 AS src', streams=[BytesIO(buffer.getvalue())])
+
+    for length, ops in CHAINS.items():
+        script = '\n'.join(['CLONE src AS img', *ops])
+        (before, expected), (after, output) = (measure(runner, script, repeat) for runner in runners)
+        assert output == expected, 'fused chain of %d differs' % length
+        print('%d op(s)  sequential: %7.1f ms  fused: %7.1f ms  (%.1fx)' % (
+            length, before * 1e3, after * 1e3, before / after,
+        ))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,44 @@
+"""Compile and draw time of ``POLYGON`` and ``LINE`` statements with very
+long coordinate lists, such as traced outlines, and the memory their
+coordinates take in the compiled program.
+
+    python -m benchmarks.polygon [points]
+"""
+import math
+import sys
+import time
+
+from fstop import Runner
+
+def outline(points: int, size: int = 1000) -> str:
+    """A wavy closed outline of ``points`` vertices, as a coordinate literal."""
+    coords = []
+    for i in range(points):
+        angle = 2 * math.pi * i / points
+        radius = size * (0.35 + 0.1 * math.sin(angle * 40))
+        coords += [round(size / 2 + radius * math.cos(angle)), round(size / 2 + radius * math.sin(angle))]
+    return '(%s)' % ', '.join(map(str, coords))
+
+def footprint(value) -> int:
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(sys.getsizeof(v) for v in set(value))  # small ints are shared
+    return sys.getsizeof(value)
+
+def main(points: int = 100000) -> None:
+    xy = outline(points)
+    for statement in ('POLYGON img %s COLOR (255, 0, 0)' % xy, 'LINE img %s COLOR (0, 255, 0)' % xy):
+        code = 'NEW "RGB" (1000, 1000) AS img\n%s\nSAVE img STREAM "PNG"' % statement
+        runner = Runner()
+        start = time.perf_counter()
+        program = runner.compile(code)
+        compiled = time.perf_counter() - start
+        start = time.perf_counter()
+        program.run(context=runner.context)
+        ran = time.perf_counter() - start
+        coords = program.statements[1].args[2]
+        print('%-8s %d points: compile %8.1f ms, run %7.1f ms, coordinates held as %s (%d bytes)' % (
+            statement.split()[0], points, compiled * 1e3, ran * 1e3, type(coords).__name__, footprint(coords)
+        ))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,67 @@
+"""Peak memory and time of re-encoding a long GIF through ``SEQUENCE``, with
+frames decoded on demand versus all decoded up front (as the original list
+based sequences did). Each mode runs in a fresh process.
+
+    python -m benchmarks.sequence [frames]
+"""
+from io import BytesIO
+
+import os
+import sys
+import time
+import resource
+import subprocess
+
+from PIL import Image
+
+SCRIPT = '''
+OPEN STREAM 0 AS img
+NEW SEQUENCE img AS frames
+SAVE frames STREAM "GIF" LOOP 0
+'''
+
+def animation(frames: int, size=(480, 360)) -> bytes:
+    images = [
+        Image.effect_mandelbrot(size, (-2 + i * 0.01, -1.5, 1, 1.5), 50).convert('P')
+        for i in range(frames)
+    ]
+    buffer = BytesIO()
+    images[0].save(buffer, 'GIF', save_all=True, append_images=images[1:], duration=40, loop=0)
+    return buffer.getvalue()
+
+def child(mode: str, path: str) -> None:
+    from fstop import Runner, FrameSequence
+
+    with open(path, 'rb') as f:
+        source = f.read()
+    runner = Runner()
+    if mode == 'eager':
+        runner.execute('OPEN STREAM 0 AS img\nNEW SEQUENCE img AS frames', streams=[BytesIO(source)])
+        frames = runner.context.env['frames']
+        runner.context.env['frames'] = FrameSequence([frames[i] for i in range(len(frames))])
+        script = 'SAVE frames STREAM "GIF" LOOP 0'
+    else:
+        script = SCRIPT
+
+    start = time.perf_counter()
+    runner.execute(script, streams=[BytesIO(source)])
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('%-5s %7.1f ms  peak RSS: %6.1f MiB' % (mode, elapsed * 1e3, peak))
+
+def main(frames: int = 300) -> None:
+    path = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'fstop-sequence-benchmark.gif')
+    with open(path, 'wb') as f:
+        f.write(animation(frames))
+    print('%d frames' % frames)
+    try:
+        for mode in ('eager', 'lazy'):
+            subprocess.run([sys.executable, '-m', 'benchmarks.sequence', '--child', mode, path], check=True)
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(*sys.argv[2:])
+    else:
+        main(*map(int, sys.argv[1:]))
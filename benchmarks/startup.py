@@ -0,0 +1,62 @@
+"""Cold-start benchmark: ``import fstop`` plus the first ``Runner()`` in a fresh
+interpreter, with and without the on-disk LALR table cache.
+
+    python -m benchmarks.startup [runs]
+"""
+from typing import Optional
+
+import os
+import sys
+import json
+import tempfile
+import statistics
+import subprocess
+
+SNIPPET = '''
+import sys, time, json, warnings
+warnings.simplefilter('ignore')
+start = time.perf_counter()
+import fstop
+imported = time.perf_counter()
+fstop.Runner()
+ready = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'runner': ready - imported,
+    'cv2': 'cv2' in sys.modules,
+    'numpy': 'numpy' in sys.modules,
+}))
+'''
+
+def cold_start(cache_dir: Optional[str]) -> dict:
+    env = dict(os.environ, FSTOP_CACHE_DIR=cache_dir or '')
+    out = subprocess.run(
+        [sys.executable, '-c', SNIPPET],
+        env=env, check=True, capture_output=True, text=True,
+    )
+    return json.loads(out.stdout)
+
+def measure(cache_dir: Optional[str], runs: int) -> dict:
+    samples = [cold_start(cache_dir) for _ in range(runs)]
+    return {
+        'import': statistics.median(s['import'] for s in samples),
+        'runner': statistics.median(s['runner'] for s in samples),
+        'cv2': samples[-1]['cv2'],
+        'numpy': samples[-1]['numpy'],
+    }
+
+def main(runs: int = 5) -> None:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold_start(cache_dir)  # populate the table cache
+        results = {
+            'no cache': measure(None, runs),
+            'table cache': measure(cache_dir, runs),
+        }
+
+    for name, r in results.items():
+        print('%-12s import %6.1f ms  Runner() %6.1f ms  cv2 loaded: %-5s numpy loaded: %s' % (
+            name, r['import'] * 1e3, r['runner'] * 1e3, r['cv2'], r['numpy'],
+        ))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,44 @@
+"""Time of the heavy filters on a large image, run in one call versus as
+parallel strips (``Runner(strip_pixels=...)``) as the strip pool grows.
+
+    python -m benchmarks.strips [side]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import os
+import sys
+import time
+
+from PIL import Image
+
+from fstop import Runner, tiles
+
+STATEMENTS = ['BLUR img 8', 'MEDIAN_FILTER img 9', 'MAX_FILTER img 7', 'MIN_FILTER img 7']
+
+def main(side: int = 3000) -> None:
+    buffer = BytesIO()
+    Image.effect_mandelbrot((side, side), (-2, -1.5, 1, 1.5), 100).convert('RGB').save(buffer, 'PNG')
+    source = buffer.getvalue()
+
+    counts = sorted({2, os.cpu_count() or 1})
+    print('%-20s%13s' % ('statement', 'one call') + ''.join('%9d thr' % n for n in counts))
+    for statement in STATEMENTS:
+        script = 'OPEN STREAM 0 AS img\n%s\nSAVE img STREAM "BMP"' % statement
+        row, outputs = [], []
+        for threads in [None] + counts:
+            if threads is not None:
+                tiles._pool = ThreadPoolExecutor(threads)
+            runner = Runner(strip_pixels=None if threads is None else 0)
+            start = time.perf_counter()
+            runner.execute(script, streams=[BytesIO(source)])
+            row.append(time.perf_counter() - start)
+            outputs.append(runner.streams[-1].getvalue())
+            if threads is not None:
+                tiles._pool.shutdown()
+        tiles._pool = None
+        assert all(output == outputs[0] for output in outputs), 'strips differ from the single call'
+        print('%-20s' % statement + ''.join('%10.1f ms' % (t * 1e3) for t in row))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,297 @@
+"""The benchmark suite: every statement family and a few whole scripts, on
+synthetic images generated at several sizes and modes, so it runs offline.
+
+    python -m benchmarks.suite [-g GROUP ...] [-s SIZE ...] [-r REPEAT]
+                               [--json OUT] [--baseline FILE] [-t [GROUP=]RATIO ...]
+
+Each case runs its setup untimed (opening the test image, ...) and then
+times its statements alone, ``REPEAT`` times after one warm-up run; the
+median and minimum are reported. ``--json`` writes the results, which can
+later be given back as ``--baseline``: cases whose median got slower than
+the baseline by more than their group's threshold (10% unless set with
+``-t``) are reported as regressions, and the exit status is 1.
+"""
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from io import BytesIO
+
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+
+import PIL
+from PIL import Image
+
+from fstop import Runner, ImageRepr
+
+SIZES = {'small': (320, 240), 'medium': (1024, 768), 'large': (2048, 1536)}
+GROUPS = ('parse', 'pil', 'filters', 'draw', 'cv', 'sequence', 'scripts')
+
+class Case:
+    """One benchmark: ``script`` is timed after ``setup`` ran in the same
+    context; ``streams`` are the inputs of ``OPEN STREAM``."""
+
+    def __init__(self, group: str, name: str, script: str, setup: str = '', streams: Callable[[], List[bytes]] = list) -> None:
+        self.group = group
+        self.name = name
+        self.script = script
+        self.setup = setup
+        self.streams = streams
+
+    def run(self, runner: Runner) -> float:
+        runner.reset()
+        runner.execute(self.setup, streams=[BytesIO(data) for data in self.streams()])
+        for value in runner.context.env.values():
+            if isinstance(value, ImageRepr):
+                value.image.load()  # OPEN only reads the header; decoding is not what is measured
+        start = time.perf_counter()
+        runner.execute(self.script)
+        return time.perf_counter() - start
+
+class ScriptCase(Case):
+    """Times a whole script, decoding and encoding included."""
+
+    def run(self, runner: Runner) -> float:
+        runner.reset()
+        streams = [BytesIO(data) for data in self.streams()]
+        start = time.perf_counter()
+        runner.execute(self.script, streams=streams)
+        return time.perf_counter() - start
+
+class ParseCase(Case):
+    """Times lexing and parsing ``script``, bypassing the program cache."""
+
+    def run(self, runner: Runner) -> float:
+        start = time.perf_counter()
+        runner.parser.parse(runner.lexer.lex(self.script))
+        return time.perf_counter() - start
+
+# synthetic inputs, generated once per size and mode
+
+_images: Dict[Tuple[str, str, str], bytes] = {}
+
+def image(size: str, mode: str = 'RGB', format: str = 'PNG') -> bytes:
+    key = size, mode, format
+    if key not in _images:
+        width, height = SIZES[size]
+        base = Image.effect_mandelbrot((width, height), (-2, -1.25, 1, 1.25), 64)
+        noise = Image.effect_noise((width, height), 40)
+        gradient = Image.linear_gradient('L').resize((width, height))
+        rgb = Image.merge('RGB', (base, Image.blend(base, noise, 0.5), gradient))
+        buffer = BytesIO()
+        rgb.convert(mode).save(buffer, format)
+        _images[key] = buffer.getvalue()
+    return _images[key]
+
+def animation(size: str, frames: int = 12) -> bytes:
+    key = size, 'animation', str(frames)
+    if key not in _images:
+        width, height = SIZES[size]
+        images = [
+            Image.effect_mandelbrot((width, height), (-2 + i * 0.02, -1.25, 1, 1.25), 48).convert('P')
+            for i in range(frames)
+        ]
+        buffer = BytesIO()
+        images[0].save(buffer, 'GIF', save_all=True, append_images=images[1:], duration=40, loop=0)
+        _images[key] = buffer.getvalue()
+    return _images[key]
+
+# cases
+
+PIL_OPS = [
+    'INVERT img', 'GRAYSCALE img', 'SOLARIZE img 100', 'POSTERIZE img 3', 'MIRROR img', 'FLIP img',
+    'BRIGHTEN img 1.3', 'CONTRAST img 1.4', 'ROTATE img 30', 'CROP img (10, 10, 200, 150)',
+    'RESIZE img (200, 150)', 'SCALE img 0.5', 'REDUCE img 2', 'EXPAND img 20', 'PAD img (400, 400)',
+    'FIT img (160, 160)', 'CONVERT img "L"', 'DISTORT img (300, 300) "AFFINE" (1, 0.2, 0, 0.1, 1, 0)',
+    'INVERT img\nSOLARIZE img 100\nPOSTERIZE img 4',
+    'RESIZE img (600, 450)\nROTATE img 15\nCROP img (20, 20, 400, 300)',
+]
+FILTERS = [
+    'BLUR img', 'BLUR img 8', 'SHARPEN img', 'SMOOTH img', 'EMBOSS img', 'DETAIL img', 'CONTOUR img',
+    'EDGE_ENHANCE img', 'MEDIAN_FILTER img 5', 'MAX_FILTER img 5', 'MIN_FILTER img 5', 'MODE_FILTER img 5',
+]
+CV_OPS = [
+    'CANNY img 50, 150', 'THRESHOLD img 127, 255 "THRESH_BINARY"', 'NOT img',
+    'img INRANGE (0, 0, 0), (128, 128, 128) AS mask', 'CVTCOLOR img "BGR2HSV"', 'COLORMAP img "JET"',
+    'THRESHOLD img 127, 255 "THRESH_BINARY"\nNOT img\nINVERT img',
+]
+DRAWS = {
+    'lines': 'LINE img (%(a)d, %(b)d, %(c)d, %(d)d) COLOR (255, 0, 0)',
+    'rectangles': 'RECTANGLE img (%(a)d, %(b)d, %(c)d, %(d)d) 2 COLOR (0, 255, 0)',
+    'ellipses': 'ELLIPSE img (%(a)d, %(b)d, %(c)d, %(d)d) COLOR (0, 0, 255)',
+    'dots': 'DOT img (%(a)d, %(b)d) COLOR (255, 255, 0)',
+    'text': 'TEXT img "benchmark %(a)d" (%(a)d, %(b)d) COLOR (255, 255, 255)',
+}
+SCRIPTS = {
+    'thumbnail': '''
+OPEN STREAM 0 AS img
+RESIZE img (640, 480)
+SHARPEN img
+BRIGHTEN img 1.1
+SAVE img STREAM "JPEG"
+''',
+    'watermark': '''
+OPEN STREAM 0 AS img
+CLONE img AS mark
+GRAYSCALE mark
+CONVERT mark "RGB"
+BLEND img, mark ALPHA 0.3 AS out
+TEXT out "f-stop" (20, 20) COLOR (255, 255, 255)
+RECTANGLE out (10, 10, 120, 40) 2 COLOR (255, 255, 255)
+SAVE out STREAM "PNG"
+''',
+    'blend': '''
+OPEN STREAM 0 AS img
+NEW "RGB" (WIDTH img, HEIGHT img) COLOR (0, 0, 255) AS bg
+CLONE img AS overlay
+INVERT img
+SOLARIZE img
+ROTATE img -40.0
+PASTE img ON bg (100, 100)
+BLEND bg, overlay ALPHA 0.5 AS blended
+TEXT blended "hello" (10, 10) COLOR (255, 0, 0)
+LINE blended (0, 0, 100, 100) COLOR (255, 0, 0)
+ARC blended (10, 100, 100, 100) 10, 100 COLOR (0, 0, 255)
+SAVE blended STREAM "PNG"
+''',
+    'edges': '''
+OPEN STREAM 0 AS img
+GRAYSCALE img
+BLUR img 2
+CANNY img 50, 150
+THRESHOLD img 127, 255 "THRESH_BINARY"
+SAVE img STREAM "PNG"
+''',
+}
+
+def draw_script(template: str, count: int, size: Tuple[int, int]) -> str:
+    width, height = size
+    return '\n'.join(template % {
+        'a': (i * 37) % width // 2, 'b': (i * 53) % height // 2,
+        'c': width // 2 + (i * 29) % (width // 2), 'd': height // 2 + (i * 31) % (height // 2),
+    } for i in range(count))
+
+def cases(sizes: List[str]) -> Iterator[Case]:
+    with open('test.ft') as f:
+        sample = f.read()
+    long_script = '\n'.join([
+        'OPEN STREAM 0 AS img', *(PIL_OPS + FILTERS) * 20, 'SAVE img STREAM "PNG"'
+    ])
+    yield ParseCase('parse', 'test.ft', sample)
+    yield ParseCase('parse', 'long script (%d statements)' % (long_script.count('\n') + 1), long_script)
+    yield ParseCase('parse', 'draw script (500 statements)', draw_script(DRAWS['rectangles'], 500, SIZES['medium']))
+
+    for size in sizes:
+        for mode in ('RGB', 'L'):
+            opener = 'OPEN STREAM 0 AS img'
+            streams = lambda size=size, mode=mode: [image(size, mode)]
+            for statement in PIL_OPS:
+                yield Case('pil', '%s [%s %s]' % (statement.replace('\n', '; '), mode, size), statement, opener, streams)
+            for statement in FILTERS:
+                yield Case('filters', '%s [%s %s]' % (statement, mode, size), statement, opener, streams)
+            for statement in CV_OPS:
+                if mode == 'L' and ('CVTCOLOR' in statement or 'INRANGE' in statement):
+                    continue
+                yield Case('cv', '%s [%s %s]' % (statement.replace('\n', '; '), mode, size), statement, opener, streams)
+
+        streams = lambda size=size: [image(size)]
+        for name, template in DRAWS.items():
+            count = 50 if name == 'text' else 500
+            yield Case('draw', '%d %s [%s]' % (count, name, size), draw_script(template, count, SIZES[size]), 'OPEN STREAM 0 AS img', streams)
+
+        frames = lambda size=size: [animation(size)]
+        yield Case('sequence', 'SAVE GIF, 12 frames [%s]' % size, 'SAVE frames STREAM "GIF" LOOP 0',
+                   'OPEN STREAM 0 AS img\nNEW SEQUENCE img AS frames', frames)
+        yield Case('sequence', 'RESIZE + SAVE GIF, 12 frames [%s]' % size,
+                   'CONVERT frames "RGB"\nRESIZE frames (160, 120)\nSAVE frames STREAM "GIF" LOOP 0',
+                   'OPEN STREAM 0 AS img\nNEW SEQUENCE img AS frames', frames)
+        yield Case('sequence', 'SAVE PNG [a, b, c] [%s]' % size, 'SAVE s STREAM "PNG" DURATION 100',
+                   'OPEN STREAM 0 AS a\nCLONE a AS b\nINVERT b\nCLONE a AS c\nNEW [a, b, c,] AS s', streams)
+
+        for name, script in SCRIPTS.items():
+            yield ScriptCase('scripts', '%s [%s]' % (name, size), script, streams=streams)
+
+def measure(case: Case, runner: Runner, repeat: int) -> Dict[str, float]:
+    case.run(runner)  # warm-up: compiles the script and fills caches
+    samples = [case.run(runner) for _ in range(repeat)]
+    return {'median': statistics.median(samples), 'min': min(samples), 'runs': repeat}
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], thresholds: Dict[str, float]) -> List[str]:
+    """Prints each case against the baseline; returns the regressed ones."""
+    regressions = []
+    for key, result in results.items():
+        if (before := baseline.get(key)) is None or 'median' not in result or 'median' not in before:
+            continue
+        ratio = result['median'] / before['median']
+        limit = thresholds.get(result['group'], thresholds.get('*', 0.10))
+        flag = ''
+        if ratio > 1 + limit:
+            flag = '  REGRESSION (> +%.0f%%)' % (limit * 100)
+            regressions.append(key)
+        elif ratio < 1 - limit:
+            flag = '  faster'
+        print('%-72s %9.3f ms -> %9.3f ms  %+6.1f%%%s' % (
+            key, before['median'] * 1e3, result['median'] * 1e3, (ratio - 1) * 100, flag,
+        ))
+    return regressions
+
+def parse_thresholds(values: List[str]) -> Dict[str, float]:
+    thresholds = {}
+    for value in values:
+        group, _, ratio = value.rpartition('=')
+        thresholds[group or '*'] = float(ratio)
+    return thresholds
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description=__doc__.split('\n\n')[0])
+    parser.add_argument('-g', '--group', action='append', choices=GROUPS, help='only run these groups')
+    parser.add_argument('-s', '--size', action='append', choices=list(SIZES), help='image sizes (default: small, medium)')
+    parser.add_argument('-k', '--filter', default='', help='only run cases whose name contains this')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--json', metavar='OUT', help='write the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against results written by --json')
+    parser.add_argument('-t', '--threshold', action='append', default=[], metavar='[GROUP=]RATIO',
+                        help='allowed slowdown before a case counts as a regression, e.g. 0.1 or filters=0.25')
+    args = parser.parse_args(argv)
+
+    groups = set(args.group or GROUPS)
+    runner = Runner()
+    results = {}
+    for case in cases(args.size or ['small', 'medium']):
+        if case.group not in groups or args.filter not in case.name:
+            continue
+        key = '%s/%s' % (case.group, case.name)
+        try:
+            result = measure(case, runner, args.repeat)
+        except Exception as exc:
+            result = {'error': '%s: %s' % (type(exc).__name__, exc)}
+            print('%-72s %s' % (key, result['error']))
+        else:
+            print('%-72s %9.3f ms  (min %.3f ms)' % (key, result['median'] * 1e3, result['min'] * 1e3))
+        results[key] = dict(result, group=case.group)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'meta': {
+                    'python': platform.python_version(), 'pillow': PIL.__version__,
+                    'platform': platform.platform(), 'machine': platform.machine(),
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': args.repeat,
+                },
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print()
+        regressions = compare(results, baseline, parse_thresholds(args.threshold))
+        if regressions:
+            print('\n%d regression(s)' % len(regressions))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
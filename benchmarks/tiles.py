@@ -0,0 +1,67 @@
+"""Peak memory and time of filtering a large uncompressed TIFF in memory
+versus tiled (``Runner(tile_budget=...)``). Each mode runs in a fresh process.
+
+    python -m benchmarks.tiles [side] [budget MiB]
+"""
+import os
+import sys
+import time
+import resource
+import subprocess
+
+from PIL import Image
+
+SCRIPT = '''
+OPEN "%(source)s" AS img
+CLONE img AS copy
+INVERT copy
+BLUR copy 3
+THRESHOLD copy 128, 255 "THRESH_BINARY"
+SAVE copy "%(target)s"
+'''
+
+def build(path: str, side: str) -> None:
+    side = int(side)
+    tile = Image.effect_mandelbrot((1000, 1000), (-2, -1.5, 1, 1.5), 50).convert('RGB')
+    image = Image.new('RGB', (side, side))
+    for x in range(0, side, 1000):
+        for y in range(0, side, 1000):
+            image.paste(tile, (x, y))
+    image.save(path)
+
+def child(mode: str, source: str, target: str, budget: str) -> None:
+    from fstop import Runner
+
+    runner = Runner(tile_budget=int(budget) << 20 if mode == 'tiled' else None)
+    runner.execute('NEW "RGB" (8, 8) AS img\nINVERT img\nTHRESHOLD img 1, 2 "THRESH_BINARY"')  # imports PIL, numpy and OpenCV
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    runner.execute(SCRIPT % {'source': source, 'target': target})
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('%-6s %8.1f ms  peak RSS: %7.1f MiB (+%.1f MiB for the script)' % (mode, elapsed * 1e3, peak, peak - baseline))
+
+def main(side: int = 8000, budget: int = 64) -> None:
+    directory = os.environ.get('TMPDIR', '/tmp')
+    source = os.path.join(directory, 'fstop-tiles-benchmark.tif')
+    targets = {mode: os.path.join(directory, 'fstop-tiles-benchmark-%s.tif' % mode) for mode in ('memory', 'tiled')}
+    # built in its own process too, as the peak RSS of a process survives exec
+    subprocess.run([sys.executable, '-m', 'benchmarks.tiles', '--source', source, str(side)], check=True)
+    print('%dx%d RGB (%.0f MiB of pixels), budget %d MiB' % (side, side, side * side * 3 / 2 ** 20, budget))
+    try:
+        for mode, target in targets.items():
+            subprocess.run([sys.executable, '-m', 'benchmarks.tiles', '--child', mode, source, target, str(budget)], check=True)
+        with Image.open(targets['memory']) as a, Image.open(targets['tiled']) as b:
+            assert a.tobytes() == b.tobytes(), 'tiled output differs'
+    finally:
+        for path in (source, *targets.values()):
+            if os.path.exists(path):
+                os.remove(path)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(*sys.argv[2:])
+    elif sys.argv[1:2] == ['--source']:
+        build(*sys.argv[2:])
+    else:
+        main(*map(int, sys.argv[1:]))
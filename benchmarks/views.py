@@ -0,0 +1,83 @@
+"""Counts PIL <-> NumPy conversions of a CV heavy script, comparing the
+original ImageRepr (which rebuilt the array on every read and converted back
+after every CV statement) with the cached views.
+
+    python -m benchmarks.views
+"""
+from io import BytesIO
+
+import time
+
+from PIL import Image
+
+import fstop
+from fstop import objects, ImageRepr, Runner
+
+SCRIPT = '''
+OPEN STREAM 0 AS img
+CLONE img AS other
+CVTCOLOR img "BGR2HSV"
+THRESHOLD img 100, 255 "THRESH_BINARY"
+NOT img
+COLORMAP img "JET"
+img AND other AS both
+img XOR other AS either
+both OR either AS mask
+CANNY mask 100, 200
+SAVE mask STREAM "PNG"
+'''
+
+class LegacyRepr(ImageRepr):
+    """Reproduces the conversions the original ImageRepr performed."""
+
+    def __init__(self, image=None, *, array=None):
+        if array is not None:
+            image, array = self._legacy_image(array), None  # ImageRepr(_fromarray(arr))
+        super().__init__(image)
+        self._legacy_array()  # converted eagerly on construction
+
+    def _legacy_image(self, arr):
+        objects.conversions['image'] += 1
+        return objects.array_to_image(arr)
+
+    def _legacy_array(self):
+        objects.conversions['array'] += 1
+        return objects.image_to_array(self.image)
+
+    @property
+    def array(self):
+        return self._legacy_array()  # and again on every read
+
+    @array.setter
+    def array(self, arr):
+        self.image = self._legacy_image(arr)  # converted back after every CV statement
+
+def measure(source: bytes) -> tuple:
+    objects.conversions.clear()
+    start = time.perf_counter()
+    Runner().execute(SCRIPT, streams=[BytesIO(source)])
+    return dict(objects.conversions), time.perf_counter() - start
+
+def main() -> None:
+    buffer = BytesIO()
+    Image.effect_mandelbrot((1920, 1080), (-2, -1.5, 1, 1.5), 100).convert('RGB').save(buffer, 'PNG')
+    source = buffer.getvalue()
+
+    measure(source)  # imports OpenCV
+    after = measure(source)
+    modules = (fstop.parser, fstop.cv)
+    for module in modules:
+        module.ImageRepr = LegacyRepr
+    try:
+        before = measure(source)
+    finally:
+        for module in modules:
+            module.ImageRepr = ImageRepr
+
+    for name, (counts, elapsed) in (('before', before), ('after', after)):
+        print('%-6s to array: %3d  to PIL: %3d  total: %3d  (%.1f ms)' % (
+            name, counts.get('array', 0), counts.get('image', 0), sum(counts.values()), elapsed * 1e3,
+        ))
+
+if __name__ == '__main__':
+    main()
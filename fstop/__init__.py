@@ -1,6 +1,15 @@
 from .lexer import generator
 from .parser import parser
-from .objects import ImageRepr
+from .objects import ImageRepr, FrameSequence
+from .tiles import TiledImage
 
 from . import operations
 from . import cv
+
+from .cache import ResultCache
+from .context import Context
+from .limits import Limits
+from .metrics import registry
+from .profile import Profile
+from .program import Program
+from .runner import Runner, BatchResult
@@ -0,0 +1,366 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from array import array
+from io import BytesIO
+from threading import Lock
+
+import os
+import pickle
+import hashlib
+import tempfile
+
+from rply import Token
+
+from .context import Context
+from .objects import ImageRepr, FrameSequence
+from .tiles import TiledImage
+from .limits import pixel_bytes
+from .parser import open_statement, save_statement, show_statement, echo, echo_var
+from .program import Group, Name, Node
+from .utils import LRUCache
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# statements that act outside the variables, and so always run
+EFFECTS = {echo, echo_var, show_statement}
+
+Payload = Optional[Tuple[str, Any]]  # ('image', Image) / ('array', ndarray) / ('frames', [Image]), None once deleted
+Entry = Tuple[Dict[str, Payload], List[bytes]]  # variables a statement left behind, buffers it saved
+
+def cacheable(node: Node) -> bool:
+    if isinstance(node, Group):
+        return all(cacheable(inner) for inner in node.nodes)
+    if node.func in EFFECTS:
+        return False
+    if node.func is save_statement:  # SAVE ... STREAM only fills buffers, which are stored
+        return any(isinstance(arg, Token) and arg.gettokentype() == 'STREAM' for arg in node.args)
+    return True
+
+def _feed_source(h: 'hashlib._Hash', args: list, context: Context) -> bool:
+    """Hashes the bytes an ``OPEN`` statement will decode; URLs are not
+    cached, as only fetching them tells whether they changed, nor are paths
+    computed at run time."""
+    if isinstance(args[1], str):
+        try:
+            with open(args[1], 'rb') as f:
+                h.update(f.read())
+        except OSError:
+            return False  # the statement itself raises
+        return True
+    if isinstance(args[1], Token) and args[1].gettokentype() == 'STREAM' and isinstance(args[2], int):
+        try:
+            stream = context.streams[args[2]]
+        except IndexError:
+            return False
+        if isinstance(stream, BytesIO):
+            h.update(stream.getbuffer()[stream.tell():])
+            return True
+    return False
+
+def _feed(h: 'hashlib._Hash', value: Any, context: Context) -> bool:
+    """Hashes the compiled form of a statement, ignoring source positions.
+    False when part of it cannot be hashed."""
+    if isinstance(value, Group):
+        h.update(type(value).__name__.encode())
+        return all(_feed(h, inner, context) for inner in value.nodes)
+    elif isinstance(value, Node):
+        if value.func is open_statement and not _feed_source(h, value.args, context):
+            return False
+        h.update(('(%s.%s' % (value.func.__module__, value.func.__qualname__)).encode())
+        if not all(_feed(h, arg, context) for arg in value.args):
+            return False
+        h.update(b')')
+    elif isinstance(value, Token):
+        h.update(('%s %r;' % (value.gettokentype(), value.getstr())).encode())
+    elif isinstance(value, (Name, str, int, float, type(None))):
+        h.update(('%s %r;' % (type(value).__name__, value)).encode())
+    elif isinstance(value, (list, tuple)):
+        h.update(b'[')
+        if not all(_feed(h, item, context) for item in value):
+            return False
+        h.update(b']')
+    elif isinstance(value, array):
+        h.update(('array %s;' % value.typecode).encode())
+        h.update(value.tobytes())
+    else:
+        return False
+    return True
+
+def _feed_image(h: 'hashlib._Hash', image: 'Image.Image') -> None:
+    h.update(('%s %r;' % (image.mode, image.size)).encode())
+    h.update(image.tobytes())
+    if image.palette is not None:
+        h.update(bytes(image.getpalette() or ()))
+
+def freeze(value: Any) -> Payload:
+    """A copy of a variable that later statements cannot modify; raises
+    :class:`TypeError` for variables that cannot be stored."""
+    if value is None:
+        return None
+    if isinstance(value, TiledImage) and value.store is not None:
+        raise TypeError('tiled images stay on disk')
+    if isinstance(value, ImageRepr):
+        if value._image is None:
+            return 'array', value._array.copy()
+        if getattr(value._image, 'n_frames', 1) > 1:
+            raise TypeError('only the current frame would be copied')
+        return 'image', value._image.copy()
+    if isinstance(value, FrameSequence):
+        return 'frames', [FrameSequence.decode(frame, cache=False).copy() for frame in value.frames]
+    raise TypeError('cannot store %s' % type(value).__name__)
+
+def thaw(payload: Tuple[str, Any]) -> Any:
+    kind, data = payload
+    if kind == 'image':
+        return ImageRepr(data.copy())
+    elif kind == 'array':
+        return ImageRepr(array=data.copy())
+    return FrameSequence(frame.copy() for frame in data)
+
+def entry_size(entry: Entry) -> int:
+    values, streams = entry
+    total = sum(map(len, streams))
+    for payload in values.values():
+        if payload is None:
+            continue
+        kind, data = payload
+        if kind == 'array':
+            total += data.nbytes
+        else:
+            for image in data if kind == 'frames' else [data]:
+                total += image.width * image.height * pixel_bytes(image.mode)
+    return total
+
+class DiskCache:
+    """Entries pickled one per file in ``directory``, evicted least recently
+    used first once they take more than ``maxbytes``.
+
+    The directory may be shared by several processes (the workers of
+    :meth:`fstop.Runner.map`); each one only accounts for the files it has
+    seen, so the budget is then approximate. Only point it at a directory
+    nobody else can write to, as entries are unpickled.
+    """
+
+    def __init__(self, directory: str, maxbytes: int) -> None:
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._files = OrderedDict()  # key -> size, least recently used first
+        self._lock = Lock()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        found = []
+        for name in os.listdir(directory):
+            if name.endswith('.entry'):
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name[:-len('.entry')], stat.st_size))
+        with self._lock:
+            for _, key, size in sorted(found):
+                self._files[key] = size
+                self.nbytes += size
+            self._evict()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.entry')
+
+    def get(self, key: str) -> Optional[Entry]:
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                entry = pickle.load(f)
+            os.utime(path)
+        except Exception:
+            return None  # missing, evicted by another process, or truncated
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+            else:  # written by another process
+                self._files[key] = size
+                self.nbytes += size
+                self._evict()
+        return entry
+
+    def put(self, key: str, entry: Entry) -> None:
+        data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.maxbytes:
+            return
+        try:
+            with tempfile.NamedTemporaryFile('wb', dir=self.directory, delete=False) as f:
+                f.write(data)
+            os.replace(f.name, self.path(key))
+        except OSError:
+            return  # full or read-only, entries are recomputed next time
+        with self._lock:
+            self.nbytes += len(data) - self._files.pop(key, 0)
+            self._files[key] = len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.nbytes > self.maxbytes and self._files:
+            key, size = self._files.popitem(last=False)
+            self.nbytes -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.endswith('.entry'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+            self._files.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __repr__(self):
+        return "<DiskCache %s entries=%d bytes=%d>" % (self.directory, len(self), self.nbytes)
+
+class ResultCache:
+    """Variables left behind by each statement, keyed by everything that
+    determined them, shared by every execution given the cache.
+
+    A statement's key hashes the previous statement's key with the
+    statement itself and, for ``OPEN``, the bytes it decodes; the first key
+    hashes the variables the execution started with. So a repeated request,
+    or one sharing a prefix of statements over the same inputs, skips every
+    statement it finds, and only restores the variables it needs, just
+    before the first statement that has to run. Statements with effects
+    outside the variables (``ECHO``, ``SHOW``, ``SAVE`` to a path) always
+    run, as does everything after ``OPEN URL`` or a statement whose inputs
+    cannot be hashed. Nothing is stored for statements using tiled images
+    or unsequenced animations.
+
+    Entries are kept in memory up to ``max_bytes`` of pixels and, with a
+    ``directory``, also on disk up to ``max_disk_bytes``. Storing copies
+    every image a statement uses, so the cache costs time on misses.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 << 20, *,
+        directory: Optional[str] = None,
+        max_disk_bytes: int = 1 << 30
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = LRUCache(maxsize=None, maxbytes=max_bytes, sizeof=entry_size)
+        self.disk = DiskCache(directory, max_disk_bytes) if directory is not None else None
+
+    def get(self, key: str) -> Optional[Entry]:
+        if (entry := self.memory.get(key)) is not None:
+            return entry
+        if self.disk is not None and (entry := self.disk.get(key)) is not None:
+            self.memory.put(key, entry)
+            return entry
+
+    def put(self, key: str, entry: Entry) -> None:
+        self.memory.put(key, entry)
+        if self.disk is not None:
+            self.disk.put(key, entry)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def replay(self, context: Context) -> 'Replay':
+        return Replay(self, context)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # worker processes start with an empty memory tier, sharing the disk one
+        return {'max_bytes': self.max_bytes, 'directory': self.directory, 'max_disk_bytes': self.max_disk_bytes}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state.pop('max_bytes'), **state)
+
+    def __repr__(self):
+        return "<ResultCache memory=%d bytes disk=%r>" % (self.memory.nbytes, self.disk)
+
+class Replay:
+    """The state of one execution going through a :class:`ResultCache`; see
+    :meth:`fstop.program.Program.run`."""
+
+    def __init__(self, cache: ResultCache, context: Context) -> None:
+        self.cache = cache
+        self.context = context
+        self.pending: Dict[str, Payload] = {}  # variables of skipped statements, not restored yet
+        self.mark = len(context.saved_streams)
+        self.key = self.root()
+
+    def root(self) -> Optional[str]:
+        context = self.context
+        h = hashlib.sha1(b'fstop-results-1')
+        limits = context.limits
+        h.update(repr((context.tile_budget, limits and (limits.max_pixels, limits.max_bytes, limits.max_frames))).encode())
+        for name, value in sorted(context.env.items()):
+            h.update(('var %r;' % name).encode())
+            if isinstance(value, TiledImage) and value.store is not None:
+                return None
+            try:
+                if isinstance(value, ImageRepr):
+                    _feed_image(h, value.image)
+                elif isinstance(value, FrameSequence):
+                    for frame in value.frames:
+                        _feed_image(h, FrameSequence.decode(frame, cache=False))
+                else:
+                    return None
+            except ValueError:  # closed by CLOSE
+                return None
+        return h.hexdigest()
+
+    def skip(self, node: Node, results: List[Any]) -> bool:
+        """Advances the key over ``node``; true when its outcome was found,
+        in which case it must not run."""
+        if self.key is not None:
+            h = hashlib.sha1(self.key.encode())
+            self.key = h.hexdigest() if _feed(h, node, self.context) else None
+        if self.key is None or not cacheable(node) or (entry := self.cache.get(self.key)) is None:
+            return False
+
+        values, streams = entry
+        self.pending.update(values)
+        buffers = [BytesIO(data) for data in streams]
+        self.context.saved_streams.extend(buffers)
+        for inner in node.nodes if isinstance(node, Group) else [node]:
+            results[inner.index] = None
+        if buffers and not isinstance(node, Group):
+            results[node.index] = buffers[-1]  # what SAVE ... STREAM returns
+        return True
+
+    def restore(self) -> None:
+        """Brings back the variables of the statements skipped so far."""
+        env = self.context.env
+        for name, payload in self.pending.items():
+            if payload is None:
+                env.pop(name, None)
+            else:
+                env[name] = thaw(payload)
+        self.pending.clear()
+        self.mark = len(self.context.saved_streams)
+
+    def store(self, node: Node) -> None:
+        """Records what ``node`` just did, after it ran."""
+        if self.key is None or not cacheable(node):
+            return
+        env = self.context.env
+        try:
+            values = {name: freeze(env.get(name)) for name in set(node.names())}
+        except (TypeError, ValueError):  # ValueError: closed by CLOSE
+            return
+        streams = [buffer.getvalue() for buffer in self.context.saved_streams[self.mark:]]
+        self.cache.put(self.key, (values, streams))
+
+    def forget(self, name: str) -> None:
+        """Drops a pending variable that is released anyway."""
+        self.pending.pop(name, None)
@@ -0,0 +1,61 @@
+from typing import TYPE_CHECKING, Iterator, List, Optional, Dict, Any
+from contextlib import contextmanager
+from contextvars import ContextVar
+from io import BytesIO
+from weakref import WeakSet
+
+if TYPE_CHECKING:
+    from .limits import Limits
+
+class Context:
+    """The state of one execution: its variables, the input streams handed to
+    ``OPEN STREAM`` and the buffers written by ``SAVE ... STREAM``.
+
+    Productions read the context bound to the running thread (or task) through
+    :func:`current`, so separate executions never see each other's variables.
+    """
+
+    def __init__(
+        self,
+        streams: Optional[List[BytesIO]] = None, *,
+        tile_budget: Optional[int] = None,
+        strip_pixels: Optional[int] = None,
+        limits: Optional['Limits'] = None
+    ) -> None:
+        self.env: Dict[str, Any] = {}
+        self.streams = streams if streams is not None else []
+        self.saved_streams: List[BytesIO] = []
+        self.fetched: Dict[str, bytes] = {}  # OPEN URL payloads fetched ahead of time
+        self.tile_budget = tile_budget  # images larger than this many bytes are opened tiled
+        self.strip_pixels = strip_pixels  # images with this many pixels are filtered in parallel strips
+        self.limits = limits  # see fstop.limits
+        contexts.add(self)
+
+    def release(self, name: str, close: bool = True) -> None:
+        """Forgets variable ``name`` and frees the pixels it holds, unless
+        another variable refers to the same object. Without ``close`` its
+        images are only dropped, as something else may still use them."""
+        value = self.env.pop(name, None)
+        if hasattr(value, 'release') and not any(other is value for other in self.env.values()):
+            value.release(close)
+
+    @contextmanager
+    def bind(self) -> Iterator['Context']:
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def __repr__(self):
+        return "<Context variables=%d saved_streams=%d>" % (len(self.env), len(self.saved_streams))
+
+contexts: 'WeakSet[Context]' = WeakSet()  # every context alive, for fstop.limits.live_bytes
+
+_current: ContextVar[Context] = ContextVar('fstop_context')
+
+def current() -> Context:
+    try:
+        return _current.get()
+    except LookupError:
+        raise RuntimeError('No F-Stop execution is running in this thread') from None
@@ -1,82 +1,105 @@
-from typing import Callable
+from typing import Callable, Optional
 
-import cv2 as cv
-import numpy as np
 from PIL import Image
 
-from .parser import parser, get_var
-from .objects import ImageRepr
+from .parser import parser, get_var, set_var
+from .objects import ImageRepr, FrameSequence, image_to_array, array_to_image
+from .tiles import TiledImage
+from .limits import reserve
+from .utils import LazyModule
 
-def _fromarray(arr: np.ndarray) -> Image.Image:
-    return Image.fromarray(
-        cv.cvtColor(
-            arr, cv.COLOR_BGR2RGB
-        )
-    )
+cv = LazyModule('cv2')
+np = LazyModule('numpy')
+
+def _color(arr: 'np.ndarray') -> 'np.ndarray':
+    """Drops the alpha channel of BGRA arrays, for functions that need 1 or 3 channels."""
+    return arr[..., :3] if arr.ndim == 3 and arr.shape[2] == 4 else arr
+
+def cv_process(img: str, operation: Callable, *args, halo: Optional[int] = None, **kwargs) -> Optional['np.ndarray']:
+    """Applies ``operation`` to the array of ``img``; ``halo`` is as in
+    :func:`fstop.parser.update`, for operations that can run in strips."""
+    img = get_var(img, (ImageRepr, FrameSequence))
+
+    def process_frame(image: Image.Image) -> Image.Image:
+        arr = operation(image_to_array(image), *args, **kwargs)
+        return array_to_image(arr[-1] if isinstance(arr, tuple) else arr)
+
+    if isinstance(img, FrameSequence):
+        return img.map(process_frame)
+    if isinstance(img, TiledImage) and img.store is not None and halo is not None:
+        return img.map(process_frame, halo)
 
-def cv_process(img: str, operation: Callable, *args, **kwargs) -> np.ndarray:
-    img = get_var(img)
     arr = operation(img.array, *args, **kwargs)
     if isinstance(arr, tuple):
         arr = arr[-1]
-    img.array = arr
-    img.image = _fromarray(arr)
+    img.array = arr  # the PIL view is rebuilt only when a PIL statement needs it
     return arr
 
 @parser.production('expr : CANNY variable number COMMA number')
-def canny_st(p: list) -> np.ndarray:
+def canny_st(p: list) -> 'np.ndarray':
+    # never split into strips: hysteresis follows edges across the whole
+    # image, and OpenCV already runs Canny on all cores by itself
     return cv_process(p[1], cv.Canny, p[2], p[4])
 
 @parser.production('expr : CVTCOLOR variable string')
-def colorspace_convert(p: list) -> np.ndarray:
+def colorspace_convert(p: list) -> 'np.ndarray':
     mapping = getattr(cv, 
         (p[2] if p[2].startswith('COLOR_') else 'COLOR_' + p[2]).upper()
     )
     return cv_process(p[1], cv.cvtColor, mapping)
 
 @parser.production('expr : NOT variable')
-def bitwise_not(p: list) -> np.ndarray:
-    return cv_process(p[1], cv.bitwise_not)
+def bitwise_not(p: list) -> 'np.ndarray':
+    return cv_process(p[1], cv.bitwise_not, halo=0)
 
 @parser.production('expr : THRESHOLD variable number COMMA number string')
-def threshold_st(p: list) -> np.ndarray:
-    return cv_process(p[1], cv.threshold, p[2], p[4], getattr(cv, p[5].upper()))
+def threshold_st(p: list) -> 'np.ndarray':
+    kind = getattr(cv, p[5].upper())
+    local = not kind & (cv.THRESH_OTSU | cv.THRESH_TRIANGLE)  # those pick the threshold from the whole histogram
+    return cv_process(p[1], cv.threshold, p[2], p[4], kind, halo=0 if local else None)
 
 @parser.production('expr : COLORMAP variable string')
-def apply_color_map(p: list) -> np.ndarray:
+def apply_color_map(p: list) -> 'np.ndarray':
     mapping = getattr(cv, 
         (p[2] if p[2].startswith('COLORMAP_') else 'COLORMAP_' + p[2]).upper()
     )
-    return cv_process(p[1], cv.applyColorMap, mapping)
+    return cv_process(p[1], lambda arr, mapping: cv.applyColorMap(_color(arr), mapping), mapping, halo=0)
 
 @parser.production('expr : variable INRANGE ntuple COMMA ntuple AS variable')
 def inrange_st(p: list) -> ImageRepr:
     img = get_var(p[0])
-    arr = cv.inRange(img.array, p[2], p[4])
-    img = ImageRepr(_fromarray(arr))
-    parser.env[p[-1]] = img
+    reserve(img.size, 'L')
+    arr = img.array
+    if arr.ndim == 3 and len(p[2]) < arr.shape[2]:
+        arr = _color(arr)  # bounds given for BGR only
+    arr = cv.inRange(arr, p[2], p[4])
+    img = ImageRepr(array=arr)
+    set_var(p[-1], img)
     return img
 
 @parser.production('expr : variable AND variable AS variable')
 def bitwise_and(p: list) -> ImageRepr:
     img, img2 = get_var(p[0]), get_var(p[2])
+    reserve(img.size, img.mode)
     arr = cv.bitwise_and(img.array, img2.array)
-    img = ImageRepr(_fromarray(arr))
-    parser.env[p[-1]] = img
+    img = ImageRepr(array=arr)
+    set_var(p[-1], img)
     return img
 
 @parser.production('expr : variable OR variable AS variable')
 def bitwise_or(p: list) -> ImageRepr:
     img, img2 = get_var(p[0]), get_var(p[2])
+    reserve(img.size, img.mode)
     arr = cv.bitwise_or(img.array, img2.array)
-    img = ImageRepr(_fromarray(arr))
-    parser.env[p[-1]] = img
+    img = ImageRepr(array=arr)
+    set_var(p[-1], img)
     return img
 
 @parser.production('expr : variable XOR variable AS variable')
 def bitwise_xor(p: list) -> ImageRepr:
     img, img2 = get_var(p[0]), get_var(p[2])
+    reserve(img.size, img.mode)
     arr = cv.bitwise_xor(img.array, img2.array)
-    img = ImageRepr(_fromarray(arr))
-    parser.env[p[-1]] = img
+    img = ImageRepr(array=arr)
+    set_var(p[-1], img)
     return img
\ No newline at end of file
@@ -0,0 +1,256 @@
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future
+from urllib.parse import SplitResult, unquote, urlsplit, urljoin
+from urllib.request import getproxies, proxy_bypass
+from threading import Lock
+
+import os
+import json
+import time
+import base64
+import hashlib
+import tempfile
+import http.client
+
+from .utils import LRUCache
+
+Address = Tuple[str, str, Optional[int], Optional[str]]  # scheme, host, port, proxy tunnelled through
+Entry = Tuple[bytes, Dict[str, str], float]  # body, validators (ETag, Last-Modified), when it was checked
+
+class Fetcher:
+    """Shared HTTP layer behind ``OPEN URL``.
+
+    * keeps idle keep-alive connections per host and reuses them,
+    * caches response bodies in memory, in an LRU bounded by ``max_bytes``,
+      for ``max_age`` seconds (``None`` for as long as they stay cached),
+    * optionally stores bodies in ``cache_dir``,
+    * revalidates stale bodies with ``If-None-Match`` / ``If-Modified-Since``
+      instead of downloading them again,
+    * coalesces concurrent requests for the same URL into one download,
+    * goes through ``proxies`` (``{scheme: proxy URL}``), by default those
+      of the environment (``http_proxy``, ``https_proxy``, ``no_proxy``).
+    """
+
+    headers = {'User-Agent': 'Mozilla/5.0'}
+
+    def __init__(
+        self, *,
+        max_bytes: int = 64 * 1024 * 1024,
+        cache_dir: Optional[str] = None,
+        max_idle: int = 4,
+        timeout: Optional[float] = 30.0,
+        max_redirects: int = 5,
+        max_age: Optional[float] = 60.0,
+        proxies: Optional[Dict[str, str]] = None
+    ) -> None:
+        self.memory = LRUCache(maxsize=None, maxbytes=max_bytes, sizeof=lambda entry: len(entry[0]))
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.proxies = getproxies() if proxies is None else proxies
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+
+        self.counters = dict.fromkeys(
+            ('revalidated', 'coalesced', 'requests', 'connections', 'bytes_fetched'), 0
+        )
+        self._idle: Dict[Address, List[http.client.HTTPConnection]] = {}
+        self._inflight: Dict[str, Future] = {}
+        self._lock = Lock()
+
+    def fetch(self, url: str) -> bytes:
+        entry = self.memory.get(url)
+        if entry is not None and (self.max_age is None or time.monotonic() - entry[2] < self.max_age):
+            return entry[0]
+
+        with self._lock:
+            future = self._inflight.get(url)
+            leader = future is None
+            if leader:
+                future = self._inflight[url] = Future()
+            else:
+                self.counters['coalesced'] += 1
+
+        if not leader:
+            return future.result()
+        try:
+            body, validators = self._fetch(url, entry)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            self.memory.put(url, (body, validators, time.monotonic()))
+            future.set_result(body)
+            return body
+        finally:
+            with self._lock:
+                del self._inflight[url]
+
+    def stats(self) -> Dict[str, int]:
+        memory = self.memory.stats()
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'hits': memory['hits'],
+            'misses': memory['misses'],
+            'evictions': memory['evictions'],
+            'bytes_cached': memory['bytes'],
+            **counters,
+        }
+
+    def _count(self, counter: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] += n
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    # disk tier
+
+    def _paths(self, url: str) -> Tuple[str, str]:
+        name = hashlib.sha1(url.encode()).hexdigest()
+        return (
+            os.path.join(self.cache_dir, name + '.body'),
+            os.path.join(self.cache_dir, name + '.json')
+        )
+
+    def _load(self, url: str) -> Tuple[Optional[bytes], Dict[str, str]]:
+        if not self.cache_dir:
+            return None, {}
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                return f.read(), meta
+        except (OSError, ValueError):
+            return None, {}
+
+    def _store(self, url: str, body: bytes, meta: Dict[str, str]) -> None:
+        if not self.cache_dir or not meta:
+            return  # nothing to revalidate against later
+        body_path, meta_path = self._paths(url)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for path, data, mode in ((body_path, body, 'wb'), (meta_path, json.dumps(meta), 'w')):
+                with tempfile.NamedTemporaryFile(mode, dir=self.cache_dir, delete=False) as f:
+                    f.write(data)
+                os.replace(f.name, path)
+        except OSError:
+            pass
+
+    # network
+
+    def _fetch(self, url: str, stale: Optional[Entry] = None) -> Tuple[bytes, Dict[str, str]]:
+        """The body of ``url`` and its validators, asking the server whether
+        ``stale`` (or the body in the disk tier) is still current."""
+        cached, meta = stale[:2] if stale is not None else self._load(url)
+        headers = dict(self.headers)
+        if cached is not None:
+            if 'ETag' in meta:
+                headers['If-None-Match'] = meta['ETag']
+            if 'Last-Modified' in meta:
+                headers['If-Modified-Since'] = meta['Last-Modified']
+
+        target = url
+        for _ in range(self.max_redirects + 1):
+            status, response_headers, body = self._request(target, headers)
+            if status in (301, 302, 303, 307, 308) and 'Location' in response_headers:
+                target = urljoin(target, response_headers['Location'])
+                continue
+            break
+
+        if status == 304 and cached is not None:
+            self._count('revalidated')
+            return cached, meta
+        if status >= 400 or status in (301, 302, 303, 307, 308):
+            raise RuntimeError('Could not fetch the image properly; status-code: %s' % status)
+
+        self._count('bytes_fetched', len(body))
+        meta = {
+            key: value for key in ('ETag', 'Last-Modified') if (value := response_headers.get(key))
+        }
+        self._store(url, body, meta)
+        return body, meta
+
+    def _request(self, url: str, headers: dict) -> Tuple[int, http.client.HTTPMessage, bytes]:
+        parts = urlsplit(url)
+        address = (parts.scheme, parts.hostname, parts.port, None)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        if (proxy := self._proxy(parts)) is not None:
+            if parts.scheme == 'https':
+                address = (parts.scheme, parts.hostname, parts.port, proxy.geturl())
+            else:  # plain HTTP is forwarded by the proxy, which takes the whole URL
+                address = (proxy.scheme, proxy.hostname, proxy.port, None)
+                path = parts._replace(fragment='').geturl()
+                headers = {**headers, **_proxy_headers(proxy)}
+
+        for attempt in range(2):
+            conn, reused = self._acquire(address)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                if reused and attempt == 0:
+                    continue  # the server dropped an idle keep-alive connection
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            self._count('requests')
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(address, conn)
+            return response.status, response.headers, body
+
+    def _acquire(self, address: Address) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if idle := self._idle.get(address):
+                return idle.pop(), True
+            self.counters['connections'] += 1
+
+        scheme, host, port, proxy = address
+        if proxy is not None:  # HTTPS is tunnelled through the proxy with CONNECT
+            proxy = urlsplit(proxy)
+            conn = http.client.HTTPSConnection(
+                proxy.hostname, proxy.port or (443 if proxy.scheme == 'https' else 80), timeout=self.timeout
+            )
+            conn.set_tunnel(host, port or 443, headers=_proxy_headers(proxy))
+            return conn, False
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout), False
+        elif scheme == 'http':
+            return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+        raise ValueError("Unsupported URL scheme '%s'" % scheme)
+
+    def _proxy(self, parts: SplitResult) -> Optional[SplitResult]:
+        if (proxy := self.proxies.get(parts.scheme)) is None or proxy_bypass(parts.hostname):
+            return None
+        return urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+
+    def _release(self, address: Address, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(address, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+def _proxy_headers(proxy: SplitResult) -> Dict[str, str]:
+    if proxy.username is None:
+        return {}
+    credentials = '%s:%s' % (unquote(proxy.username), unquote(proxy.password or ''))
+    return {'Proxy-Authorization': 'Basic ' + base64.b64encode(credentials.encode()).decode()}
+
+# process-wide fetcher; replace it to change the budget or enable the disk cache
+fetcher = Fetcher(cache_dir=os.environ.get('FSTOP_URL_CACHE_DIR') or None)
@@ -0,0 +1,44 @@
+from typing import Dict, Iterable, Tuple, Union
+
+import os
+
+from PIL import ImageFont
+
+from .utils import LRUCache
+
+FontSpec = Union[str, Tuple[str, float], Tuple[str, float, int]]
+
+class FontCache:
+    """Process-wide cache of the fonts loaded by ``FONT``.
+
+    Fonts are keyed by ``(path, size, index)``, so every ``TEXT`` statement
+    after the first one reuses the parsed face. Each FreeType face keeps its
+    file open, so at most ``maxsize`` fonts are kept, least recently used
+    ones being dropped first.
+    """
+
+    def __init__(self, maxsize: int = 64) -> None:
+        self.fonts = LRUCache(maxsize=maxsize)
+
+    def get(self, path: str, size: float = 10, index: int = 0) -> ImageFont.FreeTypeFont:
+        key = (path, size, index)
+        if (font := self.fonts.get(key)) is None:
+            font = ImageFont.truetype(path, size, index)
+            self.fonts.put(key, font)
+        return font
+
+    def preload(self, fonts: Iterable[FontSpec]) -> None:
+        """Loads ``fonts``, given as paths or ``(path, size[, index])`` tuples."""
+        for spec in fonts:
+            self.get(*((spec,) if isinstance(spec, str) else spec))
+
+    def stats(self) -> Dict[str, int]:
+        return self.fonts.stats()
+
+    def clear(self) -> None:
+        self.fonts.clear()
+
+    def __repr__(self):
+        return "<FontCache fonts=%d>" % len(self.fonts)
+
+fonts = FontCache(maxsize=int(os.environ.get('FSTOP_FONT_CACHE_SIZE', 64)))
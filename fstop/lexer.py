@@ -1,4 +1,10 @@
-from rply import LexerGenerator
+from typing import Dict, Iterator
+
+import re
+
+from rply import LexerGenerator, Token
+from rply.errors import LexingError
+from rply.token import SourcePosition
 
 generator = LexerGenerator()
 
@@ -119,4 +125,46 @@ generator.add('SUB', r'-')
 generator.add('MUL', r'\*')
 generator.add('DIV', r'/')
 generator.add('EXP', r'\^')
-generator.add('FLOOR_DIV', r'\|')
\ No newline at end of file
+generator.add('FLOOR_DIV', r'\|')
+
+class KeywordLexer:
+    """Lexer producing the same tokens as ``generator.build()``, in one pass.
+
+    rply tries every rule in turn at each position, so the ~100 keywords
+    are tried before any identifier, and a keyword also matches the start of
+    a longer word (``TOTAL`` lexes as ``TO`` + ``TAL``). Here the rules are
+    compiled into a single alternation, in their original order, except that
+    keywords (rules whose pattern is their own name) are replaced by the
+    ``identifier`` rule; each word it matches is then looked up in a dict.
+    """
+
+    def __init__(self, generator: LexerGenerator, identifier: str = 'VARIABLE') -> None:
+        self.keywords: Dict[str, str] = {}
+        patterns = ['(?P<_ignore>%s)' % '|'.join(rule.re.pattern for rule in generator.ignore_rules)]
+        for rule in generator.rules:
+            if rule.re.pattern == rule.name and rule.name.isidentifier():
+                self.keywords[rule.name] = rule.name
+            else:
+                patterns.append('(?P<%s>%s)' % (rule.name, rule.re.pattern))
+        self.identifier = identifier
+        self.re = re.compile('|'.join(patterns))
+
+    def lex(self, s: str) -> Iterator[Token]:
+        keywords, identifier = self.keywords, self.identifier
+        pos, lineno, last_nl = 0, 1, -1
+        for match in self.re.finditer(s):
+            start, end = match.span()
+            if start != pos:  # finditer skipped characters no rule matches
+                break
+            kind = match.lastgroup
+            if kind != '_ignore':
+                value = s[start:end]
+                if kind == identifier:
+                    kind = keywords.get(value, identifier)
+                yield Token(kind, value, SourcePosition(start, lineno, start - last_nl))
+            if (lines := s.count('\n', start, end)):
+                lineno += lines
+                last_nl = s.rfind('\n', start, end)
+            pos = end
+        if pos < len(s):
+            raise LexingError(None, SourcePosition(pos, lineno, pos - last_nl))
@@ -0,0 +1,93 @@
+from typing import Dict, Optional, Tuple, Any
+
+from PIL import Image
+
+from .context import Context, contexts, current
+from .objects import ImageRepr, FrameSequence
+from .tiles import TiledImage
+
+def pixel_bytes(mode: str) -> int:
+    """Bytes Pillow stores per pixel of ``mode``: one for 8 bit single band
+    modes, two for 16 bit ones and four for everything else."""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    elif mode.startswith('I;16'):
+        return 2
+    return 4
+
+def live_bytes(env: Optional[Dict[str, Any]] = None) -> int:
+    """Bytes of pixels held by the variables of ``env``, or of every
+    execution in this process when omitted. Images shared between variables
+    count once; tiled images and frames not decoded yet count nothing."""
+    if env is None:
+        return sum(live_bytes(context.env) for context in list(contexts))
+
+    seen, total = set(), 0
+    for value in list(env.values()):
+        if isinstance(value, TiledImage) and value.store is not None:
+            continue
+        if isinstance(value, ImageRepr):
+            images, arrays = [value._image], [value._array]
+        elif isinstance(value, FrameSequence):
+            images, arrays = [f for f in value.frames if isinstance(f, Image.Image)], []
+        else:
+            continue
+        for image in images:
+            if image is not None and id(image) not in seen:
+                seen.add(id(image))
+                total += image.width * image.height * pixel_bytes(image.mode)
+        for array in arrays:
+            if array is not None and id(array) not in seen:
+                seen.add(id(array))
+                total += array.nbytes
+    return total
+
+class Limits:
+    """Resource limits of one execution; ``None`` means unlimited.
+
+    ``max_pixels`` bounds the size of any one image, ``max_bytes`` the pixel
+    bytes held by all variables together (see :func:`live_bytes`) and
+    ``max_frames`` the length of sequences. Statements check them with
+    :func:`reserve` before allocating, and raise :class:`MemoryError`.
+    """
+
+    def __init__(
+        self, *,
+        max_pixels: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_frames: Optional[int] = None
+    ) -> None:
+        self.max_pixels = max_pixels
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+
+    def check(self, size: Tuple[int, int], mode: str, frames: int, context: Context, resident: bool = True) -> None:
+        pixels = max(size[0], 0) * max(size[1], 0)
+        if self.max_pixels is not None and pixels > self.max_pixels:
+            raise MemoryError('Image of %dx%d pixels exceeds the limit of %d pixels' % (*size, self.max_pixels))
+        self.check_frames(frames)
+        if self.max_bytes is not None and resident:
+            needed = pixels * pixel_bytes(mode) * frames
+            if (live := live_bytes(context.env)) + needed > self.max_bytes:
+                raise MemoryError('Allocating %d more bytes of pixels (%d live) exceeds the limit of %d bytes' % (
+                    needed, live, self.max_bytes
+                ))
+
+    def check_frames(self, frames: int) -> None:
+        if self.max_frames is not None and frames > self.max_frames:
+            raise MemoryError('Sequence of %d frames exceeds the limit of %d frames' % (frames, self.max_frames))
+
+    def __repr__(self):
+        return "<Limits max_pixels=%s max_bytes=%s max_frames=%s>" % (self.max_pixels, self.max_bytes, self.max_frames)
+
+def reserve(size: Tuple[int, int], mode: str, frames: int = 1, *, resident: bool = True) -> None:
+    """Raises :class:`MemoryError` if ``frames`` new images of ``size`` and
+    ``mode`` would break the limits of the running execution. ``resident``
+    is false for images that will not be held in memory (tiled ones)."""
+    context = current()
+    if context.limits is not None:
+        context.limits.check(size, mode, frames, context, resident)
+
+def reserve_frames(frames: int) -> None:
+    if (limits := current().limits) is not None:
+        limits.check_frames(frames)
@@ -0,0 +1,202 @@
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, TextIO, Union
+from collections import Counter
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+
+import os
+import time
+import tempfile
+import warnings
+
+from .context import contexts
+from .limits import live_bytes
+from .objects import ImageRepr, FrameSequence
+from .tiles import TiledImage
+
+if TYPE_CHECKING:
+    from .program import Node
+
+Target = Union[str, TextIO, Callable[[str], Any]]  # a path, a text file or a callback
+
+def pixels(value: Any) -> int:
+    """Pixels of an image variable, 0 for anything else (or a released one)."""
+    if isinstance(value, TiledImage) and value.store is not None \
+            or isinstance(value, ImageRepr) and (value._image is not None or value._array is not None):
+        width, height = value.size
+        return width * height
+    return 0
+
+class Registry:
+    """Process-wide aggregates of what the interpreter did, across every
+    execution of every runner, for long-running workers to export.
+
+    Nothing is recorded until :meth:`enable` is called; until then the only
+    cost is one attribute check per statement. Statements merged by the
+    optimizer are counted once each, sharing their group's latency evenly.
+    """
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = Lock()
+        self._dump_lock = Lock()
+        self.clear()
+
+    def enable(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+
+    def clear(self) -> None:
+        with self._lock:
+            self.latencies: Dict[str, List[float]] = {}  # statement: [count, sum, *bucket counts]
+            self.errors: Counter = Counter()
+            self.pixels: Counter = Counter()
+            self.bytes: Counter = Counter()  # 'decode' / 'encode'
+
+    def observe(self, statement: str, seconds: float, pixels: int = 0, error: bool = False) -> None:
+        with self._lock:
+            if (row := self.latencies.get(statement)) is None:
+                row = self.latencies[statement] = [0, 0.0] + [0] * len(self.buckets)
+            row[0] += 1
+            row[1] += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    row[2 + i] += 1
+                    break
+            self.pixels[statement] += pixels
+            if error:
+                self.errors[statement] += 1
+
+    def add_bytes(self, kind: str, count: int) -> None:
+        if self.enabled:
+            with self._lock:
+                self.bytes[kind] += count
+
+    @contextmanager
+    def statement(self, node: 'Node', env: Dict[str, Any]) -> Iterator[None]:
+        """Times a top level statement (or group) into the registry."""
+        error = False
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            used = sum(pixels(env.get(name)) for name in set(node.names()))
+            nodes = getattr(node, 'nodes', None) or [node]
+            for inner in nodes:
+                self.observe(inner.name, seconds / len(nodes), used // len(nodes), error)
+
+    def to_prometheus(self) -> str:
+        """The registry in the Prometheus text exposition format."""
+        with self._lock:
+            latencies = {name: list(row) for name, row in self.latencies.items()}
+            errors, pixels, bytes_ = Counter(self.errors), Counter(self.pixels), Counter(self.bytes)
+
+        images = 0
+        for context in list(contexts):
+            for value in list(context.env.values()):
+                if isinstance(value, ImageRepr):
+                    images += 1
+                elif isinstance(value, FrameSequence):
+                    images += len(value)
+
+        lines = [
+            '# HELP fstop_statement_seconds Latency of F-Stop statements, by production.',
+            '# TYPE fstop_statement_seconds histogram',
+        ]
+        for name, (count, total, *counts) in sorted(latencies.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append('fstop_statement_seconds_bucket{statement="%s",le="%g"} %d' % (name, bound, cumulative))
+            lines.append('fstop_statement_seconds_bucket{statement="%s",le="+Inf"} %d' % (name, count))
+            lines.append('fstop_statement_seconds_sum{statement="%s"} %.9f' % (name, total))
+            lines.append('fstop_statement_seconds_count{statement="%s"} %d' % (name, count))
+
+        lines += [
+            '# HELP fstop_statement_errors_total Statements that raised, by production.',
+            '# TYPE fstop_statement_errors_total counter',
+        ] + ['fstop_statement_errors_total{statement="%s"} %d' % item for item in sorted(errors.items())]
+        lines += [
+            '# HELP fstop_pixels_total Pixels of the images each statement used, after it ran.',
+            '# TYPE fstop_pixels_total counter',
+        ] + ['fstop_pixels_total{statement="%s"} %d' % item for item in sorted(pixels.items())]
+        for kind, text in (('decode', 'read by OPEN'), ('encode', 'written by SAVE')):
+            lines += [
+                '# HELP fstop_%s_bytes_total Bytes of encoded images %s.' % (kind, text),
+                '# TYPE fstop_%s_bytes_total counter' % kind,
+                'fstop_%s_bytes_total %d' % (kind, bytes_[kind]),
+            ]
+        lines += [
+            '# HELP fstop_live_images Images held by variables of live executions.',
+            '# TYPE fstop_live_images gauge',
+            'fstop_live_images %d' % images,
+            '# HELP fstop_live_pixel_bytes Pixel bytes held by variables of live executions.',
+            '# TYPE fstop_live_pixel_bytes gauge',
+            'fstop_live_pixel_bytes %d' % live_bytes(),
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, target: Target) -> None:
+        """Writes :meth:`to_prometheus` to a path (through a temporary file
+        in the same directory, replaced atomically for node_exporter's
+        textfile collector), a text file or a callback. Dumps from several
+        threads are serialized."""
+        text = self.to_prometheus()
+        with self._dump_lock:
+            if callable(target):
+                target(text)
+            elif isinstance(target, str):
+                fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)), suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as f:
+                        f.write(text)
+                    os.replace(temp, target)
+                except BaseException:
+                    try:
+                        os.remove(temp)
+                    except OSError:
+                        pass
+                    raise
+            else:
+                target.write(text)
+
+    def __repr__(self):
+        return "<Registry enabled=%s statements=%d>" % (self.enabled, len(self.latencies))
+
+registry = Registry()
+
+class Exporter:
+    """Dumps ``registry`` to ``target`` every ``interval`` seconds from a
+    daemon thread, and once more on :meth:`stop`. Failed dumps are reported
+    as warnings and retried at the next interval."""
+
+    def __init__(self, target: Target, interval: float, registry: Registry = registry) -> None:
+        self.target = target
+        self.interval = interval
+        self.registry = registry
+        self._stopped = Event()
+        self._thread: Optional[Thread] = Thread(target=self._run, name='fstop-metrics', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self) -> None:
+        try:
+            self.registry.dump(self.target)
+        except Exception as exc:
+            warnings.warn('Could not dump metrics to %r: %s' % (self.target, exc), RuntimeWarning)
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self.dump()
+
+    def __repr__(self):
+        return "<Exporter target=%r interval=%s>" % (self.target, self.interval)
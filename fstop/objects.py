@@ -1,25 +1,246 @@
-import numpy as np
-import cv2 as cv
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+from collections import Counter
+from threading import Lock
+from io import BytesIO
+
+import os
+
+from PIL import Image, ImageSequence
 from rply.token import BaseBox
 
+from .utils import LazyModule, LRUCache
+
+np = LazyModule('numpy')
+cv = LazyModule('cv2')
+futures = LazyModule('concurrent.futures.thread')
+
+_pool = None
+_pool_lock = Lock()
+
+def frame_pool() -> 'futures.ThreadPoolExecutor':
+    """The thread pool frames of sequences are processed on; Pillow and OpenCV
+    release the GIL while they work on pixels."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = futures.ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix='fstop-frames')
+        return _pool
+
+# how often each view had to be rebuilt from the other (see benchmarks/views.py)
+conversions = Counter()
+
+def image_to_array(image: Image.Image) -> 'np.ndarray':
+    """OpenCV view of ``image``: BGR(A) for colour modes, 2D for single band ones."""
+    if image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    elif image.mode in ('1', 'LA', 'PA', 'La'):
+        image = image.convert('L' if image.mode == '1' else 'RGBA')
+    elif image.mode not in ('L', 'I', 'F', 'I;16', 'RGB', 'RGBA'):
+        image = image.convert('RGB')
+
+    arr = np.asarray(image)
+    if image.mode == 'RGB':
+        return cv.cvtColor(arr, cv.COLOR_RGB2BGR)
+    elif image.mode == 'RGBA':
+        return cv.cvtColor(arr, cv.COLOR_RGBA2BGRA)
+    return arr  # single band images are shared as they are
+
+def array_to_image(arr: 'np.ndarray') -> Image.Image:
+    if arr.ndim == 3 and arr.shape[2] == 3:
+        return Image.fromarray(cv.cvtColor(arr, cv.COLOR_BGR2RGB))
+    elif arr.ndim == 3 and arr.shape[2] == 4:
+        return Image.fromarray(cv.cvtColor(arr, cv.COLOR_BGRA2RGBA))
+    elif arr.ndim == 3 and arr.shape[2] == 1:
+        arr = arr[..., 0]
+    return Image.fromarray(arr)  # single band arrays are wrapped without a copy
+
 class ImageRepr(BaseBox):
+    """An image variable, viewable both as a PIL image and as an OpenCV array.
+
+    Only one view is authoritative at a time; assigning ``image`` or ``array``
+    drops the other one, which is rebuilt on its next read. ``size`` and
+    ``mode`` are answered from whichever view is current. Code that modifies
+    ``image`` in place (drawing, pasting, ...) must call :meth:`touch`.
+    """
+
+    def __init__(self, image: Image.Image = None, *, array: 'np.ndarray' = None) -> None:
+        self._image = image
+        self._array = array
+
+    @property
+    def image(self) -> Image.Image:
+        if self._image is None:
+            conversions['image'] += 1
+            self._image = array_to_image(self._array)
+        return self._image
+
+    @image.setter
+    def image(self, image: Image.Image) -> None:
+        self._image = image
+        self._array = None
+
+    @property
+    def array(self) -> 'np.ndarray':
+        if self._array is None:
+            conversions['array'] += 1
+            self._array = image_to_array(self._image)
+        return self._array
+
+    @array.setter
+    def array(self, arr: 'np.ndarray') -> None:
+        self._array = arr
+        self._image = None
+
+    @property
+    def size(self) -> tuple:
+        if self._image is None:
+            return self._array.shape[1], self._array.shape[0]
+        return self._image.size
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    @property
+    def mode(self) -> str:
+        if self._image is None and self._array.dtype == np.uint8:
+            # the mode array_to_image would produce, without converting
+            channels = 1 if self._array.ndim == 2 else self._array.shape[2]
+            return {1: 'L', 3: 'RGB', 4: 'RGBA'}[channels]
+        return self.image.mode
+
+    def touch(self) -> None:
+        """Marks the PIL image as modified in place."""
+        self._array = None
+
+    def copy(self) -> 'ImageRepr':
+        return ImageRepr(self.image.copy())
+
+    def release(self, close: bool = True) -> None:
+        """Drops both views, closing the PIL image with ``close``."""
+        image, self._image, self._array = self._image, None, None
+        if image is not None and close:
+            image.close()
 
-    def __init__(self, image):
-        self.image = image
-        self.array = self._get_arr()
-
-    def _get_arr(self):
-        return cv.cvtColor(
-            np.asarray(self.image), 
-            cv.COLOR_RGB2BGR
-        )
-    
     def __repr__(self):
         return "<ImageRepr image='%s'>" % self.image
 
-    def __getattribute__(self, attr: str):
-        if attr == 'array':
-            self.array = arr = self._get_arr()
-            return arr
+class FrameSource:
+    """A multi-frame image that frames are decoded from on demand.
+
+    Seeking mutates the image, so decoding is serialized; recently decoded
+    frames are kept in an LRU of ``cache`` entries.
+    """
+
+    def __init__(self, image: Image.Image, cache: int = 8) -> None:
+        self.image = image
+        self.length = image.n_frames
+        self.frames = LRUCache(maxsize=cache)
+        self._lock = Lock()
+
+    @classmethod
+    def reopen(cls, image: Image.Image) -> Optional['FrameSource']:
+        """A source with its own handle on the file ``image`` was read from,
+        so decoding frames does not move the variable's current frame."""
+        fp = getattr(image, 'fp', None)
+        if isinstance(fp, BytesIO):
+            return cls(Image.open(BytesIO(fp.getvalue())))
+        elif getattr(image, 'filename', None):
+            with open(image.filename, 'rb') as f:  # read whole, sources are never closed explicitly
+                return cls(Image.open(BytesIO(f.read())))
+
+    def frame(self, index: int, *, cache: bool = True) -> Image.Image:
+        if (frame := self.frames.get(index)) is not None:
+            return frame
+        with self._lock:
+            self.image.seek(index)
+            frame = self.image.copy()
+        if cache:
+            self.frames.put(index, frame)
+        return frame
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __repr__(self):
+        return "<FrameSource frames=%d cached=%d>" % (self.length, len(self.frames))
+
+Frame = Union[Image.Image, Tuple[FrameSource, int]]
+
+class FrameSequence(BaseBox):
+    """The frames of an animation, as produced by ``SEQUENCE`` and ``[a, b]``.
+
+    Frames are either PIL images or references into a :class:`FrameSource`,
+    decoded only when indexed; ``len`` never decodes anything. Iterating
+    decodes one frame at a time without caching, which is how ``SAVE``
+    hands frames to the encoder; WebP and TIFF encode them as they come,
+    but Pillow's GIF and APNG encoders still keep every frame until the end.
+    """
+
+    def __init__(self, frames: Iterable[Frame] = ()) -> None:
+        self.frames: List[Frame] = list(frames)
+
+    @classmethod
+    def of(cls, image: Image.Image) -> 'FrameSequence':
+        if getattr(image, 'n_frames', 1) == 1:
+            return cls([image.copy()])
+        if (source := FrameSource.reopen(image)) is not None:
+            return cls((source, index) for index in range(len(source)))
+        # no file to reopen: copy every frame now, then go back to the current one
+        current = image.tell()
+        try:
+            return cls([frame.copy() for frame in ImageSequence.Iterator(image)])
+        finally:
+            image.seek(current)
+
+    @staticmethod
+    def decode(frame: Frame, *, cache: bool = True) -> Image.Image:
+        if isinstance(frame, tuple):
+            source, index = frame
+            return source.frame(index, cache=cache)
+        return frame
+
+    def append(self, image: Image.Image) -> None:
+        self.frames.append(image)
+
+    def release(self, close: bool = True) -> None:
+        self.frames = []  # frames may be shared with other variables, never closed
+
+    def map(self, func: Callable[[Image.Image], Image.Image]) -> None:
+        """Replaces every frame with ``func(frame)``.
+
+        Frames are processed in parallel on :func:`frame_pool`; their order
+        and durations are kept. ``func`` must not modify its argument, frames
+        can be shared with variables or with other frames.
+        """
+        def apply(frame: Frame) -> Image.Image:
+            image = self.decode(frame, cache=False)
+            result = func(image)
+            if 'duration' in image.info:
+                result.info['duration'] = image.info['duration']
+            return result
+
+        if len(self.frames) > 1:
+            self.frames = list(frame_pool().map(apply, self.frames))
         else:
-            return super().__getattribute__(attr)
\ No newline at end of file
+            self.frames = [apply(frame) for frame in self.frames]
+
+    def __getitem__(self, index: int) -> Image.Image:
+        return self.decode(self.frames[index])
+
+    def __iter__(self) -> Iterator[Image.Image]:
+        for frame in self.frames:
+            yield self.decode(frame, cache=False)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __add__(self, other: 'FrameSequence') -> 'FrameSequence':
+        return FrameSequence(self.frames + other.frames)
+
+    def __repr__(self):
+        return "<FrameSequence frames=%d>" % len(self)
@@ -1,29 +1,47 @@
 
-from typing import Callable, TypeVar
+from typing import Callable, Iterator, List, Optional, Tuple, TypeVar, Union
+from contextvars import ContextVar
+from contextlib import contextmanager
 from functools import wraps
 
 from PIL import Image as Module
 from PIL import ImageOps, ImageDraw, ImageFont, ImageFilter, ImageEnhance
 from PIL.Image import Image
 
-from .parser import parser, get_var
-from .objects import ImageRepr
+from .parser import parser, get_var, update, reserve_for
+from .context import current
+from .objects import ImageRepr, FrameSequence
+from .tiles import TiledImage, halo, in_strips
+from .fonts import fonts
+
+# operations whose output pixels only depend on the input pixels of the same row
+LOCAL = {
+    ImageOps.invert: 0,
+    ImageOps.grayscale: 0,
+    ImageOps.mirror: 0,
+    ImageOps.solarize: 0,
+    ImageOps.posterize: 0,
+}
 
 def operation(p: list, operation: Callable, *args, **kwargs) -> None:
-    image = get_var(p[1])
-    image.image = operation(
-        image.image,
+    local = halo(args[0]) if operation is Image.filter else LOCAL.get(operation)
+    func = lambda image: operation(
+        image,
         *args, **kwargs
     )
+    if operation is Image.filter and local is not None and (pixels := current().strip_pixels) is not None:
+        plain = func
+        func = lambda image: in_strips(image, plain, local) if image.width * image.height >= pixels else plain(image)
+    update(p[1], func, halo=local)
 
 RT = TypeVar('RT')
 
-def basic_operation(operation: Callable[[Image, ...], Image], *args, **kwargs) -> Callable[[Callable[[list], ...]], RT]:
+def basic_operation(method: Callable[[Image, ...], Image], *args, **kwargs) -> Callable[[Callable[[list], ...]], RT]:
     def decorator(func: Callable[[list], RT]) -> Callable[[list], RT]:
         @wraps(func)
         def inner(p: list) -> None:
             func(p)  # Just in case
-            return operation(p, operation, *args, **kwargs)
+            return operation(p, method, *args, **kwargs)
         
         return inner
     return decorator
@@ -69,18 +87,21 @@ def poster_op(p: list) -> None:
 @parser.production('expr : PAD variable ntuple color')
 def pad_op(p: list) -> None:
     color = p[-1] if len(p) == 4 else None
+    reserve_for(p[1], p[2])
     return operation(p, ImageOps.pad, size=p[2], color=color)
 
 @parser.production('expr : SCALE variable number')
 @parser.production('expr : SCALE variable number number')
 def scale_op(p: list) -> None:
     resample = p[-1] if len(p) == 4 else 3
+    reserve_for(p[1], lambda size: (round(size[0] * p[2]), round(size[1] * p[2])))
     return operation(p, ImageOps.scale, factor=p[2], resample=resample)
 
 @parser.production('expr : EXPAND variable number')
 @parser.production('expr : EXPAND variable number color')
 def expand_op(p: list) -> None:
     fill = p[-1] if len(p) == 4 else 0
+    reserve_for(p[1], lambda size: (size[0] + 2 * p[2], size[1] + 2 * p[2]))
     return operation(p, ImageOps.expand, border=p[2], fill=fill)
 
 @parser.production('expr : EQUALIZE variable')
@@ -93,6 +114,7 @@ def equalize_op(p: list) -> None:
 @parser.production('expr : FIT variable ntuple number')
 def fit_op(p: list) -> None:
     bleed = p[-1] if len(p) == 4 else 3
+    reserve_for(p[1], p[2])
     return operation(p, ImageOps.fit, size=p[2], bleed=bleed)
 
 # filters
@@ -159,20 +181,54 @@ def median_filter(p: list) -> None:
 
 # ImageDraw operations
 
-def draw(img: str, operation: str, *args, **kwargs) -> ImageDraw.Draw:
-    img = get_var(img)
-    cursor = ImageDraw.Draw(img.image)
-    operation = getattr(cursor, operation)
-    operation(*args, **kwargs)
+Primitive = Tuple[str, tuple, dict]  # ImageDraw method, args, kwargs
+
+_recording: ContextVar[Optional[List[Primitive]]] = ContextVar('fstop_draw_recording', default=None)
+
+@contextmanager
+def recording() -> Iterator[List[Primitive]]:
+    """Makes :func:`draw` collect the primitives it is asked for instead of
+    drawing them, so they can be replayed with :func:`replay` at once."""
+    calls = []
+    token = _recording.set(calls)
+    try:
+        yield calls
+    finally:
+        _recording.reset(token)
+
+def replay(img: Union[ImageRepr, FrameSequence], calls: List[Primitive]) -> Optional[ImageDraw.Draw]:
+    """Draws ``calls`` on ``img`` with a single cursor (one per frame for sequences)."""
+    def draw_all(image: Image) -> ImageDraw.Draw:
+        cursor = ImageDraw.Draw(image)
+        for operation, args, kwargs in calls:
+            getattr(cursor, operation)(*args, **kwargs)
+        return cursor
+
+    if isinstance(img, FrameSequence):
+        def draw_frame(image: Image) -> Image:
+            image = image.copy()  # frames may be shared, draw on a copy of each
+            draw_all(image)
+            return image
+        return img.map(draw_frame)
+
+    cursor = draw_all(img.image)
+    img.touch()
     return cursor
 
+def draw(img: str, operation: str, *args, **kwargs) -> Optional[ImageDraw.Draw]:
+    if (calls := _recording.get()) is not None:
+        calls.append((operation, args, kwargs))
+        return None
+    img = get_var(img, (ImageRepr, FrameSequence))
+    return replay(img, [(operation, args, kwargs)])
+
 @parser.production('font : FONT string')
 @parser.production('font : FONT LEFT_PAREN string COMMA number RIGHT_PAREN')
 def get_font(p: list) -> ImageFont.FreeTypeFont:
     if len(p) == 2:
-        return ImageFont.truetype(p[1])
+        return fonts.get(p[1])
     else:
-        return ImageFont.truetype(p[2], p[4])
+        return fonts.get(p[2], p[4])
 
 @parser.production('expr : TEXT variable string ntuple')
 @parser.production('expr : TEXT variable string ntuple font')
@@ -180,7 +236,7 @@ def get_font(p: list) -> ImageFont.FreeTypeFont:
 @parser.production('expr : TEXT variable string ntuple font color')
 def write_text(p: list) -> ImageDraw.Draw:
     coords, text = p[3], p[2]
-    fill = p[-1] if len(p) > 4 and not isinstance(p, ImageFont.FreeTypeFont) else None
+    fill = p[-1] if len(p) > 4 and not isinstance(p[-1], ImageFont.FreeTypeFont) else None
     font = p[4] if len(p) > 4 and isinstance(p[4], ImageFont.FreeTypeFont) else None
     return draw(p[1], 'multiline_text', xy=coords, text=text, fill=fill, font=font)
 
@@ -270,8 +326,12 @@ def draw_rec_w(p: list) -> ImageDraw.Draw:
 
 # ImageEnhance operations
 
-def enhance(p: list, operation: str) -> ImageEnhance._Enhance:
-    img, degree = get_var(p[1]), p[-1]
+def enhance(p: list, operation: str) -> Optional[ImageEnhance._Enhance]:
+    img, degree = get_var(p[1], (ImageRepr, FrameSequence)), p[-1]
+    if isinstance(img, FrameSequence):
+        return img.map(lambda image: getattr(ImageEnhance, operation)(image).enhance(degree))
+    if isinstance(img, TiledImage) and img.store is not None and operation != 'Contrast':  # contrast needs the mean of the whole image
+        return img.map(lambda image: getattr(ImageEnhance, operation)(image).enhance(degree))
     enhancer = getattr(ImageEnhance, operation)(img.image)
     img.image = enhancer.enhance(degree)
     return enhancer
@@ -285,7 +345,7 @@ def contrast(p: list) -> ImageEnhance.Contrast:
     return enhance(p, 'Contrast')
 
 @parser.production('expr : COLORIZE variable number')
-def brighten(p: list) -> ImageEnhance.Color:
+def colorize(p: list) -> ImageEnhance.Color:
     return enhance(p, 'Color')
 
 # ImageTransform operations
@@ -293,6 +353,6 @@ def brighten(p: list) -> ImageEnhance.Color:
 @parser.production('expr : DISTORT variable ntuple string ntuple')
 @parser.production('expr : DISTORT variable ntuple string ntuple color')
 def transform(p: list) -> int:
-    img = get_var(p[1])
     fill = p[-1] if len(p) == 6 else None
-    img.image = img.image.transform(p[2], method=getattr(Module, p[3].upper()), data=p[4], fillcolor=fill)
+    reserve_for(p[1], p[2])
+    update(p[1], lambda image: image.transform(p[2], method=getattr(Module, p[3].upper()), data=p[4], fillcolor=fill))
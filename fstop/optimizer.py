@@ -0,0 +1,534 @@
+from typing import Callable, Dict, List, Optional, Tuple, Any
+
+import math
+
+from PIL import Image, ImageOps, ImageEnhance, ImageStat
+
+from .operations import (
+    invert_op, solar_op, poster_op, brighten, contrast,
+    mirror_op, flip_op, scale_op, fit_op, transform,
+    write_text, draw_line, draw_line_w, draw_ellipse, draw_ellipse_w, draw_dot,
+    draw_arc, draw_arc_w, draw_chord, draw_chord_w, draw_polygon, draw_reg_polygon,
+    draw_rec, draw_rec_w, Primitive, recording, replay
+)
+from .objects import ImageRepr, FrameSequence
+from .tiles import TiledImage
+from .parser import (
+    get_var, open_statement, resize_statement, rotate_statement, crop_statement, reduce_st, echo
+)
+from .limits import reserve
+from .program import Group, Node, Pass
+from .utils import LRUCache
+
+def constant(node: Node) -> bool:
+    """Whether every argument of ``node`` was folded at compile time."""
+    return not any(isinstance(arg, Node) for arg in node.args)
+
+def target(node: Node) -> Optional[str]:
+    """The variable a ``<KEYWORD> variable ...`` statement operates on."""
+    return node.args[1] if len(node.args) > 1 and isinstance(node.args[1], str) else None
+
+def runs(statements: List[Node], fusible: Callable[[Node, List[Node]], bool], group: Callable[[List[Node]], Group]) -> List[Node]:
+    """Replaces every run of two or more consecutive statements accepted by
+    ``fusible(node, run)`` with ``group(run)``."""
+    out, run = [], []
+
+    def flush() -> None:
+        out.extend([group(list(run))] if len(run) > 1 else run)
+        run.clear()
+
+    for node in statements:
+        if run and fusible(node, run):
+            run.append(node)
+            continue
+        flush()
+        if fusible(node, run):
+            run.append(node)
+        else:
+            out.append(node)
+    flush()
+    return out
+
+# point operations
+
+POINT_OPS: Dict[Callable, Callable[[Image.Image, list], Image.Image]] = {
+    invert_op: lambda image, p: ImageOps.invert(image),
+    solar_op: lambda image, p: ImageOps.solarize(image, p[-1] if len(p) == 3 else 128),
+    poster_op: lambda image, p: ImageOps.posterize(image, p[-1] if len(p) == 3 else 4),
+    brighten: lambda image, p: ImageEnhance.Brightness(image).enhance(p[-1]),
+}
+
+def _valid_point_op(node: Node) -> bool:
+    """Whether the arguments of ``node`` pass the checks its statement makes,
+    which the lookup table would skip."""
+    if node.func is poster_op:
+        return len(node.args) == 2 or 1 <= node.args[-1] <= 8
+    return True
+
+tables = LRUCache(maxsize=1024)
+
+class PointChain(Group):
+    """Consecutive point operations on one variable, applied as one lookup
+    table per band.
+
+    The table is built by running the same operations on a 256 pixel ramp,
+    so the result is bit-identical to running them one by one. ``CONTRAST``
+    depends on the mean of the image it is applied to, so it may only start a
+    chain, where that mean is measured on the real input.
+    """
+    modes = ('L', 'RGB')
+
+    def __init__(self, nodes: List[Node]) -> None:
+        super().__init__(nodes)
+        self.key = tuple(
+            (node.name, tuple(arg for arg in node.args[2:])) for node in nodes
+        )
+
+    def table(self, image: Image.Image) -> List[int]:
+        mean = None
+        if self.nodes[0].func is contrast:
+            gray = image if image.mode == 'L' else image.convert('L')
+            mean = int(ImageStat.Stat(gray).mean[0] + 0.5)
+
+        key = (image.mode, mean, self.key)
+        if (lut := tables.get(key)) is not None:
+            return lut
+
+        ramp = Image.frombytes('L', (256, 1), bytes(range(256)))
+        ramp = ramp if image.mode == 'L' else Image.merge(image.mode, [ramp] * len(image.getbands()))
+        for node in self.nodes:
+            if node.func is contrast:
+                degenerate = Image.new('L', ramp.size, mean).convert(ramp.mode)
+                ramp = Image.blend(degenerate, ramp, node.args[-1])
+            else:
+                ramp = POINT_OPS[node.func](ramp, node.args)
+
+        lut = [value for band in ramp.split() for value in band.tobytes()]
+        tables.put(key, lut)
+        return lut
+
+    def eval(self) -> List[Any]:
+        img = get_var(target(self.nodes[0]), (ImageRepr, FrameSequence))
+        if not isinstance(img, ImageRepr) or img.mode not in self.modes:
+            return self.fallback()  # sequences run statement by statement, each over all frames
+        if isinstance(img, TiledImage) and img.store is not None:
+            if self.nodes[0].func is contrast:
+                return self.fallback()  # the mean has to be measured on the whole image
+            try:
+                img.map(lambda image: image.point(self.table(image)))
+            except Exception:
+                return self.fallback()
+            return [None] * len(self.nodes)
+        try:
+            lut = self.table(img.image)
+        except Exception:
+            return self.fallback()  # e.g. an invalid POSTERIZE value, raised by the statement itself
+        img.image = img.image.point(lut)
+        return [None] * len(self.nodes)
+
+def fuse_point_ops(statements: List[Node]) -> List[Node]:
+    def fusible(node: Node, run: List[Node]) -> bool:
+        if not (node.func in POINT_OPS or node.func is contrast) or not constant(node) or not _valid_point_op(node):
+            return False  # invalid statements run alone, and raise
+        return not run or (node.func is not contrast and target(node) == target(run[0]))
+
+    return runs(statements, fusible, PointChain)
+
+# geometric transforms
+
+Matrix = Tuple[float, ...]  # row-major 3x3, mapping output coordinates to input ones
+Size = Tuple[int, int]
+Step = Tuple[Matrix, Size, Optional[int]]  # resample is None when pixels are only moved
+
+IDENTITY = (1, 0, 0, 0, 1, 0, 0, 0, 1)
+
+def matmul(m: Matrix, n: Matrix) -> Matrix:
+    return tuple(
+        sum(m[row * 3 + k] * n[k * 3 + col] for k in range(3))
+        for row in range(3) for col in range(3)
+    )
+
+def affine_inverse(m: Matrix) -> Matrix:
+    a, b, c, d, e, f = m[:6]
+    det = a * e - b * d
+    return (
+        e / det, -b / det, (b * f - c * e) / det,
+        -d / det, a / det, (c * d - a * f) / det,
+        0, 0, 1,
+    )
+
+def _sized(size: Any) -> bool:
+    return isinstance(size, tuple) and len(size) == 2 and all(isinstance(v, int) and v > 0 for v in size)
+
+def _resize(p: list, size: Size) -> Optional[Step]:
+    if not _sized(new := p[-1]):
+        return None
+    return (size[0] / new[0], 0, 0, 0, size[1] / new[1], 0, 0, 0, 1), new, Image.BICUBIC
+
+def _scale(p: list, size: Size) -> Optional[Step]:
+    factor = p[2]
+    if factor == 1:
+        return IDENTITY, size, None
+    new = round(factor * size[0]), round(factor * size[1])
+    if factor <= 0 or not _sized(new):
+        return None
+    return (size[0] / new[0], 0, 0, 0, size[1] / new[1], 0, 0, 0, 1), new, p[-1] if len(p) == 4 else Image.BICUBIC
+
+def _crop(p: list, size: Size) -> Optional[Step]:
+    if len(p) == 2:
+        return IDENTITY, size, None
+    left, top, right, bottom = map(int, map(round, p[-1]))
+    if not _sized((right - left, bottom - top)):
+        return None
+    return (1, 0, left, 0, 1, top, 0, 0, 1), (right - left, bottom - top), None
+
+def _mirror(p: list, size: Size) -> Step:
+    return (-1, 0, size[0], 0, 1, 0, 0, 0, 1), size, None
+
+def _flip(p: list, size: Size) -> Step:
+    return (1, 0, 0, 0, -1, size[1], 0, 0, 1), size, None
+
+def _rotate(p: list, size: Size) -> Step:
+    angle = p[-1] % 360.0
+    if angle == 0:
+        return IDENTITY, size, None
+    # the matrix Image.rotate builds, which only moves pixels for multiples of 90 degrees it transposes
+    w, h = size
+    radians = -math.radians(angle)
+    cos, sin = round(math.cos(radians), 15), round(math.sin(radians), 15)
+    matrix = (
+        cos, sin, cos * -w / 2 + sin * -h / 2 + w / 2,
+        -sin, cos, -sin * -w / 2 + cos * -h / 2 + h / 2,
+        0, 0, 1,
+    )
+    moved = angle == 180 or (angle in (90, 270) and w == h)
+    return matrix, size, None if moved else Image.NEAREST
+
+def _distort(p: list, size: Size) -> Optional[Step]:
+    new, method, data = p[2], p[3].upper(), p[4]
+    if len(p) == 6 or not _sized(new):
+        return None  # a fill colour would also paint what earlier steps left empty
+    if method == 'AFFINE' and len(data) == 6:
+        matrix = (*data, 0, 0, 1)
+    elif method == 'PERSPECTIVE' and len(data) == 8:
+        matrix = (*data, 1)
+    elif method == 'EXTENT' and len(data) == 4:
+        x0, y0, x1, y1 = data
+        matrix = ((x1 - x0) / new[0], 0, x0, 0, (y1 - y0) / new[1], y0, 0, 0, 1)
+    else:
+        return None
+    return matrix, new, Image.NEAREST
+
+GEOMETRY: Dict[Callable, Callable[[list, Size], Optional[Step]]] = {
+    resize_statement: _resize,
+    scale_op: _scale,
+    crop_statement: _crop,
+    mirror_op: _mirror,
+    flip_op: _flip,
+    rotate_statement: _rotate,
+    transform: _distort,
+}
+
+# Image.transpose methods and the matrix each one applies to an image of the given size
+TRANSPOSES: Dict[Optional[Image.Transpose], Callable[[int, int], Matrix]] = {
+    None: lambda w, h: IDENTITY,
+    Image.Transpose.FLIP_LEFT_RIGHT: lambda w, h: (-1, 0, w, 0, 1, 0, 0, 0, 1),
+    Image.Transpose.FLIP_TOP_BOTTOM: lambda w, h: (1, 0, 0, 0, -1, h, 0, 0, 1),
+    Image.Transpose.ROTATE_180: lambda w, h: (-1, 0, w, 0, -1, h, 0, 0, 1),
+    Image.Transpose.ROTATE_90: lambda w, h: (0, -1, w, 1, 0, 0, 0, 0, 1),
+    Image.Transpose.ROTATE_270: lambda w, h: (0, 1, 0, -1, 0, h, 0, 0, 1),
+    Image.Transpose.TRANSPOSE: lambda w, h: (0, 1, 0, 1, 0, 0, 0, 0, 1),
+    Image.Transpose.TRANSVERSE: lambda w, h: (0, -1, w, -1, 0, h, 0, 0, 1),
+}
+
+def _close(a: float, b: float) -> bool:
+    return abs(a - b) < 1e-9
+
+def inside(matrix: Matrix, size: Size, source: Size) -> bool:
+    """Whether ``matrix`` maps every point of an image of ``size`` into ``source``."""
+    a, b, c, d, e, f, g, h, i = matrix
+    for x, y in ((0, 0), (size[0], 0), (0, size[1]), size):
+        z = g * x + h * y + i
+        if z <= 0:
+            return False
+        u, v = (a * x + b * y + c) / z, (d * x + e * y + f) / z
+        if not (-1e-9 <= u <= source[0] + 1e-9 and -1e-9 <= v <= source[1] + 1e-9):
+            return False
+    return True
+
+def resample(image: Image.Image, matrix: Matrix, size: Size, method: int) -> Image.Image:
+    """Applies ``matrix`` to ``image`` with a single resample.
+
+    Matrices that only scale, translate and flip or rotate by multiples of 90
+    degrees become one ``resize`` with a source box (or a plain crop) plus a
+    lossless transpose; anything else is one ``Image.transform``.
+    """
+    a, b, c, d, e, f, g, h, i = matrix
+    if g == h == 0 and (b == d == 0 or a == e == 0):
+        swapped = a == e == 0
+        resized = (size[1], size[0]) if swapped else size
+        for transpose, to_source in TRANSPOSES.items():
+            # matrix == box . to_source, where box maps the resized image onto the source
+            box = matmul(matrix, affine_inverse(to_source(*resized)))
+            if not (box[0] > 0 and box[4] > 0 and _close(box[1], 0) and _close(box[3], 0)):
+                continue
+            x0, y0 = box[2], box[5]
+            x1, y1 = x0 + box[0] * resized[0], y0 + box[4] * resized[1]
+            if x0 < -1e-9 or y0 < -1e-9 or x1 > image.width + 1e-9 or y1 > image.height + 1e-9:
+                break  # reaches outside the source, which only transform fills
+            if all(_close(v, round(v)) for v in (x0, y0, x1, y1)) and \
+                    (round(x1 - x0), round(y1 - y0)) == resized:
+                out = image.crop((round(x0), round(y0), round(x1), round(y1)))
+            else:
+                box = max(x0, 0), max(y0, 0), min(x1, image.width), min(y1, image.height)
+                out = image.resize(resized, method, box=box)
+            return out if transpose is None else out.transpose(transpose)
+
+    if g == h == 0:
+        # transform samples without antialiasing; shrink by whole factors first
+        factor = int(min(math.hypot(a, d), math.hypot(b, e)))
+        if factor >= 2:
+            image = image.reduce(factor)
+            matrix = matmul((1 / factor, 0, 0, 0, 1 / factor, 0, 0, 0, 1), matrix)
+        kind, data = Image.Transform.AFFINE, matrix[:6]
+    else:
+        kind, data = Image.Transform.PERSPECTIVE, tuple(v / i for v in matrix[:8])
+
+    if method not in (Image.NEAREST, Image.BILINEAR, Image.BICUBIC):
+        method = Image.BICUBIC
+    return image.transform(size, kind, data, method)
+
+class GeometryChain(Group):
+    """Consecutive geometric statements on one variable, composed into one
+    matrix and applied with a single resample.
+
+    Pixels are only interpolated once, so a chain is faster and sharper
+    than running its statements one by one; chains that only move pixels
+    (crops, flips, right angle rotations) give identical results. Each
+    segment interpolates with the first filter one of its statements would
+    have used. Chains that resample differ slightly from the statements run
+    one by one, so :func:`compose_geometry` only runs when asked for.
+    """
+    modes = ('L', 'RGB', 'RGBA')
+
+    def plan(self, size: Size, mode: Optional[str] = None) -> Optional[List[Tuple[Matrix, Size, int]]]:
+        """Splits the chain into segments that can each be applied as one
+        matrix. A segment ends before a statement that would sample outside
+        the image it receives, since the composed matrix would read real
+        pixels where running it alone leaves the background.
+
+        With ``mode``, the size every statement would produce is checked
+        against the limits of the execution, as running them one by one would.
+        """
+        segments, matrix, method = [], None, None
+        for node in self.nodes:
+            if (step := GEOMETRY[node.func](node.args, size)) is None:
+                return None
+            m, new, filter_ = step
+            if mode is not None:
+                reserve(new, mode)
+            if matrix is not None and not inside(m, new, size):
+                segments.append((matrix, size, Image.NEAREST if method is None else method))
+                matrix, method = None, None
+            matrix = m if matrix is None else matmul(matrix, m)
+            if method in (None, Image.NEAREST) and filter_ is not None:
+                method = filter_
+            size = new
+        segments.append((matrix, size, Image.NEAREST if method is None else method))
+        return segments
+
+    def eval(self) -> List[Any]:
+        img = get_var(target(self.nodes[0]), (ImageRepr, FrameSequence))
+        if not isinstance(img, ImageRepr) or img.mode not in self.modes or (plan := self.plan(img.size, img.mode)) is None:
+            return self.fallback()
+        image = img.image
+        for segment in plan:
+            image = resample(image, *segment)
+        img.image = image
+        return [
+            node.args[-1] if node.func in (resize_statement, rotate_statement) else None
+            for node in self.nodes
+        ]
+
+def compose_geometry(statements: List[Node]) -> List[Node]:
+    def fusible(node: Node, run: List[Node]) -> bool:
+        if node.func not in GEOMETRY or not constant(node):
+            return False
+        return not run or target(node) == target(run[0])
+
+    return runs(statements, fusible, GeometryChain)
+
+# draft decoding
+
+def _resize_needs(p: list, size: Size) -> Optional[Size]:
+    return p[-1] if _sized(p[-1]) else None
+
+def _scale_needs(p: list, size: Size) -> Optional[Size]:
+    new = round(p[2] * size[0]), round(p[2] * size[1])
+    return new if 0 < p[2] < 1 and _sized(new) else None
+
+def _reduce_needs(p: list, size: Size) -> Optional[Size]:
+    factor = p[2]
+    if len(p) == 4 or not isinstance(factor, int) or factor < 2:
+        return None
+    return -(-size[0] // factor), -(-size[1] // factor)
+
+def _fit_needs(p: list, size: Size) -> Optional[Size]:
+    bleed = p[-1] if len(p) == 4 else 3
+    if not _sized(p[2]) or not 0 <= bleed < 0.5:
+        return None
+    # the scale ImageOps.fit resizes its crop by
+    live = size[0] * (1 - 2 * bleed), size[1] * (1 - 2 * bleed)
+    factor = max(p[2][0] / live[0], p[2][1] / live[1])
+    return math.ceil(size[0] * factor), math.ceil(size[1] * factor)
+
+# the resolution each size reducing statement needs from an image of the given size
+REDUCERS: Dict[Callable, Callable[[list, Size], Optional[Size]]] = {
+    resize_statement: _resize_needs,
+    scale_op: _scale_needs,
+    reduce_st: _reduce_needs,
+    fit_op: _fit_needs,
+}
+
+# statements whose output size depends on the input size, and the filter to resample a smaller decode with
+RELATIVE: Dict[Callable, Callable[[list], int]] = {
+    scale_op: lambda p: p[-1] if len(p) == 4 else Image.BICUBIC,
+    reduce_st: lambda p: Image.BOX,
+}
+
+class DraftOpen(Group):
+    """An ``OPEN`` and the statement right after it, when that statement
+    shrinks the opened image.
+
+    Knowing the size the script needs, JPEGs are decoded with DCT scaling
+    (``Image.draft``) and other single frame images are reduced right after
+    loading, always keeping at least twice the needed resolution so the
+    shrinking statement still has detail to resample from.
+    """
+    modes = ('L', 'RGB', 'RGBA')
+    gap = 2
+
+    def eval(self) -> List[Any]:
+        opener, reducer = self.nodes
+        img = opener.eval()
+        if isinstance(img, TiledImage):
+            return [img, reducer.eval()]  # already decoded into its backing file
+        image, size = img.image, img.image.size  # opened lazily, nothing is decoded yet
+        if (needs := REDUCERS[reducer.func](reducer.args, size)) is None:
+            return [img, reducer.eval()]
+
+        wanted = needs[0] * self.gap, needs[1] * self.gap
+        if image.format == 'JPEG':
+            image.draft(None, wanted)
+        elif reducer.func is not reduce_st and image.mode in self.modes and getattr(image, 'n_frames', 1) == 1:
+            # decoding is not any cheaper here, REDUCE itself is already the fastest way down
+            factor = min(size[0] // wanted[0], size[1] // wanted[1])
+            if factor >= 2:
+                img.image = image.reduce(factor)
+
+        if reducer.func in RELATIVE and img.size != size:
+            # the factor was relative to the full size; resize to the size it would have produced
+            img.image = img.image.resize(needs, RELATIVE[reducer.func](reducer.args))
+            return [img, None]
+        return [img, reducer.eval()]
+
+# statements that can run between an ``OPEN`` and its reducer: they can neither fail nor observe any image
+TRANSPARENT = {echo}
+
+def draft_decoding(statements: List[Node]) -> List[Node]:
+    """Pairs each ``OPEN`` with the statement using its variable next, if
+    that statement shrinks it and everything in between is transparent, so
+    running the two back to back is unobservable."""
+    statements = list(statements)
+    for i, node in enumerate(statements):
+        if node.func is not open_statement:
+            continue
+        name = node.args[-1]
+        for j in range(i + 1, len(statements)):
+            other = statements[j]
+            if other.func in REDUCERS and constant(other) and target(other) == name:
+                statements[i] = DraftOpen([node, other])
+                del statements[j]
+            if other.func not in TRANSPARENT or not constant(other):
+                break
+    return statements
+
+# draw batching
+
+DRAWS = {
+    write_text, draw_line, draw_line_w, draw_ellipse, draw_ellipse_w, draw_dot,
+    draw_arc, draw_arc_w, draw_chord, draw_chord_w, draw_polygon, draw_reg_polygon,
+    draw_rec, draw_rec_w,
+}
+
+def _points(xy: Any) -> bool:
+    return isinstance(xy, tuple) and len(xy) % 2 == 0 and len(xy) >= 2
+
+def merge_primitives(calls: List[Primitive]) -> List[Primitive]:
+    """Merges runs of points of one colour into one ``point`` call, and thin
+    lines of one colour that continue each other into one polyline; both
+    draw exactly the same pixels as the separate calls."""
+    merged = []
+    for operation, args, kwargs in calls:
+        if merged and not args and operation in ('point', 'line'):
+            last, last_args, last_kwargs = merged[-1]
+            if (
+                last == operation and not last_args and
+                kwargs.keys() == last_kwargs.keys() and
+                all(kwargs[key] == last_kwargs[key] for key in kwargs if key != 'xy') and
+                _points(kwargs['xy']) and _points(last_kwargs['xy'])
+            ):
+                xy, last_xy = kwargs['xy'], last_kwargs['xy']
+                if operation == 'point':
+                    last_kwargs['xy'] = last_xy + xy
+                    continue
+                elif kwargs.get('width', 0) <= 1 and last_xy[-2:] == xy[:2]:
+                    last_kwargs['xy'] = last_xy + xy[2:]
+                    continue
+        merged.append((operation, args, dict(kwargs)))
+    return merged
+
+class DrawBatch(Group):
+    """Consecutive drawing statements on one variable, drawn with one
+    ``ImageDraw`` cursor.
+
+    The statements run as usual but only record their primitives, which are
+    then merged where possible (see :func:`merge_primitives`) and drawn in
+    one go. Every statement reports the shared cursor.
+    """
+
+    def eval(self) -> List[Any]:
+        img = get_var(target(self.nodes[0]), (ImageRepr, FrameSequence))
+        with recording() as calls:
+            try:
+                for node in self.nodes:
+                    node.eval()
+            except Exception:
+                replay(img, merge_primitives(calls))  # what ran before the error is still drawn
+                raise
+        cursor = replay(img, merge_primitives(calls))
+        return [cursor] * len(self.nodes)
+
+def batch_draws(statements: List[Node]) -> List[Node]:
+    def fusible(node: Node, run: List[Node]) -> bool:
+        if node.func not in DRAWS:
+            return False
+        return not run or target(node) == target(run[0])
+
+    return runs(statements, fusible, DrawBatch)
+
+# the passes that keep results bit-identical
+PASSES: List[Pass] = [
+    fuse_point_ops,
+    batch_draws,
+]
+
+def passes(draft: bool = False, geometry: bool = False) -> List[Pass]:
+    """:data:`PASSES`, with :func:`draft_decoding` when ``draft`` is set and
+    :func:`compose_geometry` when ``geometry`` is; both are opt-in because
+    their output is close to, but not bit-identical with, the statements
+    they replace."""
+    return (
+        ([draft_decoding] if draft else []) + [fuse_point_ops] +
+        ([compose_geometry] if geometry else []) + [batch_draws]
+    )
@@ -1,16 +1,147 @@
-from typing import Optional, Union, Any
+from typing import Callable, Optional, Tuple, Union, Any
+from array import array
 from io import BytesIO
 
-from urllib import error as url_error
-from urllib import request
+import os
+import json
+import tempfile
+import warnings
 
-from PIL import ImageSequence, Image
+from appdirs import AppDirs
+from PIL import Image
 from rply import ParserGenerator, Token
+from rply.errors import ParserGeneratorWarning
+from rply.grammar import Grammar
+from rply.parser import LRParser
+from rply.parsergenerator import LRTable
 
 from .lexer import generator
-from .objects import ImageRepr
+from .context import current
+from .objects import ImageRepr, FrameSequence
+from .tiles import TiledImage
+from .limits import reserve, reserve_frames
+from .metrics import registry
+from .program import Name, Node, sharing
+from .utils import LazyModule
+
+fetch = LazyModule('fstop.fetch')
+
+class Generator(ParserGenerator):
+    """``ParserGenerator`` that keeps the built LALR tables on disk.
+
+    Tables are stored as ``fstop-<fingerprint>.json`` inside ``cache_dir``, where
+    the fingerprint is rply's grammar hash; adding or changing a production
+    changes the fingerprint, so stale tables are simply never looked up again.
+    The directory can be pre-populated and shipped with a deployment.
+    Passing ``cache_dir=None`` disables the disk cache.
+
+    Productions do not run while parsing; the parser builds :class:`Node`
+    objects that call them later, so a parsed script can be run repeatedly.
+    """
+
+    def __init__(self, tokens: list, precedence: list = [], cache_dir: Optional[str] = None) -> None:
+        super().__init__(tokens, precedence)
+        self.cache_dir = cache_dir
+        self._built = None
+
+    def production(
+        self, 
+        rule: str, 
+        precedence: Optional[str] = None, *, 
+        pure: bool = False, 
+        eager: bool = False,
+        shares: bool = False
+    ) -> Callable[[Callable], Callable]:
+        """``pure`` productions do not touch the environment, so they are folded
+        while parsing once all of their operands are constants.
+        ``eager`` productions always run while parsing (the statement list,
+        and the element lists of literals, which grow in place).
+        ``shares`` productions keep the images of the variables they use,
+        which are then never closed when released (see :class:`fstop.program.Program`).
+        """
+        register = super().production(rule, precedence)
+
+        def inner(func: Callable[[list], Any]) -> Callable[[list], Any]:
+            if shares:
+                sharing.add(func)
+            if eager:
+                action = func
+            elif pure:
+                def action(p: list) -> Any:
+                    if any(isinstance(arg, Node) for arg in p):
+                        return Node(func, p)
+                    return func(p)
+            else:
+                def action(p: list) -> Node:
+                    return Node(func, p)
+            register(action)
+            return func
+        return inner
+
+    def grammar(self) -> Grammar:
+        g = Grammar(self.tokens)
+        for level, (assoc, terms) in enumerate(self.precedence, 1):
+            for term in terms:
+                g.set_precedence(term, assoc, level)
+
+        for name, syms, func, precedence in self.productions:
+            g.add_production(name, syms, func, precedence)
+        g.set_start()
+        return g
+
+    def cache_file(self, g: Grammar) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, 'fstop-%s.json' % self.compute_grammar_hash(g))
+
+    def _load_table(self, g: Grammar, path: Optional[str]) -> Optional[LRTable]:
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.data_is_valid(g, data):
+            return LRTable.from_cache(g, data)
+
+    def _dump_table(self, table: LRTable, path: Optional[str]) -> None:
+        if path is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=self.cache_dir, delete=False) as f:
+                json.dump(self.serialize_table(table), f)
+            os.replace(f.name, path)
+        except OSError:
+            pass  # read-only or missing cache directory, tables are rebuilt next time
+
+    def build(self) -> LRParser:
+        if self._built is not None:
+            return self._built
+
+        g = self.grammar()
+        path = self.cache_file(g)
+        table = self._load_table(g, path)
+        if table is None:
+            g.build_lritems()
+            g.compute_first()
+            g.compute_follow()
+            table = LRTable.from_grammar(g)
+            self._dump_table(table, path)
+
+        if table.sr_conflicts:
+            warnings.warn(
+                "%d shift/reduce conflict%s" % (
+                    len(table.sr_conflicts), "s" if len(table.sr_conflicts) > 1 else ""
+                ),
+                ParserGeneratorWarning,
+                stacklevel=2,
+            )
+        self._built = LRParser(table, self.error_handler)
+        return self._built
 
-parser = ParserGenerator(
+parser = Generator(
     [
         l.name for l in generator.rules
     ],
@@ -20,78 +151,120 @@ parser = ParserGenerator(
         ('left', ['MUL', 'DIV', 'FLOOR_DIV']),
         ('left', ['EXP']),
     ],
+
+    cache_dir = os.environ.get('FSTOP_CACHE_DIR', AppDirs('fstop').user_cache_dir),
 )
-parser.env = {}
-parser._stream_env = []
-parser._saved_streams = []
 
 def get_var(name: str, type_: type = ImageRepr) -> Optional[ImageRepr]:
-    if not isinstance(var := parser.env.get(name), type_):
+    if not isinstance(var := current().env.get(name), type_):
         raise NameError("Undefined variable '%s'" % name)
     return var
 
+def set_var(name: str, value: Any) -> Any:
+    current().env[name] = value
+    return value
+
+def update(
+    name: str,
+    func: Callable[[Image.Image], Image.Image], *,
+    halo: Optional[int] = None
+) -> Union[ImageRepr, FrameSequence]:
+    """Replaces the image of variable ``name`` with ``func(image)``, or each of
+    its frames when it holds a sequence.
+
+    Statements that are local pass ``halo``, the number of neighbouring rows
+    each output pixel depends on, so tiled images are processed in strips
+    instead of being loaded whole.
+    """
+    var = get_var(name, (ImageRepr, FrameSequence))
+    if isinstance(var, FrameSequence):
+        var.map(func)
+    elif isinstance(var, TiledImage) and var.store is not None and halo is not None:
+        var.map(func, halo)
+    else:
+        var.image = func(var.image)
+    return var
+
+Size = Tuple[int, int]
+
+def reserve_for(name: str, size: Union[Size, Callable[[Size], Size]], mode: Optional[str] = None) -> None:
+    """:func:`fstop.limits.reserve` for a statement that turns the image (or
+    every frame) of variable ``name`` into one of ``size``, which may be a
+    function of the current size, and of ``mode`` if it changes it."""
+    if current().limits is None:
+        return  # spares decoding the first frame of sequences
+    var = get_var(name, (ImageRepr, FrameSequence))
+    if isinstance(var, FrameSequence):
+        if len(var):
+            first = var[0]
+            reserve(size(first.size) if callable(size) else size, mode or first.mode, len(var))
+    else:
+        reserve(size(var.size) if callable(size) else size, mode or var.mode)
+
 # productions
 # program statements
 
-@parser.production("main : statements")
+@parser.production("main : statements", eager=True)
 def program(p: list) -> list:
     return p[0]
 
-@parser.production("statements : statements expr")
+@parser.production("statements : statements expr", eager=True)
 def statements(p: list) -> list:
-    return p[0] + [p[1]]
+    p[0].append(p[1])
+    return p[0]
 
-@parser.production("statements : expr")
+@parser.production("statements : expr", eager=True)
 def expr(p: list) -> list:
     return [p[0]]
 
 # object type productions
 
-@parser.production('string : STRING')
-@parser.production('string : MODE variable')
+@parser.production('string : STRING', pure=True)
 def string(p: list) -> str:
-    if len(p) == 1:
-        return p[0].getstr().strip("'").strip('"')
-    else:
-        img = get_var(p[1])
-        return img.image.mode
+    return p[0].getstr().strip("'").strip('"')
+
+@parser.production('string : MODE variable')
+def image_mode(p: list) -> str:
+    img = get_var(p[1])
+    return img.mode
+
+@parser.production('number : INTEGER', pure=True)
+@parser.production('number : FLOAT', pure=True)
+def number(p: list) -> float:
+    string = p[0].getstr()
+    return (
+        float(string) if p[0].gettokentype() == "FLOAT" else int(string)
+    )
 
-@parser.production('number : INTEGER')
-@parser.production('number : FLOAT')
 @parser.production('number : WIDTH variable')
 @parser.production('number : HEIGHT variable')
 @parser.production('number : LENGTH variable')
 @parser.production('number : LENGTH sequence')
 @parser.production('number : TELL variable')
-def number(p: list) -> float:
+def image_number(p: list) -> int:
     token = p[0].gettokentype()
-    if len(p) == 1:
-        string = p[0].getstr()
-        return (
-            float(string) if token == "FLOAT" else int(string)
-        )
-    elif len(p) == 2 and token == "LENGTH":
-        if isinstance(p[1], list):
+    if token == "LENGTH":
+        if isinstance(p[1], FrameSequence):
             return len(p[1])
         else:
-            img = get_var(p[1], (ImageRepr, list))
+            img = get_var(p[1], (ImageRepr, FrameSequence))
             return (
-                len(img) if isinstance(img, list) else getattr(img, 'n_frames', 1)
+                len(img) if isinstance(img, FrameSequence) else getattr(img.image, 'n_frames', 1)
             )
     else:
         img = get_var(p[1])
         return (
-            img.image.width if token == "WIDTH" else 
-            img.image.height if token == "HEIGHT" else 
+            img.width if token == "WIDTH" else 
+            img.height if token == "HEIGHT" else 
             img.image.tell() if token == "TELL" else 0
         )
 
-@parser.production('number : number ADD number')
-@parser.production('number : number SUB number')
-@parser.production('number : number MUL number')
-@parser.production('number : number DIV number')
-@parser.production('number : number EXP number')
-@parser.production('number : number FLOOR_DIV number')
+@parser.production('number : number ADD number', pure=True)
+@parser.production('number : number SUB number', pure=True)
+@parser.production('number : number MUL number', pure=True)
+@parser.production('number : number DIV number', pure=True)
+@parser.production('number : number EXP number', pure=True)
+@parser.production('number : number FLOOR_DIV number', pure=True)
 def numerical_operations(p: list) -> float:
     x, y = p[0], p[2]
     token = p[1].gettokentype()
@@ -109,63 +282,91 @@ def numerical_operations(p: list) -> float:
     else:
         return x // y
     
-@parser.production('variable : VARIABLE')
-def variable(p: list) -> str:
-    return p[0].getstr()
+@parser.production('variable : VARIABLE', pure=True)
+def variable(p: list) -> Name:
+    return Name(p[0].getstr())
+
+# literals of any length are accumulated in a list only the parser holds,
+# then become one constant or one node, instead of a chain of partial tuples
+
+COMPACT_LENGTH = 4096
+
+def compact(values: tuple) -> Union[tuple, array]:
+    """Keeps long constant tuples (polygon outlines) as ``array('f')``, at 4
+    bytes per number, which ImageDraw reads without converting each one;
+    only when every value survives the conversion exactly, as Pillow reads
+    buffers as 32 bit floats."""
+    if len(values) < COMPACT_LENGTH:
+        return values
+    packed = array('f', values)
+    return packed if packed.tolist() == list(values) else values
+
+@parser.production('ntuple_start : LEFT_PAREN number COMMA', eager=True)
+def ntuple_start(p: list) -> list:
+    return [p[1]]
+
+@parser.production('ntuple_start : ntuple_start number COMMA', eager=True)
+def ntuple_body(p: list) -> list:
+    p[0].append(p[1])
+    return p[0]
 
-@parser.production('ntuple_start : LEFT_PAREN number COMMA')
-def ntuple_start(p: list) -> tuple:
-    return (p[1],)
+@parser.production('ntuple : ntuple_start RIGHT_PAREN', eager=True)
+@parser.production('ntuple : ntuple_start number RIGHT_PAREN', eager=True)
+def ntuple(p: list) -> Union[tuple, array, Node]:
+    items = p[0]
+    if len(p) == 3:
+        items.append(p[1])
+    if any(isinstance(item, Node) for item in items):
+        return Node(ntuple_items, items)
+    return compact(tuple(items))
 
-@parser.production('ntuple_start : ntuple_start number COMMA')
-def ntuple_body(p: list) -> tuple:
-    return p[0] + (p[1],)
+def ntuple_items(p: list) -> tuple:
+    return tuple(p)
 
-@parser.production('ntuple : ntuple_start RIGHT_PAREN')
-@parser.production('ntuple : ntuple_start number RIGHT_PAREN')
 @parser.production('ntuple : SIZE variable')
-def ntuple(p: list) -> tuple:
-    if isinstance(p[0], Token):
-        img = get_var(p[1])
-        return img.image.size
-    else:
-        return p[0] + (p[1],) if len(p) == 3 else p[0]
+def image_size(p: list) -> tuple:
+    img = get_var(p[1])
+    return img.size
 
-@parser.production('sequence_start : LEFT_BR')
+@parser.production('sequence_start : LEFT_BR', eager=True)
 def seq_start(_: list) -> list:
     return []
 
-@parser.production('sequence_start : sequence_start variable COMMA')
+@parser.production('sequence_start : sequence_start variable COMMA', eager=True)
 def seq_body(p: list) -> list:
-    return p[0] + [p[1]]
+    p[0].append(p[1])
+    return p[0]
 
-@parser.production('sequence : sequence_start RIGHT_BR')
-@parser.production('sequence : sequence_start variable RIGHT_BR')
+@parser.production('sequence : sequence_start RIGHT_BR', shares=True)
+@parser.production('sequence : sequence_start variable RIGHT_BR', shares=True)
 @parser.production('sequence : SEQUENCE variable')
-def sequence(p: list) -> list:
+def sequence(p: list) -> FrameSequence:
     if isinstance(p[0], Token):
         img = get_var(p[1])
-        return list(ImageSequence.Iterator(img))
+        reserve_frames(getattr(img.image, 'n_frames', 1))
+        return FrameSequence.of(img.image)
     else:
         seq = p[0] + [p[1]] if len(p) == 3 else p[0]
-        return [getattr(get_var(i), 'image', None) for i in seq]
+        reserve_frames(len(seq))
+        return FrameSequence(get_var(i).image for i in seq)
 
-@parser.production('color : COLOR ntuple')
-@parser.production('color : COLOR number')
-@parser.production('color : COLOR string')
+@parser.production('color : COLOR ntuple', pure=True)
+@parser.production('color : COLOR number', pure=True)
+@parser.production('color : COLOR string', pure=True)
 def color_st(p: list) -> Union[tuple, int, str]:
     return p[-1]
 
-@parser.production('string : string ADD string')
+@parser.production('string : string ADD string', pure=True)
 def str_concat(p: list) -> str:
     return p[0] + p[-1]
 
-@parser.production('ntuple : ntuple ADD ntuple')
-def tuple_concat(p: list) -> tuple:
-    return p[0] + p[-1]
+@parser.production('ntuple : ntuple ADD ntuple', pure=True)
+def tuple_concat(p: list) -> Union[tuple, array]:
+    return compact(tuple(p[0]) + tuple(p[-1]))
 
 @parser.production('sequence : sequence ADD sequence')
-def seq_concat(p: list) -> list:
+def seq_concat(p: list) -> FrameSequence:
+    reserve_frames(len(p[0]) + len(p[-1]))
     return p[0] + p[-1]
 
 # operation productions
@@ -173,22 +374,24 @@ def seq_concat(p: list) -> list:
 
 @parser.production('expr : DEL variable')
 def del_st(p: list) -> None:
-    img = get_var(p[1], (list, ImageRepr))
-    del img; del parser.env[p[1]]
+    img = get_var(p[1], (FrameSequence, ImageRepr))
+    del img; del current().env[p[1]]
 
-@parser.production('expr : APPEND variable TO variable')
+@parser.production('expr : APPEND variable TO variable', shares=True)
 def append_seq(p: list) -> None:
     img = get_var(p[1])
-    seq = get_var(p[-1], list)
+    seq = get_var(p[-1], FrameSequence)
+    reserve_frames(len(seq) + 1)
     return seq.append(img.image)
 
 @parser.production('expr : BLEND variable COMMA variable ALPHA number AS variable')
 def blend(p: list) -> Image:
     backg, overlay, alpha, name = p[1], p[3], p[-3], p[-1]
     img1, img2 = get_var(backg), get_var(overlay)
+    reserve(img1.size, img1.mode)
     image = Image.blend(img1.image, img2.image, alpha=alpha)
     image = ImageRepr(image)
-    parser.env[name] = image
+    set_var(name, image)
     return image
 
 @parser.production('expr : NEW sequence AS variable')
@@ -197,23 +400,38 @@ def blend(p: list) -> Image:
 def new_statement(p: list) -> Optional[ImageRepr]:
 
     if len(p) == 4:
-        parser.env[p[-1]] = p[1]
+        set_var(p[-1], p[1])
     else:
         mode, size, name = p[1], p[2], p[-1]
         color = p[3] if len(p) == 6 else 0
+        reserve(size, mode)
         image = Image.new(mode, size, color)
         image = ImageRepr(image)
-        parser.env[name] = image
+        set_var(name, image)
         return image
 
 @parser.production('expr : MERGE string sequence AS variable')
 def merge_statement(p: list) -> Optional[ImageRepr]:
     mode, bands, name = p[1], p[2], p[4]
+    if len(bands):
+        reserve(bands[0].size, mode)
     image = Image.merge(mode, tuple(bands))
     image = ImageRepr(image)
-    parser.env[name] = image
+    set_var(name, image)
     return image
 
+def encoded_size(fp: Any) -> int:
+    """Bytes left to read in a stream, without reading it."""
+    if isinstance(fp, BytesIO):
+        return fp.getbuffer().nbytes - fp.tell()
+    try:
+        return os.fstat(fp.fileno()).st_size - fp.tell()
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+def fetch_url(url: str) -> bytes:
+    return fetch.fetcher.fetch(url)
+
 @parser.production('expr : OPEN string AS variable')
 @parser.production('expr : OPEN STREAM number AS variable')
 @parser.production('expr : OPEN URL string AS variable')
@@ -223,34 +441,43 @@ def open_statement(p: list) -> Optional[ImageRepr]:
         filename, name = p[1], p[-1]
     elif p[1].gettokentype() == "STREAM":
         index, name = p[2], p[-1]
-        filename = parser._stream_env[index]
+        filename = current().streams[index]
     elif p[1].gettokentype() == "URL":
         url, name = p[2], p[-1]
-        try:
-            payload = request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-            with request.urlopen(payload) as resp:
-                filename = BytesIO(resp.read())
-        except url_error.HTTPError as exc:
-            raise RuntimeError('Could not fetch the image properly; status-code: %s' % exc.getcode())
-            
-    image = Image.open(filename)
-    image = ImageRepr(image)
-    parser.env[name] = image
+        payload = current().fetched.get(url)  # already fetched by Runner.execute_async
+        filename = BytesIO(payload if payload is not None else fetch_url(url))
+
+    if registry.enabled:
+        registry.add_bytes('decode', os.path.getsize(filename) if isinstance(filename, str) else encoded_size(filename))
+    image = Image.open(filename)  # only reads the header
+    budget = current().tile_budget
+    tiled = budget is not None and image.mode in TiledImage.modes and getattr(image, 'n_frames', 1) == 1 \
+        and image.width * image.height * len(image.getbands()) > budget
+    try:
+        reserve(image.size, image.mode, resident=not tiled)
+    except MemoryError:
+        image.close()
+        raise
+    if tiled:
+        image = TiledImage.open(image, budget)
+    else:
+        image = ImageRepr(image)
+    set_var(name, image)
     return image
 
 @parser.production('expr : CLONE variable AS variable')
 def clone_statement(p: list) -> None:
     img = get_var(p[1])
     name = p[-1]
-    image = img.image.copy()
-    image = ImageRepr(image)
-    parser.env[name] = image 
+    reserve_for(p[1], lambda size: size)
+    image = img.copy()
+    set_var(name, image)
     return image
 
 @parser.production('expr : CONVERT variable string')
 def convert_statement(p: list) -> None:
-    img = get_var(p[1])
-    img.image = img.image.convert(p[-1])
+    reserve_for(p[1], lambda size: size, p[-1])
+    update(p[1], lambda image: image.convert(p[-1]), halo=0 if p[-1] in TiledImage.modes else None)
     return None
 
 @parser.production('expr : SAVE variable string')
@@ -262,8 +489,12 @@ def convert_statement(p: list) -> None:
 @parser.production('expr : SAVE variable STREAM string DURATION number')
 @parser.production('expr : SAVE variable STREAM string DURATION number LOOP number')
 def save_statement(p: list) -> Union[str, BytesIO]:
-    img = get_var(p[1], (ImageRepr, list))
-    if isinstance(img, list):
+    img = get_var(p[1], (ImageRepr, FrameSequence))
+    if isinstance(img, FrameSequence):
+        if not len(img):
+            raise ValueError('Cannot save an empty sequence')
+        frames = iter(img)  # decoded one at a time, as the encoder asks for them (GIF and APNG keep them all)
+        first = next(frames)
         options = {}
         try:
             i = p.index(Token('DURATION', r'DURATION')) + 1
@@ -272,46 +503,53 @@ def save_statement(p: list) -> Union[str, BytesIO]:
         except (ValueError, TypeError, IndexError):
             pass
     if Token('STREAM', r'STREAM') not in p:
-        if isinstance(img, ImageRepr):
+        if isinstance(img, TiledImage) and img.store is not None and p[2].lower().endswith(('.tif', '.tiff')):
+            img.save_tiff(p[2])  # written strip by strip
+        elif isinstance(img, ImageRepr):
             img.image.save(p[2])
         else:
-            img[0].save(p[2], 
+            first.save(p[2], 
                 save_all=True,
-                append_images=img[1:], 
+                append_images=frames, 
                 optimize=True, **options,
             )
+        if registry.enabled:
+            registry.add_bytes('encode', os.path.getsize(p[2]))
         return p[2]
     else:
         buffer = BytesIO()
-        if isinstance(img, ImageRepr):
+        if isinstance(img, TiledImage) and img.store is not None and p[3].upper() == 'TIFF':
+            img.save_tiff(buffer)
+        elif isinstance(img, ImageRepr):
             img.image.save(buffer, p[3])
         else:
-            img[0].save(buffer, 
+            first.save(buffer, 
                 p[3],
                 save_all=True, 
-                append_images=img[1:],
+                append_images=frames,
                 optimize=True, **options,
             )
         buffer.seek(0)
-        parser._saved_streams.append(buffer)
+        registry.add_bytes('encode', buffer.getbuffer().nbytes)
+        current().saved_streams.append(buffer)
         return buffer
 
 @parser.production('expr : CLOSE variable')
 def close_statement(p: list) -> None:
     img = get_var(p[1])
     img.image.close()
+    img.touch()
     return None
 
 @parser.production('expr : RESIZE variable ntuple')
 def resize_statement(p: list) -> tuple:
-    img = get_var(p[1])
-    img.image = img.image.resize(p[-1])
+    reserve_for(p[1], p[-1])
+    update(p[1], lambda image: image.resize(p[-1]))
     return p[-1]
 
 @parser.production('expr : ROTATE variable number')
 def rotate_statement(p: list) -> float:
-    img = get_var(p[1])
-    img.image = img.image.rotate(p[-1])
+    update(p[1], lambda image: image.rotate(p[-1]))
     return p[-1]
 
 @parser.production('expr : PASTE variable ON variable')
@@ -323,6 +561,7 @@ def paste_statement(p: list) -> None:
     xy = (0, 0) if len(p) == 4 else p[-1]
     mask = p[-2] if len(p) == 7 else None
     img2.image.paste(img1.image, xy, mask=mask)
+    img2.touch()
     return None
 
 @parser.production('expr : PUTPIXEL variable ntuple color')
@@ -330,6 +569,7 @@ def putpixel(p: list) -> tuple:
     coords, color = p[2], p[-1]
     img = get_var(p[1])
     img.image.putpixel(coords, color)
+    img.touch()
     return coords
  
 @parser.production('expr : SHOW variable')
@@ -343,34 +583,35 @@ def show_statement(p: list) -> Optional[str]:
 @parser.production('expr : CROP variable')
 @parser.production('expr : CROP variable ntuple')
 def crop_statement(p: list) -> None:
-    img = get_var(p[1])
     box = p[-1] if len(p) == 3 else None
-    img.image = img.image.crop(box=box)
+    if box is not None:
+        reserve_for(p[1], (box[2] - box[0], box[3] - box[1]))
+    update(p[1], lambda image: image.crop(box=box))
     return None
 
 @parser.production('expr : SPREAD variable number')
 def spread_st(p: list) -> None:
-    img = get_var(p[1])
-    img.image = img.image.effect_spread(p[-1])
+    update(p[1], lambda image: image.effect_spread(p[-1]))
     return None
 
 @parser.production('expr : PUTALPHA variable ON variable')
 def putalpha_st(p: list) -> None:
     img2, img = get_var(p[1]), get_var(p[3])
     img.image.putalpha(img2.image)
+    img.touch()
     return None
 
 @parser.production('expr : REDUCE variable number')
 @parser.production('expr : REDUCE variable number ntuple')
 def reduce_st(p: list) -> None:
-    img = get_var(p[1])
     box = p[-1] if len(p) == 4 else None
-    img.image = img.image.reduce(p[2], box=box)
+    update(p[1], lambda image: image.reduce(p[2], box=box))
 
 @parser.production('expr : SEEK variable number')
 def seek_st(p: list) -> int:
     img = get_var(p[1])
     img.image.seek(p[2])
+    img.touch()
     return p[2]
 
 @parser.production('expr : ECHO expr')
@@ -0,0 +1,130 @@
+from typing import Any, Dict, Iterator, List, Optional, Union
+from contextlib import contextmanager
+
+import os
+import json
+import time
+import threading
+import tracemalloc
+
+from .objects import ImageRepr, FrameSequence
+from .program import Node
+
+_tracers = 0
+_tracers_lock = threading.Lock()
+
+@contextmanager
+def tracing() -> Iterator[None]:
+    """Keeps :mod:`tracemalloc` running (with one frame per allocation, the
+    cheapest setting) while at least one profile is being recorded, unless
+    it was started by someone else."""
+    global _tracers
+    with _tracers_lock:
+        owned = _tracers > 0 or not tracemalloc.is_tracing()
+        if owned:
+            if _tracers == 0:
+                tracemalloc.start(1)
+            _tracers += 1
+    try:
+        yield
+    finally:
+        if owned:
+            with _tracers_lock:
+                _tracers -= 1
+                if _tracers == 0:
+                    tracemalloc.stop()
+
+def describe(value: Any) -> Optional[Dict[str, Any]]:
+    """Size and mode of an image variable, without converting or decoding it."""
+    if isinstance(value, ImageRepr):
+        return {'size': list(value.size), 'mode': value.mode}
+    elif isinstance(value, FrameSequence):
+        return {'frames': len(value)}
+
+class Span:
+    """One timed step: lexing, parsing or a statement.
+
+    ``start`` and ``wall`` come from :func:`time.perf_counter`, ``cpu`` from
+    :func:`time.thread_time`; all in seconds. ``allocated`` is the peak of
+    memory traced by :mod:`tracemalloc` during the span, above what was
+    traced when it started; Python objects and NumPy arrays are traced, but
+    not the pixel buffers Pillow allocates itself, which ``args`` show as
+    image sizes instead. The peak is process wide, so concurrent executions
+    inflate each other's numbers.
+    """
+    __slots__ = ('name', 'category', 'start', 'wall', 'cpu', 'allocated', 'thread', 'args')
+
+    def __init__(self, name: str, category: str, **args) -> None:
+        self.name = name
+        self.category = category
+        self.start = self.wall = self.cpu = 0.0
+        self.allocated = 0
+        self.thread = threading.get_ident()
+        self.args = args
+
+    def __repr__(self):
+        return "<Span %s %.3f ms>" % (self.name, self.wall * 1e3)
+
+class Profile:
+    """The spans recorded by ``Runner.execute(..., profile=True)``; spans
+    are only measured for memory inside :func:`tracing`."""
+
+    def __init__(self) -> None:
+        self.spans: List[Span] = []
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, category: str, **args) -> Iterator[Span]:
+        span = Span(name, category, **args)
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        span.start, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield span
+        finally:
+            span.wall = time.perf_counter() - span.start
+            span.cpu = time.thread_time() - cpu
+            span.allocated = max(tracemalloc.get_traced_memory()[1] - before, 0)
+            self.spans.append(span)
+
+    @contextmanager
+    def statement(self, node: Node, env: Dict[str, Any]) -> Iterator[Span]:
+        """A span for a top level statement, recording the size and mode of
+        the variables it uses before and after it runs."""
+        names = sorted(set(node.names()))
+        position = node.position
+        with self.span(node.name, 'statement', line=position and position.lineno, column=position and position.colno) as span:
+            span.args['inputs'] = {name: info for name in names if (info := describe(env.get(name))) is not None}
+            try:
+                yield span
+            finally:
+                span.args['outputs'] = {name: info for name in names if (info := describe(env.get(name))) is not None}
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """The spans as Chrome trace events, as read by ``chrome://tracing``
+        and Perfetto."""
+        pid = os.getpid()
+        return {
+            'displayTimeUnit': 'ms',
+            'traceEvents': [{
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': (span.start - self.origin) * 1e6,
+                'dur': span.wall * 1e6,
+                'tdur': span.cpu * 1e6,
+                'pid': pid,
+                'tid': span.thread,
+                'args': dict(span.args, cpu_ms=span.cpu * 1e3, allocated_bytes=span.allocated),
+            } for span in self.spans],
+        }
+
+    def save(self, fp: Union[str, Any]) -> None:
+        """Writes :meth:`to_chrome` as JSON to a path or a text file."""
+        if isinstance(fp, str):
+            with open(fp, 'w') as f:
+                return self.save(f)
+        json.dump(self.to_chrome(), fp)
+
+    def __repr__(self):
+        return "<Profile spans=%d wall=%.3f ms>" % (len(self.spans), sum(span.wall for span in self.spans) * 1e3)
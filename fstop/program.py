@@ -0,0 +1,267 @@
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional, Set, Tuple, Any
+from contextlib import ExitStack
+from functools import partial
+from io import BytesIO
+
+from rply.token import BaseBox, Token, SourcePosition
+
+from .context import Context
+from .metrics import registry
+
+if TYPE_CHECKING:
+    from .cache import ResultCache
+    from .profile import Profile
+
+class Name(str):
+    """A variable name, as produced by the ``variable`` production.
+
+    Behaves exactly like ``str`` but lets the compiler tell variable
+    references apart from string literals.
+    """
+
+class Node(BaseBox):
+    """A production call deferred from parse time to run time.
+
+    ``args`` is the list the parser matched (tokens, constants and other
+    nodes); evaluating the node evaluates its child nodes and then calls the
+    production function with the results, exactly as rply would have done.
+    """
+    __slots__ = ('func', 'args', 'index')
+
+    def __init__(self, func: Callable[[list], Any], args: list) -> None:
+        self.func = func
+        self.args = args
+        self.index = None
+
+    @property
+    def name(self) -> str:
+        return self.func.__name__
+
+    @property
+    def position(self) -> Optional[SourcePosition]:
+        for arg in self.args:
+            if isinstance(arg, Token):
+                return arg.getsourcepos()
+            elif isinstance(arg, Node) and (pos := arg.position) is not None:
+                return pos
+
+    def names(self) -> Iterator[Name]:
+        """Yields every variable name referenced by this node."""
+        stack = list(self.args)
+        while stack:
+            arg = stack.pop()
+            if isinstance(arg, Name):
+                yield arg
+            elif isinstance(arg, Node):
+                stack.extend(arg.args)
+            elif isinstance(arg, (list, tuple)):
+                stack.extend(arg)
+
+    def targets(self) -> Iterator[Name]:
+        """Yields the variables this statement binds (``... AS name``)."""
+        for before, arg in zip(self.args, self.args[1:]):
+            if isinstance(arg, Name) and isinstance(before, Token) and before.gettokentype() == 'AS':
+                yield arg
+
+    def shares(self) -> bool:
+        """Whether this node keeps references to the images of the variables
+        it uses (see :data:`sharing`)."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.func in sharing:
+                return True
+            stack.extend(arg for arg in node.args if isinstance(arg, Node))
+        return False
+
+    def eval(self) -> Any:
+        return self.func([
+            arg.eval() if isinstance(arg, Node) else arg for arg in self.args
+        ])
+
+    def execute(self, results: List[Any]) -> None:
+        """Runs a top level statement, storing its result at its source index."""
+        results[self.index] = self.eval()
+
+    def __repr__(self):
+        return "<Node %s at %s>" % (self.name, self.position)
+
+class Group(Node):
+    """Several statements that an optimization pass runs as one unit.
+
+    Subclasses implement :meth:`eval`, returning one result per statement in
+    ``nodes``; :meth:`fallback` runs the statements one by one instead.
+    """
+    __slots__ = ('nodes',)
+
+    def __init__(self, nodes: List[Node]) -> None:
+        super().__init__(None, [])
+        self.nodes = nodes
+
+    @property
+    def name(self) -> str:
+        return '+'.join(node.name for node in self.nodes)
+
+    @property
+    def position(self) -> Optional[SourcePosition]:
+        return self.nodes[0].position
+
+    def names(self) -> Iterator[Name]:
+        for node in self.nodes:
+            yield from node.names()
+
+    def targets(self) -> Iterator[Name]:
+        for node in self.nodes:
+            yield from node.targets()
+
+    def shares(self) -> bool:
+        return any(node.shares() for node in self.nodes)
+
+    def fallback(self) -> List[Any]:
+        return [node.eval() for node in self.nodes]
+
+    def eval(self) -> List[Any]:
+        return self.fallback()
+
+    def execute(self, results: List[Any]) -> None:
+        for node, value in zip(self.nodes, self.eval()):
+            results[node.index] = value
+
+    def __repr__(self):
+        return "<%s %s at %s>" % (type(self).__name__, self.name, self.position)
+
+Pass = Callable[[List[Node]], List[Node]]
+
+# productions whose results hold on to the images of the variables they use
+# (e.g. ``[a, b]``), filled by ``parser.production(..., shares=True)``
+sharing: Set[Callable[[list], Any]] = set()
+
+class Program:
+    """A compiled script.
+
+    Lexing and parsing happen once, in :meth:`fstop.Runner.compile`; the
+    resulting program can then be run any number of times. ``passes`` rewrite
+    the statement list, e.g. merging statements into :class:`Group` nodes;
+    results are still reported per source statement.
+
+    ``dead[i]`` lists the variables whose last use is ``statements[i]``;
+    the last statement's variables are never listed, as they make up what
+    the script leaves behind. ``shared`` holds the variables whose images
+    may still be used elsewhere once they are dead, so releasing them must
+    not close those images: the ones the script reads before binding them
+    (left by earlier runs) and the ones a sharing statement uses.
+    """
+
+    def __init__(self, statements: List[Node], passes: List[Pass] = ()) -> None:
+        self.length = len(statements)
+        for index, node in enumerate(statements):
+            node.index = index
+        for optimize in passes:
+            statements = optimize(statements)
+        self.statements = statements
+
+        last = {}
+        for i, node in enumerate(statements):
+            for name in node.names():
+                last[name] = i
+        self.dead: List[List[Name]] = [[] for _ in statements]
+        for name, i in last.items():
+            if i < len(statements) - 1:
+                self.dead[i].append(name)
+
+        self.shared: Set[Name] = set()
+        seen = set()
+        for node in statements:
+            names, targets = list(node.names()), set(node.targets())
+            if node.shares():
+                self.shared.update(names)
+            for name in set(names) - seen:
+                if name not in targets or names.count(name) > 1:
+                    self.shared.add(name)  # read before this script binds it
+            seen.update(names)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __repr__(self):
+        return "<Program statements=%d>" % len(self)
+
+    def run(
+        self, *, 
+        streams: Optional[List[BytesIO]] = [], 
+        context: Optional[Context] = None,
+        release: bool = False,
+        keep: Iterable[str] = (),
+        profile: Optional['Profile'] = None,
+        cache: Optional['ResultCache'] = None
+    ) -> List[Any]:
+        """Runs the program in ``context``, or in a fresh one when omitted.
+
+        Buffers written by ``SAVE ... STREAM`` are appended to
+        ``context.saved_streams``. With ``release``, each variable not in
+        ``keep`` is released (see :meth:`Context.release`) right after its
+        last use, so intermediates do not pile up; results of the statements
+        that produced them are then no longer usable. Each statement is
+        recorded in ``profile``, if given.
+
+        With a ``cache``, statements whose outcome it holds are skipped (and
+        report ``None``, or the buffer a ``SAVE ... STREAM`` wrote), and the
+        outcome of the others is stored in it.
+        """
+        if context is None:
+            context = Context()
+        results = [None] * self.length
+        for _, step in self.steps(
+            results, streams=streams, context=context, release=release, keep=keep, profile=profile, cache=cache,
+        ):
+            step()
+        return results
+
+    def steps(
+        self,
+        results: List[Any], *,
+        streams: Optional[List[BytesIO]],
+        context: Context,
+        release: bool = False,
+        keep: Iterable[str] = (),
+        profile: Optional['Profile'] = None,
+        cache: Optional['ResultCache'] = None
+    ) -> Iterator[Tuple[Node, Callable[[], None]]]:
+        """:meth:`run` one statement at a time, for callers that wait on
+        something between statements (see :meth:`fstop.Runner.execute_async`).
+
+        Yields each top level statement with a function that runs it into
+        ``results`` and releases the variables it was the last use of; call it,
+        from any thread, before asking for the next statement.
+        """
+        context.streams = streams
+        keep = set(keep)
+        replay = cache.replay(context) if cache is not None else None
+
+        def step(node: Node, dead: List[Name]) -> None:
+            with context.bind():
+                if replay is None or not replay.skip(node, results):
+                    if replay is not None:
+                        replay.restore()
+                    if profile is None and not registry.enabled:
+                        node.execute(results)
+                    else:
+                        with ExitStack() as stack:
+                            if profile is not None:
+                                stack.enter_context(profile.statement(node, context.env))
+                            if registry.enabled:
+                                stack.enter_context(registry.statement(node, context.env))
+                            node.execute(results)
+                    if replay is not None:
+                        replay.store(node)
+                if release:
+                    for name in dead:
+                        if name not in keep:
+                            if replay is not None:
+                                replay.forget(name)
+                            context.release(name, close=name not in self.shared)
+
+        for node, dead in zip(self.statements, self.dead):
+            yield node, partial(step, node, dead)
+        if replay is not None:
+            replay.restore()
@@ -0,0 +1,347 @@
+from typing import Iterable, Iterator, List, Optional, Union, Dict, Any
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+from collections import deque
+from contextlib import nullcontext
+from functools import partial
+from io import BytesIO
+
+import os
+import pickle
+import hashlib
+import threading
+
+from .context import Context
+from .lexer import generator, KeywordLexer
+from .parser import parser, open_statement, fetch_url
+from .program import Node, Group, Pass, Program
+from .optimizer import passes
+from .limits import Limits
+from .cache import ResultCache
+from .metrics import Exporter, Target as MetricsTarget, registry
+from .profile import Profile, tracing
+from .fonts import fonts, FontSpec
+from .utils import LazyModule, LRUCache
+
+from rply import Token
+
+asyncio = LazyModule('asyncio')
+futures = LazyModule('concurrent.futures.process')
+
+# compiled programs, shared by every Runner in the process
+programs = LRUCache(maxsize=256)
+
+Source = Union[bytes, BytesIO]
+
+class BatchResult:
+    """Outcome of one input of :meth:`Runner.map`.
+
+    ``streams`` holds the buffers written by ``SAVE ... STREAM``; if the script
+    raised, ``error`` holds the exception and ``streams`` is empty.
+    """
+    __slots__ = ('index', 'streams', 'error')
+
+    def __init__(self, index: int, streams: List[BytesIO], error: Optional[BaseException] = None) -> None:
+        self.index = index
+        self.streams = streams
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return "<BatchResult index=%d streams=%d error=%r>" % (self.index, len(self.streams), self.error)
+
+# process pool workers
+
+_worker = None
+
+def _init_worker(options: Dict[str, Any]) -> None:
+    global _worker
+    _worker = Runner(**options)  # builds (or loads) the parser tables once per process
+
+def _map_item(code: str, index: int, sources: List[bytes]) -> tuple:
+    program = _worker.compile(code)  # compiled once per worker, then served from the LRU
+    context = _worker.new_context()
+    try:
+        program.run(
+            streams=[BytesIO(source) for source in sources], context=context,
+            release=_worker.release, cache=_worker.cache,
+        )
+    except Exception as exc:
+        try:
+            pickle.dumps(exc)
+        except Exception:
+            exc = RuntimeError('%s: %s' % (type(exc).__name__, exc))
+        return index, [], exc
+    return index, [buffer.getvalue() for buffer in context.saved_streams], None
+
+def _urls(node: Node) -> Iterator[str]:
+    """The constant URLs opened by ``node``, looking into the statements
+    optimizer passes group together (an ``OPEN`` fused with a resize)."""
+    if isinstance(node, Group):
+        for inner in node.nodes:
+            yield from _urls(inner)
+    elif node.func is open_statement and isinstance(node.args[1], Token) \
+            and node.args[1].gettokentype() == 'URL' and isinstance(node.args[2], str):
+        yield node.args[2]
+
+def _read(source: Source) -> bytes:
+    return source.getvalue() if isinstance(source, BytesIO) else bytes(source)
+
+class Runner:
+    """Compiles and executes F-Stop scripts.
+
+    Variables persist across :meth:`execute` calls until :meth:`reset`; each
+    thread gets its own :class:`Context`, so one runner can serve a pool.
+
+    * ``optimize``: rewrite programs with the passes of :mod:`fstop.optimizer`,
+    * ``draft``: also decode images opened only to be shrunk at a reduced size
+      (faster, but not bit-identical),
+    * ``compose_geometry``: also merge geometric transforms into one resample
+      (faster, but not bit-identical),
+    * ``preload_fonts``: fonts to load into :data:`fstop.fonts.fonts` up front,
+    * ``tile_budget``: open images larger than this many bytes as
+      :class:`fstop.tiles.TiledImage`,
+    * ``strip_pixels``: run filters on images this large in strips on a thread pool,
+    * ``limits``: a :class:`fstop.limits.Limits` for every execution,
+    * ``release``: release variables after their last use (see :meth:`Program.run`),
+    * ``metrics``, ``metrics_interval``: where and how often to export
+      :data:`fstop.metrics.registry` (see :meth:`dump_metrics`),
+    * ``keyword_lexer``: lex with :class:`fstop.lexer.KeywordLexer` instead of rply,
+    * ``cache``: a :class:`fstop.cache.ResultCache` of statement outcomes.
+    """
+
+    def __init__(
+        self, *,
+        optimize: bool = True,
+        draft: bool = False,
+        compose_geometry: bool = False,
+        preload_fonts: Iterable[FontSpec] = (),
+        tile_budget: Optional[int] = None,
+        strip_pixels: Optional[int] = None,
+        release: bool = False,
+        limits: Optional[Limits] = None,
+        metrics: Optional[MetricsTarget] = None,
+        metrics_interval: float = 15.0,
+        keyword_lexer: bool = True,
+        cache: Optional[ResultCache] = None
+    ) -> None:
+        self._lexergen  = generator
+        self._parsergen = parser
+        self.lexer  = KeywordLexer(self._lexergen) if keyword_lexer else self._lexergen.build()
+        self.parser = self._parsergen.build()  # memoized, and loaded from the table cache when possible
+        self._local = threading.local()
+        self._pool = None
+        self._workers = 0  # processes in _pool
+        self.optimize = optimize
+        self.draft = draft
+        self.compose_geometry = compose_geometry
+        self.preload_fonts = tuple(preload_fonts)
+        fonts.preload(self.preload_fonts)
+        self.tile_budget = tile_budget
+        self.strip_pixels = strip_pixels
+        self.release = release
+        self.limits = limits
+        self.metrics = metrics
+        self.metrics_interval = metrics_interval
+        self.keyword_lexer = keyword_lexer
+        self.cache = cache
+        self._exporter = None
+        if metrics is not None:
+            registry.enable()
+            self._exporter = Exporter(metrics, metrics_interval)
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        """The keyword arguments this runner was created with."""
+        return {
+            'optimize': self.optimize, 'draft': self.draft, 'compose_geometry': self.compose_geometry,
+            'preload_fonts': self.preload_fonts, 'tile_budget': self.tile_budget,
+            'strip_pixels': self.strip_pixels, 'release': self.release, 'limits': self.limits,
+            'keyword_lexer': self.keyword_lexer, 'cache': self.cache,
+        }
+
+    @property
+    def _passes(self) -> List[Pass]:
+        return passes(self.draft, self.compose_geometry) if self.optimize else []
+
+    def new_context(self) -> Context:
+        return Context(tile_budget=self.tile_budget, strip_pixels=self.strip_pixels, limits=self.limits)
+
+    @property
+    def context(self) -> Context:
+        try:
+            return self._local.context
+        except AttributeError:
+            self._local.context = context = self.new_context()
+            return context
+
+    @property
+    def streams(self) -> List[BytesIO]:
+        return self.context.saved_streams
+
+    def compile(self, code: str, *, profile: Optional[Profile] = None) -> Program:
+        key = hashlib.sha1(code.encode()).hexdigest(), self.optimize, self.draft, self.compose_geometry, self.keyword_lexer
+        if (program := programs.get(key)) is not None:
+            if profile is not None:
+                with profile.span('compile', 'compile', cached=True):
+                    pass
+            return program
+
+        if profile is None:
+            tokens = self.lexer.lex(code)
+            program = Program(self.parser.parse(tokens), passes=self._passes)
+        else:
+            with profile.span('lex', 'compile') as span:
+                tokens = list(self.lexer.lex(code))  # the lexer is lazy, drain it to time it alone
+                span.args['tokens'] = len(tokens)
+            with profile.span('parse', 'compile'):
+                statements = self.parser.parse(iter(tokens))
+            with profile.span('optimize', 'compile', statements=len(statements)):
+                program = Program(statements, passes=self._passes)
+        programs.put(key, program)
+        return program
+
+    def execute(
+        self, 
+        code: str, *,
+        streams: Optional[List[BytesIO]] = [],
+        profile: bool = False
+    ) -> List[Any]:
+        """Runs ``code`` in this thread's context.
+
+        With ``profile``, lexing, parsing and every statement are timed (wall
+        and CPU time, memory, sizes of the images involved) into a
+        :class:`fstop.profile.Profile`, left in :attr:`profile`; its
+        ``save`` method writes a Chrome / Perfetto trace.
+        """
+        if not profile:
+            return self.compile(code).run(streams=streams, context=self.context, release=self.release, cache=self.cache)
+
+        self._local.profile = recorded = Profile()
+        with tracing():
+            program = self.compile(code, profile=recorded)
+            return program.run(
+                streams=streams, context=self.context, release=self.release, profile=recorded, cache=self.cache,
+            )
+
+    @property
+    def profile(self) -> Optional[Profile]:
+        """The profile of the last ``execute(..., profile=True)`` in this thread."""
+        return getattr(self._local, 'profile', None)
+
+    async def execute_async(
+        self,
+        code: str, *,
+        streams: Optional[List[BytesIO]] = [],
+        context: Optional[Context] = None,
+        executor: Optional[Executor] = None,
+        profile: bool = False
+    ) -> List[Any]:
+        """Executes ``code`` without blocking the event loop.
+
+        Every statement runs on ``executor`` (the loop's default executor when
+        omitted). All ``OPEN URL`` statements with a constant URL are fetched
+        concurrently as soon as execution starts, and each statement only waits
+        for its own download. Each call runs in a fresh :class:`Context` unless
+        one is given. ``profile`` is as in :meth:`execute`, for the thread
+        awaiting this call.
+        """
+        loop = asyncio.get_running_loop()
+        recorded = Profile() if profile else None
+        if profile:
+            self._local.profile = recorded
+        with tracing() if profile else nullcontext():
+            program = await loop.run_in_executor(executor, partial(self.compile, code, profile=recorded))
+            if context is None:
+                context = self.new_context()
+
+            fetches = {}
+            for node in program.statements:
+                for url in _urls(node):
+                    if url not in fetches:
+                        fetches[url] = loop.run_in_executor(executor, fetch_url, url)
+
+            results = [None] * len(program)
+            steps = program.steps(
+                results, streams=streams, context=context, release=self.release, profile=recorded, cache=self.cache,
+            )
+            try:
+                for node, step in steps:
+                    for url in _urls(node):
+                        if url not in context.fetched:
+                            context.fetched[url] = await fetches[url]
+                    await loop.run_in_executor(executor, step)
+            finally:
+                for future in fetches.values():
+                    future.cancel()
+                # collects downloads that finished or failed while nobody was waiting for them
+                await asyncio.gather(*fetches.values(), return_exceptions=True)
+        return results
+
+    def dump_metrics(self, target: Optional[MetricsTarget] = None) -> None:
+        """Writes the metrics registry in the Prometheus text format to
+        ``target``, or to this runner's ``metrics`` when omitted, right away
+        (the runner also does so every ``metrics_interval`` seconds)."""
+        registry.dump(target if target is not None else self.metrics)
+
+    def map(
+        self,
+        code: str,
+        inputs: Iterable[Union[Source, List[Source]]], *,
+        workers: Optional[int] = None,
+        ordered: bool = True
+    ) -> Iterator[BatchResult]:
+        """Runs ``code`` once per input on a pool of worker processes.
+
+        Each input is either one source (``STREAM 0``) or a list of sources.
+        Results are yielded in input order, or as they complete when
+        ``ordered`` is false; errors are reported per item instead of stopping
+        the batch. The pool is kept alive between calls until :meth:`close`.
+        """
+        workers = workers or os.cpu_count() or 1
+        pool = self._process_pool(workers)
+        window = workers * 4  # bounds how many inputs are in flight at once
+        pending = deque()
+
+        def collect() -> Iterator[BatchResult]:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+            for future in done:
+                index, streams, error = future.result()
+                yield BatchResult(index, [BytesIO(data) for data in streams], error)
+
+        for index, item in enumerate(inputs):
+            sources = [_read(s) for s in item] if isinstance(item, (list, tuple)) else [_read(item)]
+            pending.append(pool.submit(_map_item, code, index, sources))
+            while len(pending) >= window:
+                yield from collect()
+        while pending:
+            yield from collect()
+
+    def _process_pool(self, workers: int) -> 'futures.ProcessPoolExecutor':
+        if self._pool is not None and self._workers != workers:
+            self.close()
+        if self._pool is None:
+            self._pool = futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.options,))
+            self._workers = workers
+        return self._pool
+
+    def close(self) -> None:
+        """Shuts down the worker processes started by :meth:`map`, and the
+        periodic metrics dumps after a last one."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._exporter is not None:
+            self._exporter.stop()
+            self._exporter = None
+
+    def reset(self) -> Dict:
+        self._local.context = self.new_context()
+        return {}
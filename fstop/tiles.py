@@ -0,0 +1,260 @@
+from typing import BinaryIO, Callable, Iterator, Optional, Tuple, Union
+from threading import Lock
+
+import os
+import math
+import mmap
+import struct
+import tempfile
+
+from PIL import Image, ImageFilter
+
+from .objects import ImageRepr, conversions
+from .utils import LazyModule
+
+np = LazyModule('numpy')
+futures = LazyModule('concurrent.futures.thread')
+
+_pool = None
+_pool_workers = 0  # threads in _pool
+_pool_lock = Lock()
+
+def strip_pool() -> 'futures.ThreadPoolExecutor':
+    """The thread pool strips of one image are filtered on. It is separate
+    from :func:`fstop.objects.frame_pool`, since frame threads wait on it."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None:
+            _pool_workers = os.cpu_count() or 1
+            _pool = futures.ThreadPoolExecutor(_pool_workers, thread_name_prefix='fstop-strips')
+        return _pool
+
+Strip = Tuple[int, int, int, int]  # rows [y0, y1) to produce, read from rows [top, bottom)
+
+def halo(filter: ImageFilter.Filter) -> Optional[int]:
+    """How many rows of context above and below a strip ``filter`` needs for
+    the strip to come out exactly as it would in the whole image; ``None``
+    when the filter is not local."""
+    if isinstance(filter, type):
+        filter = filter()  # Image.filter accepts the builtin filter classes too
+    if isinstance(filter, ImageFilter.GaussianBlur):
+        radius = max(filter.radius) if isinstance(filter.radius, tuple) else filter.radius
+        # three box blur passes, each with a box radius of at most sqrt(4r^2 + 1) / 2
+        return 3 * (math.ceil(math.sqrt(4 * radius ** 2 + 1) / 2) + 1)
+    elif isinstance(filter, ImageFilter.BoxBlur):
+        radius = max(filter.radius) if isinstance(filter.radius, tuple) else filter.radius
+        return math.ceil(radius) + 1
+    elif isinstance(filter, (ImageFilter.RankFilter, ImageFilter.ModeFilter)):
+        return filter.size // 2
+    elif isinstance(filter, ImageFilter.BuiltinFilter):
+        return filter.filterargs[0][1] // 2
+
+def strips(height: int, rows: int, halo: int) -> Iterator[Strip]:
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        yield y0, y1, max(y0 - halo, 0), min(y1 + halo, height)
+
+def in_strips(image: Image.Image, func: Callable[[Image.Image], Image.Image], halo: int) -> Image.Image:
+    """``func(image)`` computed as horizontal strips in parallel, for a
+    ``func`` that keeps the size and is local as in :meth:`TiledImage.map`.
+    Each strip is read with ``halo`` extra rows on both sides, so the
+    stitched result is identical to a single call."""
+    pool = strip_pool()
+    workers = _pool_workers
+    rows = -(-image.height // workers)
+    if workers < 2 or rows < max(halo, 1):
+        return func(image)  # the overlap would cost more than the threads save
+
+    def strip(bounds: Strip) -> Image.Image:
+        y0, y1, top, bottom = bounds
+        result = func(image.crop((0, top, image.width, bottom)))
+        return result.crop((0, y0 - top, image.width, y1 - top))
+
+    image.load()
+    bounds = list(strips(image.height, rows, halo))
+    out = None
+    for (y0, *_), result in zip(bounds, pool.map(strip, bounds)):
+        if out is None:
+            out = Image.new(result.mode, image.size)
+        out.paste(result, (0, y0))
+    return out
+
+def allocate(shape: tuple) -> 'np.memmap':
+    """A zeroed, anonymous memory-mapped array, backed by a temporary file
+    that is removed once the array is released."""
+    with tempfile.TemporaryFile() as f:
+        return np.memmap(f, dtype=np.uint8, mode='w+', shape=shape)
+
+def release(*stores: 'np.ndarray') -> None:
+    """Unmaps the pages of memory-mapped ``stores`` that this process has
+    touched. They stay in the page cache and in the file, but no longer count
+    against the resident memory of the process."""
+    for store in stores:
+        if (mapping := getattr(store, '_mmap', None)) is not None and hasattr(mmap, 'MADV_DONTNEED'):
+            mapping.madvise(mmap.MADV_DONTNEED)
+
+def raw_strips(image: Image.Image) -> Optional[Tuple[int, int]]:
+    """``(offset, length)`` of the pixel data of an uncompressed, 8 bit, chunky
+    TIFF whose strips are stored back to back, so it can be mapped as is."""
+    if image.format != 'TIFF' or image.info.get('compression') != 'raw' or not getattr(image, 'filename', None):
+        return None
+    tags = image.tag_v2
+    offsets, counts = tags.get(273), tags.get(279)
+    if not offsets or not counts or tags.get(284, 1) != 1 or set(tags.get(258, (8,))) != {8}:
+        return None
+    for offset, count, following in zip(offsets, counts, offsets[1:]):
+        if offset + count != following:
+            return None
+    return offsets[0], sum(counts)
+
+class TiledImage(ImageRepr):
+    """An image variable kept in a memory-mapped file instead of in memory.
+
+    Local statements (see :func:`fstop.parser.update`) read and write it in
+    strips of full rows, sized so that about ``budget`` bytes of pixels are
+    in memory at a time. Any other statement reads :attr:`image`, which loads
+    the whole image and turns the variable into a regular in-memory one.
+    Only L, RGB and RGBA images are tiled.
+    """
+    modes = ('L', 'RGB', 'RGBA')
+
+    def __init__(self, store: 'np.ndarray', budget: int) -> None:
+        super().__init__()
+        self.store = store
+        self.budget = budget
+
+    @classmethod
+    def open(cls, image: Image.Image, budget: int) -> 'TiledImage':
+        """Maps uncompressed TIFFs directly; other files are decoded once and
+        copied to a backing file."""
+        bands = len(image.getbands())
+        shape = (image.height, image.width) if bands == 1 else (image.height, image.width, bands)
+        if (raw := raw_strips(image)) is not None and raw[1] == math.prod(shape):
+            return cls(np.memmap(image.filename, dtype=np.uint8, mode='r', offset=raw[0], shape=shape), budget)
+
+        store = allocate(shape)
+        image.load()
+        for y0, y1, _, _ in strips(image.height, cls.rows(store, budget), 0):
+            store[y0:y1] = np.asarray(image.crop((0, y0, image.width, y1)))
+            release(store)
+        image.close()
+        return cls(store, budget)
+
+    @staticmethod
+    def rows(store: 'np.ndarray', budget: int, halo: int = 0) -> int:
+        # several copies of a strip are alive at once: its mapped pages, the PIL
+        # image made from them, the result and its temporaries (more for OpenCV
+        # statements, which convert to BGR and back), and the pages written to
+        return max(budget // (12 * store[0].nbytes) - 2 * halo, 1)
+
+    @property
+    def image(self) -> Image.Image:
+        if self.store is not None:
+            conversions['image'] += 1
+            self._image, self.store = Image.fromarray(np.array(self.store)), None
+        return super().image
+
+    @image.setter
+    def image(self, image: Image.Image) -> None:
+        self.store = None
+        ImageRepr.image.fset(self, image)
+
+    @property
+    def array(self) -> 'np.ndarray':
+        self.image  # loads the store, if any
+        return super().array
+
+    @array.setter
+    def array(self, arr: 'np.ndarray') -> None:
+        self.store = None
+        ImageRepr.array.fset(self, arr)
+
+    @property
+    def size(self) -> tuple:
+        if self.store is not None:
+            return self.store.shape[1], self.store.shape[0]
+        return super().size
+
+    @property
+    def mode(self) -> str:
+        if self.store is not None:
+            return 'L' if self.store.ndim == 2 else {3: 'RGB', 4: 'RGBA'}[self.store.shape[2]]
+        return super().mode
+
+    def map(self, func: Callable[[Image.Image], Image.Image], halo: int = 0) -> None:
+        """Replaces the image with ``func(image)``, computed strip by strip.
+
+        ``func`` must keep the size of the image, and be local: each output
+        pixel may only depend on input pixels at most ``halo`` rows away.
+        """
+        height, width = self.store.shape[:2]
+        out = None
+        for y0, y1, top, bottom in strips(height, self.rows(self.store, self.budget, halo), halo):
+            result = func(Image.fromarray(np.asarray(self.store[top:bottom])))
+            if result.size != (width, bottom - top) or result.mode not in self.modes:
+                raise ValueError('Tiled statements must keep the size and produce an L, RGB or RGBA image')
+            arr = np.asarray(result)[y0 - top:y1 - top]
+            if out is None:
+                out = allocate((height,) + arr.shape[1:])
+            out[y0:y1] = arr
+            release(self.store, out)
+        out.flush()
+        self.store = out
+
+    def release(self, close: bool = True) -> None:
+        self.store = None
+        super().release(close)
+
+    def copy(self) -> ImageRepr:
+        if self.store is None:
+            return super().copy()
+        out = allocate(self.store.shape)
+        for y0, y1, _, _ in strips(self.store.shape[0], self.rows(self.store, self.budget), 0):
+            out[y0:y1] = self.store[y0:y1]
+            release(self.store, out)
+        return TiledImage(out, self.budget)
+
+    def save_tiff(self, fp: Union[str, BinaryIO]) -> None:
+        """Writes an uncompressed TIFF strip by strip, without loading the image."""
+        if isinstance(fp, str):
+            with open(fp, 'wb') as f:
+                return self.save_tiff(f)
+
+        height, width = self.store.shape[:2]
+        bands = 1 if self.store.ndim == 2 else self.store.shape[2]
+        entries = 11 if bands == 4 else 10
+        ifd_size = 2 + 12 * entries + 4
+        bits_offset = 8 + ifd_size
+        data_offset = bits_offset + (2 * bands if bands > 1 else 0)
+
+        tags = [
+            (256, 4, 1, width),  # ImageWidth
+            (257, 4, 1, height),  # ImageLength
+            (258, 3, bands, 8 if bands == 1 else bits_offset),  # BitsPerSample
+            (259, 3, 1, 1),  # Compression: none
+            (262, 3, 1, 1 if bands == 1 else 2),  # PhotometricInterpretation
+            (273, 4, 1, data_offset),  # StripOffsets
+            (277, 3, 1, bands),  # SamplesPerPixel
+            (278, 4, 1, height),  # RowsPerStrip
+            (279, 4, 1, self.store.nbytes),  # StripByteCounts
+            (284, 3, 1, 1),  # PlanarConfiguration: chunky
+        ]
+        if bands == 4:
+            tags.append((338, 3, 1, 2))  # ExtraSamples: unassociated alpha
+
+        fp.write(b'II*\x00' + struct.pack('<I', 8))
+        fp.write(struct.pack('<H', len(tags)))
+        for tag, type_, count, value in tags:
+            packed = struct.pack('<H', value) + b'\x00\x00' if type_ == 3 and count == 1 else struct.pack('<I', value)
+            fp.write(struct.pack('<HHI', tag, type_, count) + packed)
+        fp.write(struct.pack('<I', 0))
+        if bands > 1:
+            fp.write(struct.pack('<%dH' % bands, *[8] * bands))
+        for y0, y1, _, _ in strips(height, self.rows(self.store, self.budget), 0):
+            fp.write(self.store[y0:y1].tobytes())
+            release(self.store)
+
+    def __repr__(self):
+        if self.store is not None:
+            return "<TiledImage size=%s mode=%s>" % (self.size, self.mode)
+        return super().__repr__()
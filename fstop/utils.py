@@ -0,0 +1,97 @@
+from typing import Any, Callable, Dict, Hashable, Optional
+from types import ModuleType
+from importlib import import_module
+from collections import OrderedDict
+from threading import Lock
+
+class LazyModule:
+    """Stand-in for a module that is only imported on first attribute access,
+    so that ``import fstop`` does not pay for OpenCV and NumPy up front."""
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module = None
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            self._module = import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return "<LazyModule name='%s' loaded=%s>" % (self._name, self._module is not None)
+
+class LRUCache:
+    """A small thread-safe LRU mapping, bounded by entry count and, when
+    ``maxbytes`` is given, by the total ``sizeof`` of its values."""
+
+    def __init__(
+        self, 
+        maxsize: Optional[int] = 128, 
+        maxbytes: Optional[int] = None, 
+        sizeof: Callable[[Any], int] = len
+    ) -> None:
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.hits = self.misses = self.evictions = 0
+        self.nbytes = 0
+        self._data = OrderedDict()  # key -> (value, size)
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self._data[key][0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        with self._lock:
+            if (old := self._data.pop(key, None)) is not None:
+                self.nbytes -= old[1]
+            if self.maxbytes is not None and size > self.maxbytes:
+                return  # larger than the whole budget, never cached
+
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while (
+                (self.maxsize is not None and len(self._data) > self.maxsize) or
+                (self.maxbytes is not None and self.nbytes > self.maxbytes)
+            ):
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if (old := self._data.pop(key, None)) is None:
+                return default
+            self.nbytes -= old[1]
+            return old[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._data),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
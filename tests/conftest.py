@@ -0,0 +1,76 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from threading import Lock, Thread
+from urllib.parse import urlsplit
+
+import time
+
+import pytest
+from PIL import Image
+
+from fstop import fetch
+
+def encode(image: Image.Image, format: str) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format)
+    return buffer.getvalue()
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        try:
+            time.sleep(server.delay)
+            body = server.files.get(urlsplit(self.path).path)  # proxies get the whole URL
+            etag = '"%d"' % hash(body)
+            if body is None:
+                self.send_response(404)
+                body = b''
+            elif self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                body = b''
+            else:
+                self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args) -> None:
+        pass
+
+@pytest.fixture
+def server(monkeypatch):
+    """A local HTTP server serving ``server.files`` by path, each response
+    after ``server.delay`` seconds, with ETags; ``server.url(path)``."""
+    monkeypatch.setenv('no_proxy', '127.0.0.1')  # whatever proxies the environment sets
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.daemon_threads = True
+    httpd.lock = Lock()
+    httpd.requests, httpd.active, httpd.peak, httpd.delay = [], 0, 0, 0.0
+    httpd.files = {
+        '/%s.png' % name: encode(Image.new('RGB', (640, 480), color), 'PNG')
+        for name, color in (('red', (255, 0, 0)), ('green', (0, 255, 0)), ('blue', (0, 0, 255)))
+    }
+    httpd.url = lambda path: 'http://127.0.0.1:%d%s' % (httpd.server_address[1], path)
+    thread = Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def fetcher(monkeypatch):
+    """A fresh process-wide fetcher, so no test sees another's cached bodies."""
+    instance = fetch.Fetcher()
+    monkeypatch.setattr(fetch, 'fetcher', instance)
+    yield instance
+    instance.close()
@@ -0,0 +1,73 @@
+"""Runs scripts concurrently from a thread pool through one shared Runner and
+checks every output is byte-identical to a serial run; a short run is part
+of the pytest suite (``tests/test_stress.py``).
+
+    python -m tests.stress [executions] [threads]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import os
+import sys
+
+from fstop import Runner
+
+ASSET = os.path.join(os.path.dirname(__file__), '..', 'assets', 'test.png')
+
+SCRIPTS = [
+    '''
+    OPEN STREAM 0 AS img
+    CONVERT img "RGB"
+    BLUR img 3
+    INVERT img
+    RESIZE img (WIDTH img | 2, HEIGHT img | 2)
+    SAVE img STREAM "PNG"
+    ''',
+    '''
+    OPEN STREAM 0 AS img
+    NEW "RGB" SIZE img COLOR (0, 0, 255) AS bg
+    CONVERT img MODE bg
+    CLONE img AS overlay
+    ROTATE img 33
+    BLEND bg, overlay ALPHA 0.25 AS blended
+    RECTANGLE blended (50, 50, 200, 200) 10 COLOR (255, 0, 0)
+    SAVE blended STREAM "PNG"
+    ''',
+    '''
+    OPEN STREAM 0 AS img
+    CONVERT img "RGB"
+    CANNY img 100, 200
+    COLORMAP img "JET"
+    SAVE img STREAM "PNG"
+    ''',
+    '''
+    NEW "L" (64, 64) COLOR 40 AS a
+    NEW "L" (64, 64) COLOR 200 AS b
+    NEW [a, b] AS frames
+    SAVE frames STREAM "GIF" DURATION 100 LOOP 0
+    ''',
+]
+
+def run(runner: Runner, script: str, source: bytes) -> list:
+    runner.execute(script, streams=[BytesIO(source)])
+    outputs = [buffer.getvalue() for buffer in runner.streams]
+    runner.reset()
+    return outputs
+
+def main(executions: int = 200, threads: int = 8) -> None:
+    with open(ASSET, 'rb') as f:
+        source = f.read()
+
+    runner = Runner()
+    expected = [run(runner, script, source) for script in SCRIPTS]
+
+    jobs = [SCRIPTS[i % len(SCRIPTS)] for i in range(executions)]
+    with ThreadPoolExecutor(threads) as pool:
+        outputs = list(pool.map(lambda script: run(runner, script, source), jobs))
+
+    for i, output in enumerate(outputs):
+        assert output == expected[i % len(SCRIPTS)], 'execution %d diverged from the serial run' % i
+    print('%d executions on %d threads match the serial outputs' % (executions, threads))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
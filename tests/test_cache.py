@@ -0,0 +1,71 @@
+from io import BytesIO
+
+import os
+
+import pytest
+from PIL import Image
+
+from fstop import Runner
+from fstop.cache import ResultCache
+
+from .stress import ASSET
+
+def test_computed_open_paths_are_not_cached(tmp_path):
+    for mode, color in (('RGB', (255, 0, 0)), ('L', 128)):
+        Image.new(mode, (4, 4), color).save(tmp_path / ('%s.png' % mode))
+    runner = Runner(cache=ResultCache())
+
+    for mode in ('RGB', 'L', 'RGB'):
+        script = 'NEW "%s" (1, 1) AS m\nOPEN "%s/" + MODE m + ".png" AS img' % (mode, tmp_path)
+        runner.execute(script)
+        assert runner.context.env['img'].image.mode == mode
+        runner.reset()
+
+PREFIX = 'OPEN STREAM 0 AS img\nCONVERT img "RGB"\nBLUR img 2\n'
+
+def outputs(runner: Runner, script: str, source: bytes) -> list:
+    runner.execute(script, streams=[BytesIO(source)])
+    streams = [buffer.getvalue() for buffer in runner.streams]
+    runner.reset()
+    return streams
+
+@pytest.fixture(scope='module')
+def source():
+    with open(ASSET, 'rb') as f:
+        return f.read()
+
+def test_closed_images_are_not_cached(monkeypatch):
+    monkeypatch.chdir(os.path.dirname(ASSET) + '/..')
+    monkeypatch.setattr(Image.Image, 'show', lambda image, title=None: None)
+    with open('test.ft') as f:
+        script = f.read()
+
+    def state(runner: Runner) -> dict:
+        env = runner.context.env
+        return {'overlay': env['overlay'].image.tobytes(), 'var': [frame.tobytes() for frame in env['var']]}
+
+    plain = Runner()
+    plain.execute(script)
+    runner = Runner(cache=ResultCache())
+    for _ in range(2):
+        runner.execute(script)  # CLOSE leaves images that cannot be stored
+        assert state(runner) == state(plain)
+        runner.reset()
+
+def test_cache_hits_match_uncached_output(source):
+    script = PREFIX + 'INVERT img\nSAVE img STREAM "PNG"'
+    expected = outputs(Runner(), script, source)
+    cache = ResultCache()
+    runner = Runner(cache=cache)
+    assert outputs(runner, script, source) == expected
+    assert cache.memory.hits == 0
+    assert outputs(runner, script, source) == expected
+    assert cache.memory.hits == 5
+
+def test_prefixes_are_shared_between_scripts(source):
+    first, second = PREFIX + 'INVERT img\nSAVE img STREAM "PNG"', PREFIX + 'SOLARIZE img\nSAVE img STREAM "PNG"'
+    cache = ResultCache()
+    runner = Runner(cache=cache)
+    assert outputs(runner, first, source) == outputs(Runner(), first, source)
+    assert outputs(runner, second, source) == outputs(Runner(), second, source)
+    assert cache.memory.hits == 3  # OPEN, CONVERT and BLUR
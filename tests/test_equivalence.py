@@ -0,0 +1,88 @@
+"""Optimized and parallel execution paths against plain execution."""
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from fstop import Runner, tiles
+from fstop.optimizer import DrawBatch, PointChain
+from fstop.tiles import TiledImage
+
+from .stress import ASSET
+
+@pytest.fixture(scope='module')
+def source():
+    with open(ASSET, 'rb') as f:
+        return f.read()
+
+def output(runner: Runner, script: str, source: bytes) -> Image.Image:
+    runner.execute('OPEN STREAM 0 AS img\n%s\nSAVE img STREAM "PNG"' % script, streams=[BytesIO(source)])
+    return Image.open(runner.streams[-1])
+
+def assert_same(runner: Runner, script: str, source: bytes) -> None:
+    expected = output(Runner(optimize=False), script, source)
+    result = output(runner, script, source)
+    assert (result.mode, result.size) == (expected.mode, expected.size)
+    assert result.tobytes() == expected.tobytes()
+
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+@pytest.mark.parametrize('chain', [
+    'INVERT img\nSOLARIZE img 100\nPOSTERIZE img 3',
+    'CONTRAST img 1.4\nBRIGHTEN img 0.8\nINVERT img',
+    'BRIGHTEN img 1.3\nSOLARIZE img\nBRIGHTEN img 0.7\nPOSTERIZE img',
+])
+def test_point_chains_match_plain(source, mode, chain):
+    script = 'CONVERT img "%s"\n%s' % (mode, chain)
+    runner = Runner()
+    assert any(isinstance(node, PointChain) for node in runner.compile('OPEN STREAM 0 AS img\n' + script).statements)
+    assert_same(runner, script, source)
+
+@pytest.mark.parametrize('script', [
+    'BLUR img 4',
+    'MEDIAN_FILTER img 5',
+    'MODE_FILTER img 3',
+    'MAX_FILTER img 3\nMIN_FILTER img 5',
+    'CONVERT img "RGB"\nCANNY img 100, 200',
+])
+def test_strips_match_plain(source, script, monkeypatch):
+    tiles.strip_pool()
+    monkeypatch.setattr(tiles, '_pool_workers', 4)  # split even on machines with fewer cores
+    assert_same(Runner(optimize=False, strip_pixels=1000), script, source)
+
+@pytest.mark.parametrize('script', [
+    'CONVERT img "RGB"\nINVERT img\nBLUR img 3',
+    'CONVERT img "RGB"\nMEDIAN_FILTER img 3\nPOSTERIZE img 2',
+    'CONVERT img "L"\nTHRESHOLD img 100, 255 "THRESH_BINARY"',
+])
+def test_tiled_images_match_plain(source, script):
+    runner = Runner(optimize=False, tile_budget=64 * 1024)
+    runner.execute('OPEN STREAM 0 AS img\n' + script, streams=[BytesIO(source)])
+    img = runner.context.env['img']
+    assert isinstance(img, TiledImage) and img.store is not None  # processed strip by strip
+    assert_same(runner, script, source)
+
+@pytest.mark.parametrize('bits', [0, -2, 9])
+def test_point_chains_reject_what_plain_statements_reject(source, bits):
+    script = 'CONVERT img "RGB"\nINVERT img\nPOSTERIZE img %d' % bits
+    for runner in (Runner(optimize=False), Runner()):
+        with pytest.raises(ValueError):
+            output(runner, script, source)
+
+def test_draw_batches_match_plain():
+    script = '\n'.join([
+        'NEW "RGB" (64, 64) COLOR (20, 20, 20) AS img',
+        'DOT img (1, 1)', 'DOT img (2, 2)', 'DOT img (3, 3) COLOR (255, 0, 0)', 'DOT img (4, 4) COLOR (255, 0, 0)',
+        'DOT img (5, 5, 6, 6)', 'DOT img (7, 7) COLOR (0, 255, 0)',
+        'LINE img (0, 10, 30, 10)', 'LINE img (30, 10, 30, 40)', 'LINE img (30, 40, 60, 40) COLOR (0, 0, 255)',
+        'LINE img (60, 40, 60, 60) COLOR (0, 0, 255)', 'LINE img (60, 60, 10, 60) 3 COLOR (0, 0, 255)',
+        'LINE img (10, 60, 10, 20) 3 COLOR (0, 0, 255)', 'LINE img (10, 20, 50, 20) 1 COLOR (0, 0, 255)',
+        'LINE img (5, 50, 20, 50)', 'LINE img (40, 50, 50, 55)', 'DOT img (50, 55)',
+        'SAVE img STREAM "PNG"',
+    ])
+    runner = Runner()
+    assert any(isinstance(node, DrawBatch) for node in runner.compile(script).statements)
+    outputs = []
+    for runner in (Runner(optimize=False), runner):
+        runner.execute(script)
+        outputs.append(Image.open(runner.streams[-1]).tobytes())
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+import gc
+import time
+
+import pytest
+
+from fstop import Runner
+from fstop.cache import ResultCache
+from fstop.fetch import Fetcher
+from fstop.optimizer import DraftOpen
+
+@pytest.mark.parametrize('optimize', [False, True])
+def test_execute_async_prefetches_every_url(server, fetcher, optimize):
+    server.delay = 0.5
+    script = '\n'.join(
+        'OPEN URL "%s" AS %s\nRESIZE %s (64, 48)' % (server.url('/%s.png' % name), name, name)
+        for name in ('red', 'green', 'blue')
+    )
+    runner = Runner(optimize=optimize, draft=True)
+    program = runner.compile(script)
+    assert any(isinstance(node, DraftOpen) for node in program.statements) == optimize
+
+    start = time.perf_counter()
+    asyncio.run(runner.execute_async(script))
+    elapsed = time.perf_counter() - start
+
+    assert server.peak == 3
+    assert elapsed < 1.0  # one delay, not three
+
+def test_fetches_overlap(server, fetcher):
+    server.delay = 0.5
+    urls = [server.url('/%s.png' % name) for name in ('red', 'green', 'blue')]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(3) as pool:
+        bodies = list(pool.map(fetcher.fetch, urls))
+    assert time.perf_counter() - start < 1.0
+    assert server.peak == 3
+    assert bodies == [server.files['/%s.png' % name] for name in ('red', 'green', 'blue')]
+
+def test_disk_cache_revalidates_with_etag(server, tmp_path):
+    url = server.url('/red.png')
+    for _ in range(2):
+        fetcher = Fetcher(cache_dir=str(tmp_path))  # a new process, with an empty memory tier
+        assert fetcher.fetch(url) == server.files['/red.png']
+        fetcher.close()
+    assert fetcher.stats()['revalidated'] == 1
+    assert fetcher.stats()['bytes_fetched'] == 0  # answered with 304 Not Modified
+    assert len(server.requests) == 2
+
+def test_concurrent_requests_are_coalesced(server, fetcher):
+    server.delay = 0.3
+    url = server.url('/green.png')
+    with ThreadPoolExecutor(4) as pool:
+        bodies = list(pool.map(lambda _: fetcher.fetch(url), range(4)))
+    assert bodies == [server.files['/green.png']] * 4
+    assert server.requests == ['/green.png']
+    assert fetcher.stats()['coalesced'] == 3
+
+def test_memory_tier_revalidates_after_max_age(server):
+    fetcher = Fetcher(max_age=0.2)
+    url = server.url('/blue.png')
+    for _ in range(2):
+        assert fetcher.fetch(url) == server.files['/blue.png']
+    assert len(server.requests) == 1  # still fresh
+
+    time.sleep(0.3)
+    assert fetcher.fetch(url) == server.files['/blue.png']
+    stats = fetcher.stats()
+    assert len(server.requests) == 2
+    assert stats['revalidated'] == 1
+    assert stats['bytes_fetched'] == len(server.files['/blue.png'])
+    fetcher.close()
+
+def test_plain_http_goes_through_the_proxy(server, monkeypatch):
+    monkeypatch.setenv('no_proxy', '')
+    fetcher = Fetcher(proxies={'http': server.url('')})
+    assert fetcher.fetch('http://images.invalid/red.png') == server.files['/red.png']
+    assert server.requests == ['http://images.invalid/red.png']
+    fetcher.close()
+
+def test_execute_async_shares_the_run_loop(fetcher):
+    script = 'NEW "RGB" (8, 8) COLOR (10, 20, 30) AS img\nINVERT img\nSAVE img STREAM "PNG"'
+    cache = ResultCache()
+    runner = Runner(cache=cache, release=True)
+    expected = Runner()
+    expected.execute(script)
+
+    for run in range(2):
+        context = runner.new_context()
+        asyncio.run(runner.execute_async(script, context=context, profile=True))
+        assert context.saved_streams[0].getvalue() == expected.streams[0].getvalue()
+        statements = [span.name for span in runner.profile.spans if span.category == 'statement']
+        assert statements == ([] if run else ['new_statement', 'invert_op', 'save_statement'])
+    assert cache.memory.hits == 3
+
+def test_execute_async_collects_downloads_after_an_error(server, fetcher):
+    # the download fails while the first statements run, and nothing waits for it
+    script = 'NEW "RGB" (2000, 2000) AS a\nBLUR a 20\nRESIZE missing (2, 2)\nOPEN URL "%s" AS img' % server.url('/missing.png')
+    errors = []
+
+    async def main() -> None:
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        try:
+            await Runner().execute_async(script)
+        except NameError:
+            pass  # dropping the traceback, and with it the frame holding the downloads
+        else:
+            raise AssertionError('RESIZE should have failed')
+        gc.collect()
+
+    asyncio.run(main())
+    assert errors == []
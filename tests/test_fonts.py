@@ -0,0 +1,36 @@
+import pytest
+from PIL import ImageFont
+
+from fstop import Runner
+from fstop.fonts import fonts
+
+@pytest.fixture
+def font(tmp_path):
+    """Pillow's built in FreeType font, saved as a file ``FONT`` can load."""
+    path = tmp_path / 'font.ttf'
+    path.write_bytes(ImageFont.load_default(10).font_bytes)
+    fonts.clear()
+    yield str(path)
+    fonts.clear()
+
+def test_font_statements_reuse_the_loaded_font(font):
+    script = f'NEW "L" (64, 32) AS img\nTEXT img "fstop" (2, 2) FONT ("{font}", 14) COLOR 255'
+    images = []
+    for _ in range(2):
+        runner = Runner()
+        runner.execute(script)
+        images.append(runner.context.env['img'].image)
+    assert images[0].getbbox() is not None
+    assert images[0].tobytes() == images[1].tobytes()
+    assert fonts.stats()['entries'] == 1
+    assert fonts.stats()['misses'] == 1 and fonts.stats()['hits'] == 1
+    assert fonts.get(font, 14) is fonts.get(font, 14)
+
+def test_preload_fills_the_cache(font):
+    loaded = Runner(preload_fonts=[font, (font, 14), (font, 20, 0)])
+    assert fonts.stats()['entries'] == 3
+    assert loaded.options['preload_fonts'] == (font, (font, 14), (font, 20, 0))
+
+    before = fonts.stats()['misses']
+    Runner().execute(f'NEW "L" (64, 32) AS img\nTEXT img "fstop" (2, 2) FONT ("{font}", 14)')
+    assert fonts.stats()['misses'] == before
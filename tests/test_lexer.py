@@ -0,0 +1,47 @@
+import os
+import random
+
+from fstop.lexer import generator, KeywordLexer
+
+from .stress import ASSET
+
+def tokens(lexer, source: str) -> list:
+    return [
+        (token.gettokentype(), token.getstr(), token.getsourcepos().idx, token.getsourcepos().lineno, token.getsourcepos().colno)
+        for token in lexer.lex(source)
+    ]
+
+def generated(seed: int, length: int = 2000) -> str:
+    rng = random.Random(seed)
+    rply = generator.build()
+    # not the keywords rply splits, as it does with COLORIZE (COLOR + IZE)
+    keywords = sorted(word for word in KeywordLexer(generator).keywords if len(list(rply.lex(word))) == 1)
+    words = [
+        lambda: rng.choice(keywords),
+        lambda: rng.choice(['img', 'bg', 'frames', '_tmp2', 'x']),
+        lambda: str(rng.randint(-500, 500)),
+        lambda: '%.3f' % rng.uniform(-10, 10),
+        lambda: rng.choice(['"./assets/test.png"', "'RGB'", '"a \\" quote"']),
+        lambda: rng.choice(', ( ) [ ] + - * / ^ |'.split()),
+        lambda: rng.choice(['// a comment\n', '/* a\nlonger one */']),
+    ]
+    return ''.join(rng.choice(words)() + rng.choice([' ', ' ', '\n', '\t', '  ']) for _ in range(length))
+
+def test_matches_rply_on_the_sample_script():
+    with open(os.path.join(os.path.dirname(ASSET), '..', 'test.ft')) as f:
+        source = f.read()
+    assert tokens(KeywordLexer(generator), source) == tokens(generator.build(), source)
+
+def test_matches_rply_on_generated_scripts():
+    for seed in range(5):
+        source = generated(seed)
+        assert tokens(KeywordLexer(generator), source) == tokens(generator.build(), source)
+
+def test_identifiers_starting_with_a_keyword_stay_variables():
+    source = 'NEW "RGB" (4, 4) AS TOTAL\nINVERT OPENED\nECHO NOTE\nCOLORIZE TOTAL'
+    kinds = [kind for kind, *_ in tokens(KeywordLexer(generator), source)]
+    assert kinds == [
+        'NEW', 'STRING', 'LEFT_PAREN', 'INTEGER', 'COMMA', 'INTEGER', 'RIGHT_PAREN', 'AS', 'VARIABLE',
+        'INVERT', 'VARIABLE', 'ECHO', 'VARIABLE', 'COLORIZE', 'VARIABLE',
+    ]
+    assert [kind for kind, *_ in tokens(generator.build(), 'TOTAL')] == ['TO', 'VARIABLE']  # why rply is not the default
@@ -0,0 +1,22 @@
+import pytest
+
+from fstop import Runner
+from fstop.limits import Limits
+
+RGB = 'NEW "RGB" (100, 100) COLOR (10, 20, 30) AS a\n'  # 40000 bytes of pixels
+GRAY = 'NEW "L" (100, 100) COLOR 100 AS r\nNEW "L" (100, 100) COLOR 150 AS g\nNEW "L" (100, 100) COLOR 200 AS b\n'
+
+@pytest.mark.parametrize('script, max_bytes', [
+    (RGB + 'CLONE a AS b', 60000),
+    (RGB + 'BLEND a, a ALPHA 0.5 AS b', 60000),
+    (GRAY + 'MERGE "RGB" [r, g, b] AS c', 50000),
+    (GRAY + 'CONVERT r "RGB"', 50000),
+    (RGB + 'a INRANGE (0, 0, 0), (50, 50, 50) AS b', 45000),
+    (RGB + 'a AND a AS b', 60000),
+    (RGB + 'a OR a AS b', 60000),
+    (RGB + 'a XOR a AS b', 60000),
+])
+def test_statements_reserve_their_output(script, max_bytes):
+    Runner().execute(script)  # fine without limits
+    with pytest.raises(MemoryError):
+        Runner(limits=Limits(max_bytes=max_bytes)).execute(script)
@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import os
+
+import pytest
+
+from fstop import Runner, registry
+
+SCRIPT = 'NEW "RGB" (64, 32) COLOR (0, 0, 255) AS img\nINVERT img\nSAVE img STREAM "PNG"'
+
+@pytest.fixture
+def enabled():
+    registry.clear()
+    yield registry
+    registry.enable(False)
+    registry.clear()
+
+def test_concurrent_dumps_to_a_path(tmp_path, enabled):
+    path = str(tmp_path / 'fstop.prom')
+    runner = Runner(metrics=path, metrics_interval=3600)
+
+    def work(_: int) -> None:
+        runner.execute(SCRIPT)
+        runner.dump_metrics()
+        runner.reset()
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(work, range(200)))
+    runner.close()
+
+    with open(path) as f:
+        text = f.read()
+    assert 'fstop_statement_seconds_count{statement="invert_op"} 200' in text
+    assert os.listdir(tmp_path) == ['fstop.prom']  # no temporary files left behind
+
+def test_failing_target_does_not_hide_script_errors(enabled):
+    def broken(text: str) -> None:
+        raise OSError('disk full')
+
+    runner = Runner(metrics=broken, metrics_interval=3600)
+    with pytest.raises(NameError):
+        runner.execute('INVERT missing')
+    with pytest.warns(RuntimeWarning, match='disk full'):
+        runner.close()
+
+def test_profiled_executions_are_recorded(enabled):
+    registry.enable()
+    runner = Runner()
+    runner.execute(SCRIPT, profile=True)
+    assert registry.latencies['invert_op'][0] == 1
+    assert runner.profile.spans
@@ -0,0 +1,50 @@
+import io
+import os
+
+from PIL import Image, ImageSequence
+
+from fstop import Runner
+from fstop.objects import FrameSequence, FrameSource
+
+def test_sequences_of_files_leave_no_file_open(tmp_path):
+    path = str(tmp_path / 'anim.gif')
+    frames = [Image.new('L', (16, 16), value) for value in (0, 128, 255)]
+    frames[0].save(path, save_all=True, append_images=frames[1:])
+
+    runner = Runner()
+    before = len(os.listdir('/proc/self/fd'))
+    runner.execute('OPEN "%s" AS img\nNEW SEQUENCE img AS seq\nCLOSE img' % path)
+    assert len(runner.context.env['seq']) == 3
+    assert [frame.convert('L').getpixel((0, 0)) for frame in runner.context.env['seq']] == [0, 128, 255]
+    assert len(os.listdir('/proc/self/fd')) == before
+
+def test_frame_operations_keep_order_and_durations(tmp_path):
+    path = str(tmp_path / 'anim.gif')
+    frames = [Image.new('L', (32, 32), value) for value in range(0, 250, 25)]
+    for i, frame in enumerate(frames):
+        frame.paste(255 - frame.getpixel((0, 0)), (i, i, i + 8, i + 8))
+    durations = [40 + 10 * i for i in range(len(frames))]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=durations, loop=0)
+
+    runner = Runner()
+    runner.execute('OPEN "%s" AS img\nNEW SEQUENCE img AS seq\nRESIZE seq (16, 16)\nROTATE seq 90' % path)
+    seq = runner.context.env['seq']
+
+    with Image.open(path) as original:
+        expected = [frame.copy().resize((16, 16)).rotate(90) for frame in ImageSequence.Iterator(original)]
+    assert len(seq) == len(expected)
+    assert [frame.tobytes() for frame in seq] == [frame.tobytes() for frame in expected]
+    assert [frame.info.get('duration') for frame in seq] == durations
+
+def test_sequences_of_unnamed_streams_copy_every_frame():
+    data = io.BytesIO()
+    frames = [Image.new('L', (16, 16), value) for value in (0, 128, 255)]
+    frames[0].save(data, 'GIF', save_all=True, append_images=frames[1:], duration=[30, 40, 50])
+    image = Image.open(io.BufferedReader(io.BytesIO(data.getvalue())))  # no file name to reopen
+    assert FrameSource.reopen(image) is None
+
+    image.seek(1)
+    seq = FrameSequence.of(image)
+    assert image.tell() == 1
+    assert [frame.convert('L').getpixel((0, 0)) for frame in seq] == [0, 128, 255]
+    assert [frame.info.get('duration') for frame in seq] == [30, 40, 50]
@@ -0,0 +1,62 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageChops, ImageStat
+
+from fstop import Runner
+from fstop.optimizer import DraftOpen, GeometryChain
+
+from .conftest import encode
+
+@pytest.fixture(scope='module')
+def sources():
+    image = Image.effect_mandelbrot((3000, 2000), (-2, -1.5, 1, 1.5), 100).convert('RGB')
+    return {format: encode(image, format) for format in ('JPEG', 'PNG')}
+
+def run(script: str, source: bytes, optimize: bool) -> Image.Image:
+    runner = Runner(optimize=optimize, draft=True)
+    runner.execute(script, streams=[BytesIO(source)])
+    return runner.context.env['img'].image
+
+@pytest.mark.parametrize('format', ['JPEG', 'PNG'])
+@pytest.mark.parametrize('statement', ['RESIZE img (300, 200)', 'SCALE img 0.1', 'REDUCE img 8'])
+def test_draft_decoding_within_tolerance(sources, format, statement):
+    script = 'OPEN STREAM 0 AS img\n' + statement
+    assert isinstance(Runner(draft=True).compile(script).statements[0], DraftOpen)
+
+    expected, output = (run(script, sources[format], optimize) for optimize in (False, True))
+    assert output.size == expected.size
+    diff = ImageChops.difference(output, expected)
+    assert max(high for _, high in diff.getextrema()) <= 8
+    assert max(ImageStat.Stat(diff).mean) < 0.5
+
+@pytest.mark.parametrize('between, fused', [
+    ('', True),
+    ('ECHO "loading"', True),
+    ('NEW "RGB" (8, 8) AS other', False),  # may fail after the resize already ran
+    ('OPEN STREAM 0 AS other', False),
+])
+def test_draft_decoding_only_fuses_adjacent_reducers(between, fused):
+    script = 'OPEN STREAM 0 AS img\n%s\nRESIZE img (300, 200)' % between
+    program = Runner(draft=True).compile(script)
+    assert isinstance(program.statements[0], DraftOpen) == fused
+
+def test_geometry_composition_is_opt_in():
+    script = 'NEW "RGB" (64, 48) COLOR (200, 10, 10) AS img\nROTATE img 30\nRESIZE img (32, 24)'
+    default, composed = Runner(), Runner(compose_geometry=True)
+    assert not any(isinstance(node, GeometryChain) for node in default.compile(script).statements)
+    assert any(isinstance(node, GeometryChain) for node in composed.compile(script).statements)
+
+    expected = Runner(optimize=False)
+    for runner in (expected, default):
+        runner.execute(script)
+    assert default.context.env['img'].image.tobytes() == expected.context.env['img'].image.tobytes()
+
+def test_draft_decoding_is_opt_in(sources):
+    script = 'OPEN STREAM 0 AS img\nRESIZE img (300, 200)'
+    assert not isinstance(Runner().compile(script).statements[0], DraftOpen)
+
+    runner = Runner()
+    runner.execute(script, streams=[BytesIO(sources['JPEG'])])
+    expected = run(script, sources['JPEG'], optimize=False)
+    assert runner.context.env['img'].image.tobytes() == expected.tobytes()
@@ -0,0 +1,53 @@
+from array import array
+
+from fstop import Runner
+from fstop.parser import COMPACT_LENGTH
+
+def outline(step: float, size: int = 512) -> list:
+    """The square (8, 8)..(8 + size, 8 + size), traced in ``step`` sized moves."""
+    count = int(size / step)
+    edges = [
+        [(8 + i * step, 8) for i in range(count)],
+        [(8 + size, 8 + i * step) for i in range(count)],
+        [(8 + size - i * step, 8 + size) for i in range(count)],
+        [(8, 8 + size - i * step) for i in range(count)],
+    ]
+    return [value for edge in edges for point in edge for value in point]
+
+def literal(values: list) -> str:
+    return '(' + ', '.join(str(value) for value in values) + ')'
+
+def polygon(xy: str) -> str:
+    return f'NEW "L" (528, 528) AS img\nPOLYGON img {xy} COLOR 255'
+
+def parsed(script: str):
+    return Runner(optimize=False).compile(script).statements[-1].args[2]
+
+def test_long_literals_are_compacted():
+    values = outline(0.5)
+    assert len(values) > COMPACT_LENGTH
+    xy = parsed(polygon(literal(values)))
+    assert isinstance(xy, array) and xy.typecode == 'f'
+    assert xy.tolist() == values
+
+    half = len(values) // 2
+    xy = parsed(polygon(literal(values[:half]) + ' + ' + literal(values[half:])))
+    assert isinstance(xy, array) and xy.tolist() == values
+
+    assert isinstance(parsed(polygon(literal(outline(128)))), tuple)
+
+def test_inexact_literals_stay_tuples():
+    values = outline(0.5)
+    values[1] = 8.1  # no exact 32 bit float
+    xy = parsed(polygon(literal(values)))
+    assert isinstance(xy, tuple) and list(xy) == values
+
+def test_compacted_polygons_draw_the_same():
+    images = []
+    for values in (outline(128), outline(0.5)):
+        runner = Runner()
+        runner.execute(polygon(literal(values)))
+        images.append(runner.context.env['img'].image)
+    small, large = images
+    assert small.getbbox() == (8, 8, 521, 521)
+    assert large.tobytes() == small.tobytes()
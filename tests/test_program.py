@@ -0,0 +1,36 @@
+from PIL import Image
+
+from fstop import Runner
+
+def test_shared_images_survive_release():
+    script = (
+        'NEW "RGB" (8, 8) COLOR (255, 0, 0) AS a\n'
+        'NEW "RGB" (8, 8) COLOR (0, 0, 255) AS b\n'
+        'NEW [a, b] AS frames\n'
+        'RESIZE b (4, 4)\n'
+        'SAVE frames STREAM "GIF"'
+    )
+    runner = Runner(release=True)
+    assert runner.compile(script).shared == {'a', 'b', 'frames'}
+    runner.execute(script)
+    assert len(runner.streams) == 1
+
+def test_dead_images_are_closed(monkeypatch):
+    closed = []
+    close = Image.Image.close
+    monkeypatch.setattr(Image.Image, 'close', lambda image: (closed.append(image.size), close(image)))
+
+    script = 'NEW "RGB" (8, 8) AS a\nINVERT a\nNEW "L" (2, 2) AS b\nSAVE b STREAM "PNG"'
+    runner = Runner(release=True)
+    assert not runner.compile(script).shared
+    runner.execute(script)
+    assert 'a' not in runner.context.env
+    assert closed == [(8, 8)]
+
+def test_variables_of_earlier_runs_are_not_closed():
+    runner = Runner(release=True)
+    runner.execute('NEW "RGB" (8, 8) COLOR (0, 255, 0) AS a\nNEW [a] AS frames')
+    script = 'ECHO SIZE a\nNEW "L" (2, 2) AS b\nSAVE frames STREAM "GIF"'
+    assert 'a' in runner.compile(script).shared
+    runner.execute(script)
+    assert runner.context.env['frames'][0].getpixel((0, 0)) == (0, 255, 0)
@@ -0,0 +1,20 @@
+from fstop import Runner
+
+SCRIPT = 'OPEN STREAM 0 AS img\nINVERT img\nSAVE img STREAM "PNG"'
+
+def test_map_reuses_its_pool_for_the_same_worker_count():
+    runner = Runner()
+    runner.execute('NEW "RGB" (16, 16) COLOR (10, 20, 30) AS img\nSAVE img STREAM "PNG"')
+    source = runner.streams[0].getvalue()
+    try:
+        results = list(runner.map(SCRIPT, [source] * 5, workers=2))
+        pool = runner._pool
+        assert [result.index for result in results] == list(range(5))
+        assert all(result.error is None and len(result.streams) == 1 for result in results)
+
+        list(runner.map(SCRIPT, [source], workers=2))
+        assert runner._pool is pool
+        list(runner.map(SCRIPT, [source], workers=1))
+        assert runner._pool is not pool
+    finally:
+        runner.close()
@@ -0,0 +1,4 @@
+from .stress import main
+
+def test_concurrent_executions_match_serial():
+    main(executions=40, threads=4)